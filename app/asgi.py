@@ -0,0 +1,338 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""ASGI application for serving the cross-reference graph.
+
+Serves the explorer routes (/, /elements, /table, /tree, and /static) with
+async handlers, along with /metrics and /_ah/warmup. The static data, response
+caches, and metrics are shared with the Flask app in main.py, which still
+serves every other route.
+
+Run it from this directory with any ASGI server, e.g.:
+
+    uvicorn asgi:app --host 127.0.0.1 --port 8080
+
+Rendering is CPU-bound, so the (cached) renderers and static file reads run in
+a thread pool and the event loop only handles connections; a single worker
+holds many more concurrent requests than a thread per request allows. Response
+bodies are rendered (and cached) in full before they are sent; they are handed
+to the server in chunks of at most CHUNK_SIZE bytes rather than as a single
+message.
+"""
+import asyncio
+import dataclasses
+import functools
+import json
+import mimetypes
+import time
+import urllib.parse
+from typing import Any, Awaitable, Callable, Optional
+
+import flask
+from werkzeug.exceptions import HTTPException
+from werkzeug.security import safe_join
+
+import main
+
+# Size of each response body message sent to the server.
+CHUNK_SIZE = 64 * 1024
+
+# Route pattern for static files; matches the Flask route so metrics are comparable.
+STATIC_ROUTE = "/static/<path:filename>"
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+class HTTPError(Exception):
+    """Error that is reported to the client with an HTTP status code."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclasses.dataclass
+class Response:
+    """An HTTP response.
+
+    Attributes:
+        status: Status code.
+        body: Response body.
+        headers: Dict of response headers (other than Content-Length).
+    """
+
+    status: int
+    body: bytes = b""
+    headers: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+class Request:  # pylint: disable=too-few-public-methods
+    """An HTTP request.
+
+    Attributes:
+        method: Request method.
+        path: Request path.
+        headers: Dict of request headers, with lowercase names.
+        args: Dict of query string parameters (the first value for each name).
+        body: Request body.
+        data: Request parameters, once parsed by `get_data`.
+    """
+
+    def __init__(self, scope: Scope, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+        query = urllib.parse.parse_qs(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+        self.args = {key: values[0] for key, values in query.items()}
+        self.body = body
+        self.data: Optional[dict[str, Any]] = None
+
+    def get_data(self) -> dict[str, Any]:
+        """Fetches request parameters from the JSON body (POST) or the query string (GET); see main.get_request_data."""
+        if self.data is not None:
+            return self.data
+        if self.method == "POST":
+            try:
+                data = json.loads(self.body)
+            except ValueError as error:
+                raise HTTPError(400, f"invalid JSON: {error}") from error
+            if not isinstance(data, dict):
+                raise HTTPError(400, "expected a JSON object")
+        else:
+            data = dict(self.args)
+            for key in main.BOOLEAN_PARAMS & data.keys():
+                data[key] = data[key].lower() == "true"
+        self.data = data
+        return data
+
+
+def get_encodings(header: str) -> dict[str, float]:
+    """Parses an Accept-Encoding header into a dict mapping content codings to quality values."""
+    encodings = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding.strip():
+            encodings[coding.strip().lower()] = quality
+    return encodings
+
+
+def choose_encoding(header: str) -> str:
+    """Chooses the content coding with the highest quality for an Accept-Encoding header; see main.send_payload.
+
+    Ties are broken in the order of main.ETAG_SUFFIXES, and "*" covers codings that are not listed.
+    """
+    encodings = get_encodings(header)
+    best, best_quality = "identity", 0.0
+    for encoding in main.ETAG_SUFFIXES:
+        quality = encodings.get(encoding, encodings.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def send_payload(request: Request, payload: main.Payload) -> Response:
+    """Sends a payload with content negotiation and conditional GET support; see main.send_payload."""
+    encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    headers = {
+        "etag": f'"{payload.etag}{main.ETAG_SUFFIXES[encoding]}"',
+        "vary": "Accept-Encoding",
+        "cache-control": "no-cache",
+    }
+    if request.method in {"GET", "HEAD"} and main.etag_matches(request.headers.get("if-none-match", ""), payload.etag):
+        return Response(304, headers=headers)
+    headers["content-type"] = "application/json"
+    if encoding != "identity":
+        headers["content-encoding"] = encoding
+    return Response(200, getattr(payload, encoding), headers)
+
+
+async def get_elements(request: Request) -> Response:
+    """Fetches the neighborhood around a verse."""
+    data = request.get_data()
+    verse = main.get_verse(data) if "verse" in data else None
+    if verse not in main.CONNECTIONS:
+        raise HTTPError(404, f"unknown verse: {verse}")
+    try:
+        payload = await asyncio.to_thread(main.get_elements_payload, data)
+    except (AttributeError, KeyError, TypeError, ValueError) as error:
+        raise HTTPError(400, f"missing or invalid parameter: {error}") from error
+    return send_payload(request, payload)
+
+
+async def get_table(request: Request) -> Response:
+    """Builds a cross-reference table for the given verse."""
+    if request.method == "POST":
+        verse = request.body.decode("utf-8")
+    elif "verse" in request.args:
+        verse = request.args["verse"]
+    else:
+        raise HTTPError(400, "missing parameter: verse")
+    if verse not in main.CONNECTIONS:
+        raise HTTPError(404, f"unknown verse: {verse}")
+    return send_payload(request, await asyncio.to_thread(main.get_table_payload, verse))
+
+
+async def get_tree(request: Request) -> Response:
+    """Fetches the navigation tree for the sidebar."""
+    return send_payload(request, main.TREE)
+
+
+@functools.lru_cache(maxsize=1)
+def render_root() -> bytes:
+    """Renders the main graph exploration page."""
+    with main.app.test_request_context("/"):
+        return flask.render_template("index.html", static_export_url=main.STATIC_EXPORT_URL).encode("utf-8")
+
+
+async def root(request: Request) -> Response:
+    """Shows the main graph exploration page."""
+    del request  # Unused.
+    return Response(200, await asyncio.to_thread(render_root), {"content-type": "text/html; charset=utf-8"})
+
+
+def read_file(filename: str) -> bytes:
+    """Reads a file."""
+    with open(filename, "rb") as f:
+        return f.read()
+
+
+async def get_static(request: Request) -> Response:
+    """Serves a static file without blocking the event loop."""
+    filename = safe_join(main.app.static_folder, request.path[len("/static/") :])
+    if filename is None:
+        raise HTTPError(404, "not found")
+    try:
+        body = await asyncio.to_thread(read_file, filename)
+    except (FileNotFoundError, IsADirectoryError) as error:
+        raise HTTPError(404, "not found") from error
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    return Response(200, body, {"content-type": content_type})
+
+
+async def get_metrics(request: Request) -> Response:
+    """Reports request and startup metrics in the Prometheus text format."""
+    del request  # Unused.
+    return Response(200, main.METRICS.render().encode("utf-8"), {"content-type": main.metrics_lib.CONTENT_TYPE})
+
+
+async def warmup(request: Request) -> Response:
+    """Handle warmup requests from App Engine by pre-rendering the hot set (see main.warm_up)."""
+    del request  # Unused.
+    summary = await asyncio.to_thread(main.warm_up, main.WARMUP_BUDGET)
+    return Response(200, json.dumps(summary).encode("utf-8"), {"content-type": "application/json"})
+
+
+# Dict mapping routes to handlers and allowed methods.
+ROUTES = {
+    "/": (root, {"GET", "HEAD"}),
+    "/elements": (get_elements, {"GET", "HEAD", "POST"}),
+    "/table": (get_table, {"GET", "HEAD", "POST"}),
+    "/tree": (get_tree, {"GET", "HEAD"}),
+    "/metrics": (get_metrics, {"GET", "HEAD"}),
+    "/_ah/warmup": (warmup, {"GET", "HEAD"}),
+    STATIC_ROUTE: (get_static, {"GET", "HEAD"}),
+}
+
+
+def get_route(path: str) -> Optional[str]:
+    """Returns the route pattern for a request path, or None if there is no matching route."""
+    if path.startswith("/static/"):
+        return STATIC_ROUTE
+    if path in ROUTES:
+        return path
+    return None
+
+
+async def read_body(receive: Receive) -> Optional[bytes]:
+    """Reads the request body; returns None if the client disconnects."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def send_response(send: Send, response: Response, include_body: bool = True) -> None:
+    """Sends a response, writing the body in chunks of at most CHUNK_SIZE bytes."""
+    headers = [(b"content-length", str(len(response.body)).encode("latin-1"))]
+    headers.extend((name.encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items())
+    await send({"type": "http.response.start", "status": response.status, "headers": headers})
+    body = memoryview(response.body) if include_body else memoryview(b"")
+    for start in range(0, len(body), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        await send({"type": "http.response.body", "body": bytes(body[start:end]), "more_body": end < len(body)})
+    if not body:
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def handle_lifespan(receive: Receive, send: Send) -> None:
+    """Handles lifespan events; the static data is already loaded when this module is imported."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope: Scope, receive: Receive, send: Send) -> None:
+    """ASGI entry point."""
+    if scope["type"] == "lifespan":
+        await handle_lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        raise ValueError(f"unsupported scope type: {scope['type']}")
+    start = time.perf_counter()
+    body = await read_body(receive)
+    if body is None:
+        return
+    request = Request(scope, body)
+    route = get_route(request.path)
+    try:
+        if route is None:
+            raise HTTPError(404, "not found")
+        handler, methods = ROUTES[route]
+        if request.method not in methods:
+            raise HTTPError(405, "method not allowed")
+        response = await handler(request)
+    except HTTPError as error:
+        response = Response(error.status, str(error).encode("utf-8"), {"content-type": "text/plain; charset=utf-8"})
+    except HTTPException as error:  # Raised by flask.abort in helpers shared with main.py.
+        response = Response(
+            error.code, error.description.encode("utf-8"), {"content-type": "text/plain; charset=utf-8"}
+        )
+    await send_response(send, response, include_body=request.method != "HEAD")
+    if route != "/metrics":
+        record_metrics(request, route or "unmatched", response, time.perf_counter() - start)
+
+
+def record_metrics(request: Request, route: str, response: Response, seconds: float) -> None:
+    """Records request metrics; see main.record_metrics."""
+    data = request.data if request.data is not None else request.args
+    labels = (route, *main.get_filter_labels(data))
+    main.REQUEST_LATENCY.observe(seconds, *labels)
+    main.REQUESTS.inc(route, str(response.status))
+    main.RESPONSE_SIZE.observe(len(response.body), *labels)
@@ -0,0 +1,172 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the ASGI application (app/asgi.py)."""
+import asyncio
+import gzip
+import json
+import os
+import urllib.parse
+
+import pytest
+
+from scripture_graph import benchmark_lib
+
+# NOTE(kearnes): Flask is only installed with the app requirements (app/requirements.txt).
+pytest.importorskip("flask")
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(name="asgi", scope="module")
+def asgi_fixture(main):
+    """ASGI module for the app module loaded by the main fixture (see conftest.py)."""
+    assert main is not None
+    return benchmark_lib.load_asgi_app(APP_DIR)
+
+
+@pytest.fixture(name="verse", scope="module")
+def verse_fixture(asgi):
+    """Verse with more ranked neighbors than a single-node page."""
+    return next(verse for verse, data in asgi.main.CONNECTIONS.items() if len(data.get("ranked", [])) > 2)
+
+
+def _request(asgi, method, path, query=None, headers=None, body=b""):  # pylint: disable=too-many-arguments
+    """Sends a request to the ASGI application.
+
+    Returns:
+        Status code, dict of response headers, response body, and the number of body messages.
+    """
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "method": method,
+        "path": path,
+        "query_string": urllib.parse.urlencode(query or {}).encode("latin-1"),
+        "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in (headers or {}).items()],
+    }
+    messages = []
+
+    async def _receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def _send(message):
+        messages.append(message)
+
+    asyncio.run(asgi.app(scope, _receive, _send))
+    response_headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in messages[0]["headers"]}
+    response_body = b"".join(message.get("body", b"") for message in messages[1:])
+    return messages[0]["status"], response_headers, response_body, len(messages) - 1
+
+
+def _elements_query(verse, **kwargs):
+    return {"verse": verse, "filter_mode": "all", "include_suggested": "true", "max_nodes": "2", **kwargs}
+
+
+def test_elements(asgi, verse):
+    status, headers, body, _ = _request(
+        asgi, "GET", "/elements", _elements_query(verse), headers={"Accept-Encoding": "gzip, br;q=0"}
+    )
+    assert status == 200
+    assert headers["content-encoding"] == "gzip"
+    assert headers["etag"].endswith('-gz"')
+    assert int(headers["content-length"]) == len(body)
+    elements = json.loads(gzip.decompress(body))
+    assert elements["nodes"][0]["data"]["id"] == verse
+    assert elements["cursor"] == 2
+    # POST requests take the same parameters in a JSON body.
+    data = _elements_query(verse, include_suggested=True, max_nodes=2)
+    status, headers, post_body, _ = _request(asgi, "POST", "/elements", body=json.dumps(data).encode("utf-8"))
+    assert status == 200
+    assert "content-encoding" not in headers
+    assert json.loads(post_body) == elements
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        ("", "identity"),
+        ("gzip, br", "br"),
+        ("br;q=0.1, gzip", "gzip"),
+        ("br;q=0, *", "gzip"),
+        ("*;q=0.5, identity", "identity"),
+        ("deflate", "identity"),
+    ],
+)
+def test_choose_encoding(asgi, header, expected):
+    assert asgi.choose_encoding(header) == expected
+
+
+def test_not_modified(asgi, verse):
+    query = _elements_query(verse)
+    _, headers, _, _ = _request(asgi, "GET", "/elements", query, headers={"Accept-Encoding": "br"})
+    # Any representation's entity tag validates the payload.
+    status, headers, body, _ = _request(
+        asgi, "GET", "/elements", query, headers={"Accept-Encoding": "gzip", "If-None-Match": headers["etag"]}
+    )
+    assert status == 304
+    assert headers["etag"].endswith('-gz"')
+    assert not body
+    status, _, _, _ = _request(asgi, "GET", "/elements", query, headers={"If-None-Match": '"stale"'})
+    assert status == 200
+
+
+def test_head(asgi, verse):
+    _, get_headers, get_body, _ = _request(asgi, "GET", "/table", {"verse": verse})
+    status, headers, body, _ = _request(asgi, "HEAD", "/table", {"verse": verse})
+    assert status == 200
+    assert int(headers["content-length"]) == len(get_body) > 0
+    assert headers["etag"] == get_headers["etag"]
+    assert not body
+
+
+def test_chunks(asgi, verse, monkeypatch):
+    monkeypatch.setattr(asgi, "CHUNK_SIZE", 100)
+    _, _, body, num_messages = _request(asgi, "GET", "/elements", _elements_query(verse, max_nodes="20"))
+    assert num_messages == -(-len(body) // 100) > 1
+    assert json.loads(body)["nodes"][0]["data"]["id"] == verse
+
+
+@pytest.mark.parametrize(
+    "method,path,expected",
+    [
+        ("POST", "/tree", 405),
+        ("DELETE", "/elements", 405),
+        ("GET", "/missing", 404),
+        ("GET", "/static/js/script.js", 200),
+        ("GET", "/static/missing.js", 404),
+        ("GET", "/static/js", 404),
+        ("GET", "/static/../main.py", 404),
+        ("GET", "/static/js/../../main.py", 404),
+    ],
+)
+def test_routes(asgi, method, path, expected):
+    status, _, _, _ = _request(asgi, method, path)
+    assert status == expected
+
+
+@pytest.mark.parametrize(
+    "kwargs,expected",
+    [
+        ({"cursor": "999"}, 400),
+        ({"cursor": "-1"}, 400),
+        ({"max_nodes": "0"}, 400),
+        ({"max_nodes": "abc"}, 400),
+        ({"filter_mode": "sideways"}, 400),
+        ({"verse": "Moroni 99:1"}, 404),
+    ],
+)
+def test_elements_invalid(asgi, verse, kwargs, expected):
+    status, _, body, _ = _request(asgi, "GET", "/elements", {**_elements_query(verse), **kwargs})
+    assert status == expected
+    assert body
@@ -0,0 +1,38 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Shared fixtures for the app tests."""
+import os
+
+import pytest
+
+from scripture_graph import benchmark_lib
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(name="data_dir", scope="session")
+def data_dir_fixture(tmp_path_factory):
+    """Directory containing app data built from a small synthetic corpus (see benchmark_lib.BenchmarkContext)."""
+    context = benchmark_lib.BenchmarkContext(
+        tmp_path_factory.mktemp("app").as_posix(), scale=0.01, seed=0, max_verses=50, app_dir=APP_DIR
+    )
+    context.run_build_connections()
+    return os.path.join(context.workdir, "app")
+
+
+@pytest.fixture(name="main", scope="session")
+def main_fixture(data_dir):
+    """App module (app/main.py) loaded with the synthetic data."""
+    pytest.importorskip("flask")
+    return benchmark_lib.load_app(APP_DIR, data_dir)
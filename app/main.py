@@ -12,233 +12,1055 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Flask application for serving the cross-reference graph."""
-import enum
-import itertools
+import dataclasses
+import functools
+import hashlib
 import json
 import logging
-from typing import Union
-from urllib import parse
+import math
+import os
+import time
+from typing import Any, Callable, Mapping, Optional, TypeVar
 
 import flask
 from markupsafe import escape
+from werkzeug.exceptions import HTTPException
 
-import scripture_graph
+from scripture_graph import explorer_lib
+from scripture_graph import graph_lib
+from scripture_graph import layout_lib
+from scripture_graph import metrics_lib
+from scripture_graph import search_lib
+from scripture_graph.explorer_lib import FilterMode
 
 app = flask.Flask(__name__)
 logging.basicConfig(level=logging.INFO)
 
-Elements = dict[str, list[dict[str, dict[str, str]]]]
+# pylint: disable=too-many-lines
 
-URL_BASE = "https://www.churchofjesuschrist.org/study/scriptures/"
+# Static data files produced by app/setup.sh.
+CONNECTIONS_FILENAME = "data/connections.json"
+TREE_FILENAME = "data/tree.json"
+INDEX_FILENAME = "data/index.npz"
+ROLLUPS_FILENAME = "data/rollups.json"
+SEARCH_INDEX_FILENAME = "data/search.npz"
+TOPIC_INDEX_FILENAME = "data/topics.npz"
+HOT_SET_FILENAME = "data/hot.json"  # Optional; see hotset_lib.
+LAYOUTS_FILENAME = "data/layouts.npz"  # Optional; see layout_lib.
 
-BOOK_ORDER = dict(
-    zip(
-        itertools.chain(
-            scripture_graph.VOLUMES["Old Testament"],
-            scripture_graph.VOLUMES["New Testament"],
-            scripture_graph.VOLUMES["Book of Mormon"],
-            scripture_graph.VOLUMES["Doctrine and Covenants"],
-            scripture_graph.VOLUMES["Pearl of Great Price"],
-        ),
-        range(len(scripture_graph.BOOKS_SHORT)),
+# Base URL for a static export of all responses (see build_connections.py --export_static). When set, the
+# client fetches responses from the export and uses this app as a fallback.
+STATIC_EXPORT_URL = os.environ.get("STATIC_EXPORT_URL", "")
+
+# Maximum number of rendered responses to keep in memory for each endpoint.
+CACHE_SIZE = int(os.environ.get("CACHE_SIZE", 4096))
+
+# Time budget for pre-rendering the hot set during warmup, in seconds. App Engine allows warmup requests to run
+# for the same deadline as other requests, so this should stay well below it.
+WARMUP_BUDGET = float(os.environ.get("WARMUP_BUDGET", 20))
+
+# Maximum number of verses in a single /elements/batch request.
+MAX_BATCH_SIZE = 500
+
+# Limits for /neighborhood requests.
+MAX_HOPS = 3
+MAX_NEIGHBORHOOD_NODES = 500
+
+# Maximum number of paths in a single /path request.
+MAX_PATHS = 10
+
+# Limits for /related requests. The residual tolerance bounds the work done for each request.
+MAX_RELATED = 50
+MIN_EPSILON = 1e-6
+
+# Maximum number of results in a single /search response.
+MAX_SEARCH_RESULTS = 100
+
+# Maximum number of results in a single /topic or /topics/related response.
+MAX_TOPIC_VERSES = 500
+MAX_RELATED_TOPICS = 50
+
+# Maximum number of results in a single /autocomplete response.
+MAX_COMPLETIONS = 50
+
+# Query string parameters that are parsed as booleans ("true" or "false").
+BOOLEAN_PARAMS = {"include_suggested", "directed", "exclude_neighbors"}
+
+# Compression settings for responses that are compressed on demand.
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Entity tag suffixes for each content coding. Strong validators must differ between representations that are not
+# byte-identical, so each compressed variant of a payload gets its own tag.
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz", "identity": ""}
+
+# Request metrics, exposed at /metrics. Requests are labeled by route pattern (not path) and by the filter mode
+# and suggested-edge setting, when given, so the number of label sets stays small.
+METRICS = metrics_lib.Registry()
+REQUEST_LABELS = ("route", "filter_mode", "include_suggested")
+REQUESTS = METRICS.add(
+    metrics_lib.Counter("explorer_requests_total", "Requests by route and status code.", ("route", "status"))
+)
+REQUEST_LATENCY = METRICS.add(
+    metrics_lib.Histogram(
+        "explorer_request_duration_seconds", "Request latency.", REQUEST_LABELS, metrics_lib.LATENCY_BUCKETS
+    )
+)
+RESPONSE_SIZE = METRICS.add(
+    metrics_lib.Histogram(
+        "explorer_response_size_bytes", "Response body size (as sent).", REQUEST_LABELS, metrics_lib.SIZE_BUCKETS
     )
 )
+STARTUP_SECONDS = METRICS.add(
+    metrics_lib.Gauge("explorer_startup_seconds", "Time spent loading static data at startup.", ("data",))
+)
+FILTER_MODES = frozenset(mode.name.lower() for mode in FilterMode)
 
+T = TypeVar("T")
 
-class FilterMode(enum.Enum):
-    """Edge filter mode."""
 
-    ALL = enum.auto()
-    INCOMING = enum.auto()
-    OUTGOING = enum.auto()
+def load_connections() -> explorer_lib.Connections:
+    """Loads the static set of connections."""
+    with open(CONNECTIONS_FILENAME) as f:
+        return json.load(f)
 
 
-def load_connections() -> dict[str, dict[str, Union[int, str, list[str]]]]:
-    """Loads the static set of connections."""
-    with open("data/connections.json") as f:
+@functools.lru_cache(maxsize=1)
+def load_rollups() -> dict[str, dict]:
+    """Loads the rollup graphs on first use."""
+    with open(ROLLUPS_FILENAME) as f:
+        return json.load(f)
+
+
+@functools.lru_cache(maxsize=1)
+def load_search_index() -> search_lib.SearchIndex:
+    """Loads the full-text search index on first use."""
+    return search_lib.SearchIndex.load(SEARCH_INDEX_FILENAME)
+
+
+@functools.lru_cache(maxsize=1)
+def load_topic_index() -> graph_lib.TopicIndex:
+    """Loads the verse x topic index on first use."""
+    return graph_lib.TopicIndex.load(TOPIC_INDEX_FILENAME)
+
+
+def load_layouts() -> Optional[layout_lib.Layouts]:
+    """Loads the precomputed neighborhood layouts, if any; without them, the client lays out the graph itself."""
+    if not os.path.exists(LAYOUTS_FILENAME):
+        return None
+    return layout_lib.Layouts.load(LAYOUTS_FILENAME)
+
+
+def load_hot_set() -> dict[str, Any]:
+    """Loads the hot set of requests to pre-render during warmup; returns an empty hot set if there is none."""
+    if not os.path.exists(HOT_SET_FILENAME):
+        return {"elements": [], "table": []}
+    with open(HOT_SET_FILENAME) as f:
         return json.load(f)
 
 
-CONNECTIONS = load_connections()
+def get_build_id() -> str:
+    """Computes an identifier for the current set of static data files.
+
+    The build ID is part of every response cache key, so regenerating the data
+    files invalidates any previously rendered responses. It is derived from the
+    size and modification time of each file rather than its contents, so the
+    lazily loaded files are not read at startup; missing files are allowed.
+    """
+    digest = hashlib.sha256()
+    for filename in [
+        CONNECTIONS_FILENAME,
+        TREE_FILENAME,
+        INDEX_FILENAME,
+        ROLLUPS_FILENAME,
+        SEARCH_INDEX_FILENAME,
+        TOPIC_INDEX_FILENAME,
+        LAYOUTS_FILENAME,
+    ]:
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            digest.update(f"{filename}:missing\n".encode("utf-8"))
+            continue
+        digest.update(f"{filename}:{stat.st_size}:{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+@dataclasses.dataclass(frozen=True)
+class Payload:
+    """A cacheable JSON response body with precompressed variants.
+
+    Attributes:
+        etag: Strong entity tag derived from the build ID, without a content-coding suffix (see ETAG_SUFFIXES).
+        identity: Uncompressed response body.
+        gzip: Gzip-compressed response body.
+        br: Brotli-compressed response body.
+    """
+
+    etag: str
+    identity: bytes
+    gzip: bytes
+    br: bytes
+
+
+def make_payload(key: str, body: bytes) -> Payload:
+    """Precompresses a response body.
+
+    Args:
+        key: Unique key for this response within the current build.
+        body: Uncompressed response body.
+
+    Returns:
+        Payload.
+    """
+    compressed_gzip, compressed_br = explorer_lib.compress(body, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY)
+    return Payload(etag=_get_etag(key), identity=body, gzip=compressed_gzip, br=compressed_br)
+
+
+def load_payload(key: str, filename: str) -> Payload:
+    """Loads a static response body along with the compressed copies written by graph_lib.write_compressed."""
+    data = {}
+    for name, suffix in [("identity", ""), ("gzip", ".gz"), ("br", ".br")]:
+        with open(f"{filename}{suffix}", "rb") as f:
+            data[name] = f.read()
+    return Payload(etag=_get_etag(key), **data)
+
+
+def _get_etag(key: str) -> str:
+    """Creates a strong entity tag for a response in the current build."""
+    return f"{BUILD_ID}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}"
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """Returns whether an If-None-Match header matches the entity tag of a payload.
+
+    Tags are compared without their content-coding suffixes, so a validator for any representation of a payload
+    matches it.
+
+    Args:
+        header: If-None-Match header value.
+        etag: Payload entity tag (without a suffix).
 
+    Returns:
+        Whether the header matches.
+    """
+    if header.strip() == "*":
+        return True
+    for tag in header.split(","):
+        tag = tag.strip().removeprefix("W/").strip('"')
+        for suffix in ETAG_SUFFIXES.values():
+            if suffix and tag.endswith(suffix):
+                tag = tag[: -len(suffix)]
+                break
+        if tag == etag:
+            return True
+    return False
 
-def get_edges(verse: str) -> tuple[set[str], set[str], set[str]]:
-    """Fetches the incoming and outgoing edges for a verse."""
-    data = CONNECTIONS[verse]
-    incoming = data.get("incoming", [])
-    outgoing = data.get("outgoing", [])
-    suggested = data.get("suggested", [])
-    return set(incoming), set(outgoing), set(suggested)
 
+def send_payload(payload: Payload) -> flask.Response:
+    """Sends a payload with content negotiation and conditional GET support."""
+    request = flask.request
+    # NOTE(skearnes): Ties in quality are broken in favor of the smaller body.
+    encoding = request.accept_encodings.best_match(list(ETAG_SUFFIXES)) or "identity"
+    if request.method in {"GET", "HEAD"} and etag_matches(request.headers.get("If-None-Match", ""), payload.etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(getattr(payload, encoding), mimetype="application/json")
+        if encoding != "identity":
+            response.content_encoding = encoding
+    response.set_etag(f"{payload.etag}{ETAG_SUFFIXES[encoding]}")
+    response.vary.add("Accept-Encoding")
+    # NOTE(skearnes): Clients must revalidate so that new builds are picked up immediately; unchanged
+    # responses are cheap 304s.
+    response.cache_control.no_cache = True
+    return response
 
-@app.route("/elements", methods=["POST"])
-def get_elements() -> str:
+
+def get_request_data() -> dict[str, Any]:
+    """Fetches request parameters from the JSON body (POST) or the query string (GET)."""
+    if flask.request.method == "POST":
+        data = flask.request.get_json()
+        if not isinstance(data, dict):
+            flask.abort(400, "expected a JSON object")
+        return data
+    data = dict(flask.request.args)
+    for key in BOOLEAN_PARAMS & data.keys():
+        data[key] = data[key].lower() == "true"
+    return data
+
+
+def get_int(
+    data: dict[str, Any], key: str, default: Optional[int] = None, minimum: Optional[int] = None
+) -> Optional[int]:
+    """Fetches an optional integer parameter from the request data; values below `minimum` abort with 400."""
+    value = data.get(key)
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        flask.abort(400, f"invalid integer parameter: {key}")
+    if minimum is not None and value < minimum:
+        flask.abort(400, f"{key} must be at least {minimum}: {value}")
+    return value
+
+
+def get_float(data: dict[str, Any], key: str, default: float) -> float:
+    """Fetches an optional float parameter from the request data; non-finite values abort with 400."""
+    value = data.get(key)
+    if value is None:
+        return default
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        flask.abort(400, f"invalid float parameter: {key}")
+    if not math.isfinite(value):
+        flask.abort(400, f"{key} must be finite: {value}")
+    return value
+
+
+def get_bool(data: dict[str, Any], key: str) -> bool:
+    """Fetches a required boolean parameter from the request data (see BOOLEAN_PARAMS)."""
+    value = data.get(key)
+    if value is None:
+        flask.abort(400, f"missing parameter: {key}")
+    return bool(value)
+
+
+def get_filter_mode(data: dict[str, Any], default: Optional[str] = None) -> FilterMode:
+    """Fetches the (case-insensitive) filter mode parameter from the request data."""
+    value = data.get("filter_mode", default)
+    try:
+        return FilterMode[str(value).upper()]
+    except KeyError:
+        flask.abort(400, f"invalid filter_mode: {value}")
+
+
+def get_verse(data: dict[str, Any], key: str = "verse") -> str:
+    """Fetches an escaped verse parameter from the request data."""
+    if data.get(key) is None:
+        flask.abort(400, f"missing parameter: {key}")
+    return str(escape(data[key])).replace("D&amp;C", "D&C")
+
+
+def timed_load(name: str, function: Callable[..., T], *args) -> T:
+    """Calls a data loading function and reports its duration as a startup gauge."""
+    start = time.perf_counter()
+    result = function(*args)
+    STARTUP_SECONDS.set(time.perf_counter() - start, name)
+    return result
+
+
+def get_filter_labels(data: Mapping[str, Any]) -> tuple[str, str]:
+    """Returns the filter mode and suggested-edge metric labels for a set of request parameters.
+
+    Only requests with a filter mode are labeled by filter mode and suggested-edge setting; unrecognized filter
+    modes are reported as empty labels so that arbitrary input cannot create new label sets.
+    """
+    filter_mode = data.get("filter_mode")
+    if filter_mode is None:
+        return "", ""
+    filter_mode = str(filter_mode).lower()
+    if filter_mode not in FILTER_MODES:
+        filter_mode = ""
+    include_suggested = data.get("include_suggested")
+    if include_suggested is None:
+        return filter_mode, ""
+    return filter_mode, "true" if str(include_suggested).lower() == "true" else "false"
+
+
+def get_metric_labels() -> tuple[str, str, str]:
+    """Returns the metric labels for the current request (see get_filter_labels)."""
+    request = flask.request
+    rule = request.url_rule
+    route = rule.rule if rule is not None else "unmatched"
+    if request.method == "POST":
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            data = {}
+    else:
+        data = request.args
+    return (route, *get_filter_labels(data))
+
+
+@app.before_request
+def start_timer() -> None:
+    """Records the request start time."""
+    flask.g.start_time = time.perf_counter()
+
+
+@app.after_request
+def record_metrics(response: flask.Response) -> flask.Response:
+    """Records request metrics.
+
+    NOTE(skearnes): Latency is measured up to the point the response is returned, so streamed bodies (e.g.
+    static files) do not include the time to send them and have no size.
+    """
+    start = flask.g.pop("start_time", None)
+    if start is None:
+        return response
+    labels = get_metric_labels()
+    if labels[0] == "/metrics":
+        return response
+    REQUEST_LATENCY.observe(time.perf_counter() - start, *labels)
+    REQUESTS.inc(labels[0], str(response.status_code))
+    if not response.is_streamed:
+        RESPONSE_SIZE.observe(response.content_length or 0, *labels)
+    return response
+
+
+CONNECTIONS = timed_load("connections", load_connections)
+CHAPTERS = explorer_lib.get_chapters(CONNECTIONS)
+ADJACENCY = timed_load("index", graph_lib.Adjacency.load, INDEX_FILENAME)
+LAYOUTS = timed_load("layouts", load_layouts)
+REFERENCES = search_lib.ReferenceIndex((data["book"], data["chapter"], data["verse"]) for data in CONNECTIONS.values())
+BUILD_ID = timed_load("build_id", get_build_id)
+TREE = timed_load("tree", load_payload, "tree", TREE_FILENAME)
+
+
+@app.route("/elements", methods=["GET", "POST"])
+def get_elements() -> flask.Response:
     """Fetches the neighborhood around a verse."""
-    data = flask.request.get_json()
-    elements = _get_elements(
-        verse=str(escape(data["verse"])).replace("D&amp;C", "D&C"),
-        filter_mode=FilterMode[data["filter_mode"].upper()],
-        include_suggested=data["include_suggested"],
+    return send_payload(get_elements_payload(get_request_data()))
+
+
+def get_elements_payload(data: dict[str, Any]) -> Payload:
+    """Renders (or fetches from the cache) the neighborhood around a verse; see `_render_elements`.
+
+    Invalid parameters abort with 400, and unknown verses with 404.
+
+    Args:
+        data: Request parameters (see `get_request_data`).
+
+    Returns:
+        Payload.
+    """
+    verse = get_verse(data)
+    if verse not in CONNECTIONS:
+        flask.abort(404, f"unknown verse: {verse}")
+    try:
+        return _render_elements(
+            build_id=BUILD_ID,
+            verse=verse,
+            filter_mode=get_filter_mode(data),
+            include_suggested=get_bool(data, "include_suggested"),
+            max_nodes=get_int(data, "max_nodes"),
+            cursor=get_int(data, "cursor", 0),
+        )
+    except ValueError as error:  # Invalid max_nodes or cursor; see explorer_lib.get_ranked_edges.
+        flask.abort(400, str(error))
+
+
+@app.route("/elements/batch", methods=["GET", "POST"])
+def get_batch_elements() -> flask.Response:
+    """Fetches the merged neighborhood around a list of verses or a whole chapter.
+
+    Verses are given as a "verses" list (POST) or repeated "verse" parameters (GET);
+    alternatively, "chapter" selects every verse in a chapter (e.g. "Alma 32").
+    """
+    data = get_request_data()
+    if "chapter" in data:
+        chapter = get_verse(data, "chapter")
+        if chapter not in CHAPTERS:
+            flask.abort(404, f"unknown chapter: {chapter}")
+        verses = CHAPTERS[chapter]
+    else:
+        if flask.request.method == "POST":
+            verses = data.get("verses")
+            if not isinstance(verses, list):
+                flask.abort(400, "expected a list of verses")
+        else:
+            verses = flask.request.args.getlist("verse")
+        verses = [get_verse({"verse": verse}) for verse in verses]
+    if len(verses) > MAX_BATCH_SIZE:
+        flask.abort(400, f"too many verses: {len(verses)} > {MAX_BATCH_SIZE}")
+    for verse in verses:
+        if verse not in CONNECTIONS:
+            flask.abort(404, f"unknown verse: {verse}")
+    payload = _render_batch_elements(
+        build_id=BUILD_ID,
+        verses=tuple(verses),
+        filter_mode=get_filter_mode(data),
+        include_suggested=get_bool(data, "include_suggested"),
+    )
+    return send_payload(payload)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_batch_elements(
+    build_id: str, verses: tuple[str, ...], filter_mode: FilterMode, include_suggested: bool
+) -> Payload:
+    """Renders and serializes the merged neighborhood around several verses.
+
+    NOTE(skearnes): A merged element is kept if it is kept in any of the individual neighborhoods, so nothing can
+    be sent until every verse has been merged; the response is rendered in full (and cached, since chapter
+    requests repeat) rather than streamed.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        verses: Verses to render.
+        filter_mode: FilterMode.
+        include_suggested: Whether to include suggested edges.
+
+    Returns:
+        Payload containing the serialized JSON elements.
+    """
+    del build_id  # Only used as part of the cache key.
+    elements = explorer_lib.get_batch_elements(
+        CONNECTIONS, verses=verses, filter_mode=filter_mode, include_suggested=include_suggested
     )
     num_nodes = len(elements["nodes"])
     num_edges = len(elements["edges"])
-    app.logger.info(f"Fetched {num_nodes} nodes and {num_edges} edges for {data}")
-    return flask.jsonify(elements)
-
-
-def _get_elements(verse: str, filter_mode: FilterMode, include_suggested: bool) -> Elements:
-    """Renders the neighborhood around a verse."""
-    unique_nodes = {verse}
-    incoming, outgoing, suggested = get_edges(verse)
-    # NOTE(skearnes): We drop suggested nodes if they are not requested. Filtered-out nodes
-    # are still drawn but are deemphasized for visual clarity.
-    if not include_suggested:
-        suggested.clear()
-    unique_nodes.update(incoming | outgoing | suggested)
-    nodes = []
-    for node in unique_nodes:
-        if (
-            node == verse
-            or (filter_mode == FilterMode.ALL and (node in incoming or node in outgoing))
-            or (filter_mode == FilterMode.INCOMING and node in incoming)
-            or (filter_mode == FilterMode.OUTGOING and node in outgoing)
-            or (include_suggested and node in suggested)
-        ):
-            keep = True
-        else:
-            keep = False
-        nodes.append({"data": {"id": node, "keep": keep}})
-    in_only = incoming - outgoing
-    out_only = outgoing - incoming
-    both = incoming & outgoing
-    edges = []
-    for source in in_only:
-        edges.append(
-            {
-                "data": {
-                    "id": f"{verse} <- {source}",
-                    "source": source,
-                    "target": verse,
-                    "kind": "incoming",
-                    "keep": filter_mode in {FilterMode.ALL, FilterMode.INCOMING},
-                }
-            }
-        )
-    for target in out_only:
-        edges.append(
-            {
-                "data": {
-                    "id": f"{verse} -> {target}",
-                    "source": verse,
-                    "target": target,
-                    "kind": "outgoing",
-                    "keep": filter_mode in {FilterMode.ALL, FilterMode.OUTGOING},
-                }
-            }
-        )
-    for other in both:
-        edges.append(
-            {
-                "data": {
-                    "id": f"{verse} <-> {other}",
-                    "source": verse,
-                    "target": other,
-                    "kind": "both",
-                    "keep": True,
-                }
-            }
-        )
-    for node in suggested:
-        edges.append(
-            {
-                "data": {
-                    "id": f"{verse} <?> {node}",
-                    "source": verse,
-                    "target": node,
-                    "kind": "suggested",
-                    "keep": include_suggested,
-                }
-            }
+    app.logger.info(f"Fetched {num_nodes} nodes and {num_edges} edges for {len(verses)} verses")
+    key = f"batch:{filter_mode.name}:{include_suggested}:{'|'.join(verses)}"
+    return make_payload(key, json.dumps(elements).encode("utf-8"))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_elements(
+    build_id: str,
+    verse: str,
+    filter_mode: FilterMode,
+    include_suggested: bool,
+    max_nodes: Optional[int] = None,
+    cursor: int = 0,
+) -> Payload:
+    """Renders and serializes the neighborhood around a verse.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        verse: Verse to render.
+        filter_mode: FilterMode.
+        include_suggested: Whether to include suggested edges.
+        max_nodes: Maximum number of neighbors to return; None returns all of them.
+        cursor: Position in the ranked neighbor list to start from.
+
+    Returns:
+        Payload containing the serialized JSON elements.
+    """
+    del build_id  # Only used as part of the cache key.
+    elements = explorer_lib.get_elements(
+        CONNECTIONS,
+        verse=verse,
+        filter_mode=filter_mode,
+        include_suggested=include_suggested,
+        max_nodes=max_nodes,
+        cursor=cursor,
+        positions=LAYOUTS.get_positions(CONNECTIONS, verse) if LAYOUTS is not None else None,
+    )
+    num_nodes = len(elements["nodes"])
+    num_edges = len(elements["edges"])
+    app.logger.info(
+        f"Fetched {num_nodes} nodes and {num_edges} edges for {verse} "
+        f"({filter_mode.name}, {include_suggested=}, {max_nodes=}, {cursor=})"
+    )
+    key = f"elements:{verse}:{filter_mode.name}:{include_suggested}:{max_nodes}:{cursor}"
+    return make_payload(key, json.dumps(elements).encode("utf-8"))
+
+
+@app.route("/neighborhood", methods=["GET", "POST"])
+def get_neighborhood() -> flask.Response:
+    """Fetches the multi-hop neighborhood around a verse.
+
+    The "hops" parameter sets the number of hops (1 to MAX_HOPS); "max_nodes" sets the node budget (1 to
+    MAX_NEIGHBORHOOD_NODES). The filter mode selects which reference direction is followed.
+    """
+    data = get_request_data()
+    verse = get_verse(data)
+    if verse not in ADJACENCY.index:
+        flask.abort(404, f"unknown verse: {verse}")
+    payload = _render_neighborhood(
+        build_id=BUILD_ID,
+        verse=verse,
+        hops=min(get_int(data, "hops", 2, minimum=1), MAX_HOPS),
+        filter_mode=get_filter_mode(data),
+        include_suggested=get_bool(data, "include_suggested"),
+        max_nodes=min(get_int(data, "max_nodes", MAX_NEIGHBORHOOD_NODES, minimum=1), MAX_NEIGHBORHOOD_NODES),
+    )
+    return send_payload(payload)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_neighborhood(
+    build_id: str, verse: str, hops: int, filter_mode: FilterMode, include_suggested: bool, max_nodes: int
+) -> Payload:
+    """Renders and serializes the multi-hop neighborhood around a verse.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        verse: Verse to render.
+        hops: Maximum number of hops.
+        filter_mode: FilterMode.
+        include_suggested: Whether to follow suggested edges.
+        max_nodes: Maximum number of nodes.
+
+    Returns:
+        Payload containing the serialized JSON elements.
+    """
+    del build_id  # Only used as part of the cache key.
+    node_ids, distances = graph_lib.get_neighborhood(
+        ADJACENCY,
+        verse,
+        hops=hops,
+        direction=filter_mode.name.lower(),
+        include_suggested=include_suggested,
+        max_nodes=max_nodes,
+    )
+    edges = ADJACENCY.get_subgraph_edges(node_ids, include_suggested=include_suggested)
+    nodes = ADJACENCY.nodes[node_ids].tolist()
+    elements = explorer_lib.get_subgraph_elements(
+        nodes,
+        distances.tolist(),
+        [(str(ADJACENCY.nodes[source]), str(ADJACENCY.nodes[target]), kind) for source, target, kind in edges],
+        connections=CONNECTIONS,
+    )
+    app.logger.info(f"Fetched {len(nodes)} nodes and {len(edges)} edges within {hops} hops of {verse}")
+    key = f"neighborhood:{verse}:{hops}:{filter_mode.name}:{include_suggested}:{max_nodes}"
+    return make_payload(key, json.dumps(elements).encode("utf-8"))
+
+
+@app.route("/path", methods=["GET", "POST"])
+def get_path() -> flask.Response:
+    """Fetches the shortest chains of references between two verses.
+
+    The "k" parameter sets the number of paths (between 1 and MAX_PATHS). If "directed" is true (the default), references
+    are only followed from the citing verse to the cited verse.
+    """
+    data = get_request_data()
+    source = get_verse(data, "source")
+    target = get_verse(data, "target")
+    for verse in [source, target]:
+        if verse not in ADJACENCY.index:
+            flask.abort(404, f"unknown verse: {verse}")
+    payload = _render_path(
+        build_id=BUILD_ID,
+        source=source,
+        target=target,
+        k=min(max(get_int(data, "k", 1), 1), MAX_PATHS),
+        include_suggested=bool(data.get("include_suggested", False)),
+        directed=bool(data.get("directed", True)),
+    )
+    return send_payload(payload)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_path(build_id: str, source: str, target: str, k: int, include_suggested: bool, directed: bool) -> Payload:
+    """Renders and serializes the shortest paths between two verses.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        source: Source verse.
+        target: Target verse.
+        k: Maximum number of paths.
+        include_suggested: Whether to follow suggested edges.
+        directed: Whether to respect the direction of canonical references.
+
+    Returns:
+        Payload containing the serialized paths and the JSON elements for their union. Node distances are
+        positions along the shortest path that contains them.
+    """
+    del build_id  # Only used as part of the cache key.
+    paths = graph_lib.get_shortest_paths(
+        ADJACENCY, source, target, k=k, include_suggested=include_suggested, directed=directed
+    )
+    positions = {}
+    for path in paths:
+        for position, node in enumerate(path):
+            positions.setdefault(node, position)
+    node_ids = [ADJACENCY.index[node] for node in positions]
+    edges = ADJACENCY.get_subgraph_edges(node_ids, include_suggested=include_suggested)
+    elements = explorer_lib.get_subgraph_elements(
+        list(positions),
+        list(positions.values()),
+        [(str(ADJACENCY.nodes[i]), str(ADJACENCY.nodes[j]), kind) for i, j, kind in edges],
+        connections=CONNECTIONS,
+    )
+    elements["paths"] = paths
+    app.logger.info(f"Found {len(paths)} paths from {source} to {target} ({k=}, {include_suggested=}, {directed=})")
+    key = f"path:{source}:{target}:{k}:{include_suggested}:{directed}"
+    return make_payload(key, json.dumps(elements).encode("utf-8"))
+
+
+@app.route("/related", methods=["GET", "POST"])
+def get_related() -> flask.Response:
+    """Fetches verses related to a verse, ranked by approximate personalized PageRank.
+
+    The "alpha" (teleport probability) and "epsilon" (residual tolerance, at least MIN_EPSILON) parameters are
+    passed to graph_lib.get_related; "k" sets the number of results (between 1 and MAX_RELATED).
+    """
+    data = get_request_data()
+    verse = get_verse(data)
+    if verse not in ADJACENCY.index:
+        flask.abort(404, f"unknown verse: {verse}")
+    alpha = get_float(data, "alpha", 0.15)
+    if not 0 < alpha <= 1:
+        flask.abort(400, f"alpha must be in (0, 1]: {alpha}")
+    payload = _render_related(
+        build_id=BUILD_ID,
+        verse=verse,
+        k=min(max(get_int(data, "k", 10), 1), MAX_RELATED),
+        alpha=alpha,
+        epsilon=max(get_float(data, "epsilon", 1e-4), MIN_EPSILON),
+        filter_mode=get_filter_mode(data, "all"),
+        include_suggested=bool(data.get("include_suggested", False)),
+        exclude_neighbors=bool(data.get("exclude_neighbors", False)),
+    )
+    return send_payload(payload)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_related(
+    build_id: str,
+    verse: str,
+    k: int,
+    alpha: float,
+    epsilon: float,
+    filter_mode: FilterMode,
+    include_suggested: bool,
+    exclude_neighbors: bool,
+) -> Payload:
+    """Renders and serializes the verses related to a verse.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        verse: Source verse.
+        k: Maximum number of related verses.
+        alpha: Teleport probability.
+        epsilon: Residual tolerance.
+        filter_mode: FilterMode.
+        include_suggested: Whether to follow suggested edges.
+        exclude_neighbors: Whether to omit direct neighbors of the source verse.
+
+    Returns:
+        Payload containing the serialized list of related verses and their scores.
+    """
+    del build_id  # Only used as part of the cache key.
+    related = graph_lib.get_related(
+        ADJACENCY,
+        verse,
+        k=k,
+        alpha=alpha,
+        epsilon=epsilon,
+        direction=filter_mode.name.lower(),
+        include_suggested=include_suggested,
+        exclude_neighbors=exclude_neighbors,
+    )
+    app.logger.info(f"Found {len(related)} verses related to {verse} ({alpha=}, {epsilon=}, {filter_mode.name})")
+    data = {"verse": verse, "related": [{"verse": node, "score": score} for node, score in related]}
+    key = f"related:{verse}:{k}:{alpha}:{epsilon}:{filter_mode.name}:{include_suggested}:{exclude_neighbors}"
+    return make_payload(key, json.dumps(data).encode("utf-8"))
+
+
+@app.route("/components", methods=["GET", "POST"])
+def get_components() -> flask.Response:
+    """Fetches the weak and strong components (over canonical edges) containing a verse."""
+    data = get_request_data()
+    verse = get_verse(data)
+    if verse not in CONNECTIONS:
+        flask.abort(404, f"unknown verse: {verse}")
+    connections = CONNECTIONS[verse]
+    if "weak_component" not in connections:
+        flask.abort(404, "components were not computed for this build")
+    return flask.jsonify(
+        {
+            "verse": verse,
+            "weak": {"label": connections["weak_component"], "size": connections["weak_component_size"]},
+            "strong": {"label": connections["strong_component"], "size": connections["strong_component_size"]},
+        }
+    )
+
+
+@app.route("/rollup", methods=["GET", "POST"])
+def get_rollup() -> flask.Response:
+    """Fetches a volume, book, or chapter rollup graph.
+
+    The "level" parameter is one of graph_lib.ROLLUP_LEVELS; the optional "parent" parameter zooms in on the
+    children of a single volume (for books) or book (for chapters).
+    """
+    data = get_request_data()
+    level = data.get("level", "volume")
+    if level not in graph_lib.ROLLUP_LEVELS:
+        flask.abort(400, f"unsupported level: {level}")
+    parent = get_verse(data, "parent") if data.get("parent") else None
+    return send_payload(_render_rollup(build_id=BUILD_ID, level=level, parent=parent))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_rollup(build_id: str, level: str, parent: Optional[str]) -> Payload:
+    """Renders and serializes a rollup graph.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        level: Rollup level.
+        parent: Optional parent volume or book.
+
+    Returns:
+        Payload containing the serialized JSON elements.
+    """
+    del build_id  # Only used as part of the cache key.
+    elements = explorer_lib.get_rollup_elements(load_rollups()[level], graph_lib.EDGE_KINDS, parent=parent)
+    return make_payload(f"rollup:{level}:{parent}", json.dumps(elements).encode("utf-8"))
+
+
+@app.route("/search", methods=["GET", "POST"])
+def search() -> flask.Response:
+    """Searches verse text.
+
+    The "q" parameter is the query (see search_lib); "k" sets the number of results (between 1 and
+    MAX_SEARCH_RESULTS) and "offset" skips that many top results (negative offsets are treated as 0).
+    """
+    data = get_request_data()
+    query = str(data.get("q", "")).strip()
+    try:
+        search_lib.parse_query(query)
+    except ValueError as error:
+        flask.abort(400, str(error))
+    payload = _render_search(
+        build_id=BUILD_ID,
+        query=query,
+        k=min(max(get_int(data, "k", 20), 1), MAX_SEARCH_RESULTS),
+        offset=max(get_int(data, "offset", 0), 0),
+    )
+    return send_payload(payload)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_search(build_id: str, query: str, k: int, offset: int) -> Payload:
+    """Runs and serializes a search.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        query: Query string.
+        k: Maximum number of results.
+        offset: Number of top results to skip.
+
+    Returns:
+        Payload containing the serialized results and the total number of matches.
+    """
+    del build_id  # Only used as part of the cache key.
+    results, total = load_search_index().search(query, k=k, offset=offset)
+    app.logger.info(f"Found {total} matches for {query!r}")
+    data = {"query": query, "total": total, "results": [{"verse": verse, "score": score} for verse, score in results]}
+    return make_payload(f"search:{query}:{k}:{offset}", json.dumps(data).encode("utf-8"))
+
+
+@app.route("/topics", methods=["GET", "POST"])
+def get_topics() -> flask.Response:
+    """Fetches the topics that cite or are cited by a verse."""
+    data = get_request_data()
+    verse = get_verse(data)
+    topic_index = load_topic_index()
+    if verse not in topic_index.verse_index:
+        flask.abort(404, f"unknown verse: {verse}")
+    return flask.jsonify({"verse": verse, "topics": topic_index.get_topics(verse)})
+
+
+@app.route("/topic", methods=["GET", "POST"])
+def get_topic() -> flask.Response:
+    """Fetches a page of the verses for a topic.
+
+    The "topic" parameter is the topic key (e.g. "TG Faith"); "k" sets the number of verses (between 1
+    and MAX_TOPIC_VERSES) and "offset" skips that many verses.
+    """
+    data = get_request_data()
+    topic = str(data.get("topic", ""))
+    topic_index = load_topic_index()
+    if topic not in topic_index.topic_index:
+        flask.abort(404, f"unknown topic: {topic}")
+    verses, total = topic_index.get_verses(
+        topic, k=min(max(get_int(data, "k", 100), 1), MAX_TOPIC_VERSES), offset=max(get_int(data, "offset", 0), 0)
+    )
+    return flask.jsonify({"topic": topic, "total": total, "verses": verses})
+
+
+@app.route("/topics/related", methods=["GET", "POST"])
+def get_related_topics() -> flask.Response:
+    """Fetches the topics most co-cited with a verse (see graph_lib.TopicIndex.get_cocited_topics).
+
+    The "k" parameter sets the number of results (between 1 and MAX_RELATED_TOPICS).
+    """
+    data = get_request_data()
+    verse = get_verse(data)
+    if verse not in load_topic_index().verse_index:
+        flask.abort(404, f"unknown verse: {verse}")
+    return send_payload(
+        _render_related_topics(
+            build_id=BUILD_ID, verse=verse, k=min(max(get_int(data, "k", 10), 1), MAX_RELATED_TOPICS)
         )
-    # Use attribute presence for matching in CSS.
-    for node in nodes:
-        if not node["data"]["keep"]:
-            node["data"]["hide"] = True
-    for edge in edges:
-        if not edge["data"]["keep"]:
-            edge["data"]["hide"] = True
-    return {"nodes": nodes, "edges": edges}
+    )
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_related_topics(build_id: str, verse: str, k: int) -> Payload:
+    """Renders and serializes the topics co-cited with a verse.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        verse: Source verse.
+        k: Maximum number of topics.
+
+    Returns:
+        Payload containing the serialized list of topics and their scores.
+    """
+    del build_id  # Only used as part of the cache key.
+    topics = load_topic_index().get_cocited_topics(verse, k=k)
+    data = {"verse": verse, "topics": [{"topic": topic, "score": score} for topic, score in topics]}
+    return make_payload(f"related_topics:{verse}:{k}", json.dumps(data).encode("utf-8"))
+
+
+@app.route("/autocomplete")
+def autocomplete() -> flask.Response:
+    """Completes a partial reference (e.g. "1 ne 3") to verse keys.
+
+    The "q" parameter is the partial reference; "k" sets the number of results (between 1 and MAX_COMPLETIONS).
+    """
+    data = get_request_data()
+    query = str(data.get("q", ""))
+    results = REFERENCES.complete(query, k=min(max(get_int(data, "k", 10), 1), MAX_COMPLETIONS))
+    return flask.jsonify({"query": query, "results": results})
 
 
 @app.route("/", methods=["GET"])
 def root() -> str:
     """Shows the main graph exploration page."""
-    return flask.render_template("index.html")
+    return flask.render_template("index.html", static_export_url=STATIC_EXPORT_URL)
 
 
 @app.route("/tree")
-def get_tree() -> str:
+def get_tree() -> flask.Response:
     """Fetches the navigation tree for the sidebar."""
-    with open("data/tree.json") as f:
-        return flask.jsonify(json.load(f))
+    return send_payload(TREE)
 
 
-@app.route("/table", methods=["POST"])
-def get_table() -> str:
+@app.route("/table", methods=["GET", "POST"])
+def get_table() -> flask.Response:
     """Builds a cross-reference table for the given verse."""
-    verse = flask.request.get_data(as_text=True)
-    args = {
-        "verse": verse.replace(" ", "\xa0"),  # Non-breaking space.
-        "verse_url": get_verse_url(verse),
-    }
-    incoming, outgoing, suggested = get_edges(verse)
-    args["incoming"] = [(source, get_verse_url(source)) for source in sort_verses(incoming)]
-    args["outgoing"] = [(target, get_verse_url(target)) for target in sort_verses(outgoing)]
-    args["suggested"] = [(node, get_verse_url(node)) for node in sort_verses(suggested)]
-    return flask.jsonify(flask.render_template("table.html", **args))
+    if flask.request.method == "POST":
+        verse = flask.request.get_data(as_text=True)
+    elif "verse" in flask.request.args:
+        verse = flask.request.args["verse"]
+    else:
+        flask.abort(400, "missing parameter: verse")
+    if verse not in CONNECTIONS:
+        flask.abort(404, f"unknown verse: {verse}")
+    return send_payload(get_table_payload(verse))
 
 
-@app.route("/_ah/warmup")
-def warmup() -> None:
-    """Handle warmup requests from App Engine."""
-    return flask.make_response("", 200)
-
-
-def get_verse_url(verse: str) -> str:
-    """Creates a URL for the verse text."""
-    node = CONNECTIONS[verse]
-    volume = scripture_graph.VOLUMES_SHORT[node["volume"]].lower()
-    if volume == "bom":
-        volume = "bofm"
-    elif volume == "d&c":
-        volume = "dc-testament"
-    elif volume == "pogp":
-        volume = "pgp"
-    book = node["book"].lower()
-    book_replacements = {
-        " ": "-",
-        ".": "",
-        "&": "",
-        "—": "-",
-    }
-    for old, new in book_replacements.items():
-        book = book.replace(old, new)
-    if book == "d&c":
-        book = "dc"
-    chapter = node["chapter"]
-    i = node["verse"]
-    return parse.urljoin(URL_BASE, f"{volume}/{book}/{chapter}.{i}?lang=eng#p{i}#{i}")
+def get_table_payload(verse: str) -> Payload:
+    """Renders (or fetches from the cache) the cross-reference table for a verse; see `_render_table`.
+
+    Rendering uses the app's templates, so this pushes an application context when called outside of a request.
+    """
+    if flask.has_app_context():
+        return _render_table(build_id=BUILD_ID, verse=verse)
+    with app.app_context():
+        return _render_table(build_id=BUILD_ID, verse=verse)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_table(build_id: str, verse: str) -> Payload:
+    """Renders and serializes the cross-reference table for a verse.
+
+    Args:
+        build_id: Build ID for the static data; only used as part of the cache key.
+        verse: Verse to render.
+
+    Returns:
+        Payload containing the serialized JSON string for the rendered table.
+    """
+    del build_id  # Only used as part of the cache key.
+    args = explorer_lib.get_table_args(CONNECTIONS, verse)
+    return make_payload(f"table:{verse}", json.dumps(flask.render_template("table.html", **args)).encode("utf-8"))
 
 
-def sort_verses(verses: list[str]) -> list[str]:
-    """Sorts verses in Standard Works order."""
-    return sorted(verses, key=_sort_verses)
+@app.route("/cache")
+def get_cache_info() -> str:
+    """Reports response cache statistics."""
+    info = {"build_id": BUILD_ID}
+    for name, function in [
+        ("elements", _render_elements),
+        ("neighborhood", _render_neighborhood),
+        ("path", _render_path),
+        ("related", _render_related),
+        ("related_topics", _render_related_topics),
+        ("rollup", _render_rollup),
+        ("search", _render_search),
+        ("table", _render_table),
+    ]:
+        info[name] = function.cache_info()._asdict()
+    return flask.jsonify(info)
 
 
-def _sort_verses(verse: str) -> tuple[int, int, int]:
-    """Key function for sort_verses."""
-    node = CONNECTIONS[verse]
-    return BOOK_ORDER[node["book"]], node["chapter"], node["verse"]
+@app.route("/metrics")
+def get_metrics() -> flask.Response:
+    """Reports request and startup metrics in the Prometheus text format."""
+    return flask.Response(METRICS.render(), content_type=metrics_lib.CONTENT_TYPE)
+
+
+def touch_data() -> None:
+    """Loads the lazily loaded data files and builds the cached traversal matrices."""
+    load_rollups()
+    load_search_index()
+    load_topic_index()
+    app.logger.info(f"Indexed {len(ADJACENCY.index)} nodes")
+    for filter_mode in FilterMode:
+        for include_suggested in [False, True]:
+            ADJACENCY.get_matrix(direction=filter_mode.name.lower(), include_suggested=include_suggested)
+
+
+def warm_up(budget: float) -> dict[str, Any]:
+    """Pre-renders the hot set into the response caches.
+
+    Requests are rendered in order of popularity, alternating between /elements and /table, until the hot set is
+    exhausted, the response caches are full, or the time budget runs out. Invalid requests (e.g. for verses that
+    are not in the current build) are skipped.
+
+    Args:
+        budget: Time budget, in seconds. Loading data files is not interruptible, so the budget can be exceeded by
+            the time it takes to load the largest file.
+
+    Returns:
+        Dict summarizing the work done.
+    """
+    start = time.perf_counter()
+    deadline = start + budget
+    touch_data()
+    hot_set = load_hot_set()
+    elements, table = hot_set["elements"][:CACHE_SIZE], hot_set["table"][:CACHE_SIZE]
+    counts = {"elements": 0, "table": 0, "skipped": 0}
+    num_steps = max(len(elements), len(table))
+    completed = 0
+    for i in range(num_steps):
+        if time.perf_counter() > deadline:
+            break
+        if i < len(elements):
+            try:
+                get_elements_payload(elements[i])
+                counts["elements"] += 1
+            except HTTPException:
+                counts["skipped"] += 1
+        if i < len(table):
+            if table[i] in CONNECTIONS:
+                get_table_payload(table[i])
+                counts["table"] += 1
+            else:
+                counts["skipped"] += 1
+        completed += 1
+    summary = {
+        "seconds": time.perf_counter() - start,
+        "budget": budget,
+        "complete": completed == num_steps,
+        **counts,
+    }
+    STARTUP_SECONDS.set(summary["seconds"], "warmup")
+    app.logger.info(f"Warmup: {summary}")
+    return summary
+
+
+@app.route("/_ah/warmup")
+def warmup() -> flask.Response:
+    """Handle warmup requests from App Engine by pre-rendering the hot set (see warm_up)."""
+    return flask.jsonify(warm_up(WARMUP_BUDGET))
 
 
 if __name__ == "__main__":
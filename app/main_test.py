@@ -0,0 +1,144 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for the Flask application (app/main.py)."""
+import os
+
+import pytest
+
+# NOTE(kearnes): Flask is only installed with the app requirements (app/requirements.txt).
+pytest.importorskip("flask")
+
+
+@pytest.fixture(name="client")
+def client_fixture(main, data_dir, monkeypatch):
+    """Flask test client; lazily loaded data files are read relative to the app data directory."""
+    monkeypatch.chdir(data_dir)
+    return main.app.test_client()
+
+
+@pytest.fixture(name="verse")
+def verse_fixture(main):
+    """Verse with more ranked neighbors than a single-node page."""
+    return next(verse for verse, data in main.CONNECTIONS.items() if len(data.get("ranked", [])) > 2)
+
+
+@pytest.mark.parametrize(
+    "params,expected",
+    [
+        ({}, 200),
+        ({"max_nodes": "2", "cursor": "2"}, 200),
+        ({"max_nodes": "2", "cursor": "999"}, 400),
+        ({"filter_mode": "sideways"}, 400),
+        ({"include_suggested": None}, 400),
+        ({"verse": None}, 400),
+        ({"verse": "Moroni 99:1"}, 404),
+    ],
+)
+def test_elements(client, verse, params, expected):
+    params = {"verse": verse, "filter_mode": "all", "include_suggested": "true", **params}
+    response = client.get("/elements", query_string={key: value for key, value in params.items() if value is not None})
+    assert response.status_code == expected
+
+
+def test_elements_post(client, verse):
+    assert client.post("/elements", json={"verse": verse, "filter_mode": "all"}).status_code == 400
+    assert client.post("/elements", json=[verse]).status_code == 400
+    assert client.post("/elements/batch", json={"filter_mode": "all", "include_suggested": True}).status_code == 400
+
+
+@pytest.mark.parametrize("params,expected", [(None, 200), ({}, 400), ({"verse": "Moroni 99:1"}, 404)])
+def test_table(client, verse, params, expected):
+    assert client.get("/table", query_string={"verse": verse} if params is None else params).status_code == expected
+
+
+@pytest.mark.parametrize(
+    "params,expected",
+    [({}, 200), ({"hops": "1", "max_nodes": "1"}, 200), ({"hops": "-1"}, 400), ({"max_nodes": "0"}, 400)],
+)
+def test_neighborhood(client, verse, params, expected):
+    params = {"verse": verse, "filter_mode": "all", "include_suggested": "true", **params}
+    assert client.get("/neighborhood", query_string=params).status_code == expected
+
+
+@pytest.mark.parametrize("k", ["0", "-3", "1"])
+def test_path(main, client, verse, k):
+    target = main.CONNECTIONS[verse]["ranked"][0][0]
+    response = client.get("/path", query_string={"source": verse, "target": target, "k": k, "directed": "false"})
+    assert response.status_code == 200
+    assert response.get_json()["paths"] == [[verse, target]]
+
+
+@pytest.mark.parametrize(
+    "params,expected_status,expected_count",
+    [
+        ({"k": "3"}, 200, 3),
+        ({"k": "-2"}, 200, 1),
+        ({"k": "3", "epsilon": "nan"}, 400, None),
+        ({"k": "3", "epsilon": "inf"}, 400, None),
+        ({"k": "3", "alpha": "nan"}, 400, None),
+    ],
+)
+def test_related(client, verse, params, expected_status, expected_count):
+    response = client.get("/related", query_string={"verse": verse, **params})
+    assert response.status_code == expected_status
+    if expected_count is not None:
+        assert len(response.get_json()["related"]) == expected_count
+
+
+@pytest.mark.parametrize("k,expected", [("-1", 1), ("0", 1), ("2", 2)])
+def test_autocomplete(main, client, k, expected):
+    book = next(iter(main.CONNECTIONS.values()))["book"]
+    response = client.get("/autocomplete", query_string={"q": book, "k": k})
+    assert response.status_code == 200
+    assert len(response.get_json()["results"]) == expected
+
+
+def test_get_build_id(main, client, tmp_path, monkeypatch):
+    del client  # Only used to set the working directory.
+    build_id = main.get_build_id()
+    assert build_id == main.get_build_id()
+    # Missing files are allowed.
+    monkeypatch.setattr(main, "SEARCH_INDEX_FILENAME", str(tmp_path / "missing.npz"))
+    assert main.get_build_id() != build_id
+    filename = tmp_path / "tree.json"
+    filename.write_text("{}")
+    monkeypatch.setattr(main, "TREE_FILENAME", str(filename))
+    build_id = main.get_build_id()
+    os.utime(filename, ns=(0, 0))
+    assert main.get_build_id() != build_id
+
+
+def test_warm_up(main, client, verse, monkeypatch):
+    del client  # Only used to set the working directory.
+    request = {"verse": verse, "filter_mode": "all", "include_suggested": True, "max_nodes": 100}
+    hot_set = {
+        "elements": [request, dict(request, verse="Moroni 99:1"), dict(request, filter_mode="sideways")],
+        "table": [verse, "Moroni 99:1"],
+    }
+    monkeypatch.setattr(main, "load_hot_set", lambda: hot_set)
+    summary = main.warm_up(60)
+    assert summary["complete"]
+    assert (summary["elements"], summary["table"], summary["skipped"]) == (1, 1, 3)
+
+
+def test_topics(main, client):
+    topic_index = main.load_topic_index()
+    topic = next(topic for topic in topic_index.topic_index if topic_index.get_verses(topic, k=1)[0])
+    response = client.get("/topic", query_string={"topic": topic, "k": -1})
+    assert response.status_code == 200
+    verse = response.get_json()["verses"][0]
+    assert len(response.get_json()["verses"]) == 1
+    response = client.get("/topics/related", query_string={"verse": verse, "k": 0})
+    assert response.status_code == 200
+    assert len(response.get_json()["topics"]) <= 1
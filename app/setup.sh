@@ -21,7 +21,19 @@ time python ../scripture_graph/build_graph.py \
   --output="data/scripture_graph.graphml" \
   --topics \
   --suggested \
-  --tree="data/tree.json"
+  --centrality \
+  --components \
+  --communities \
+  --tree="data/tree.json" \
+  --rollups="data/rollups.json" \
+  --records="data/records" \
+  --cache_dir="cache"
 time python ../scripture_graph/build_connections.py \
   --input="data/scripture_graph.graphml" \
-  --output="data/connections.json"
+  --output="data/connections.json" \
+  --index="data/index.npz" \
+  --layouts="data/layouts.npz" \
+  --search_index="data/search.npz" \
+  --topic_index="data/topics.npz" \
+  --hot_set="data/hot.json" \
+  --cache_dir="cache"
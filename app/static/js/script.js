@@ -19,6 +19,25 @@
 // Global Cytoscape object.
 let cy = null;
 
+// Maximum number of neighbors to fetch at once for a verse; must match
+// CLIENT_MAX_NODES in hotset_lib.py.
+const MAX_NODES = 100;
+
+// Node colors for communities (see graph_lib.add_communities); community IDs
+// are assigned in order of decreasing size and wrap around this palette.
+const COMMUNITY_COLORS = [
+  'rgb(166,206,227)',
+  'rgb(178,223,138)',
+  'rgb(251,154,153)',
+  'rgb(253,191,111)',
+  'rgb(202,178,214)',
+  'rgb(255,255,153)',
+  'rgb(141,211,199)',
+  'rgb(252,205,229)',
+  'rgb(217,217,217)',
+  'rgb(204,235,197)',
+];
+
 /**
  * Initializes the entire page.
  */
@@ -35,6 +54,39 @@ function initExplorer() {
   initTree(verse);
   initGraph(verse);
   updateTable(verse);
+  initVerseInput();
+}
+
+/**
+ * Initializes the verse input with reference autocompletion.
+ */
+function initVerseInput() {
+  // Completions for the current input, used to recognize complete verse keys.
+  let completions = [];
+  $('#verseInput').on('input', async function() {
+    const query = $(this).val();
+    const queryParams = new URLSearchParams({q : query});
+    const response = await fetch('/autocomplete?' + queryParams.toString());
+    if (!response.ok || $(this).val() !== query) {
+      return; // Ignore errors and stale responses.
+    }
+    completions = (await response.json()).results;
+    const options =
+        completions.map(verse => $('<option>').attr('value', verse));
+    $('#verseOptions').empty().append(options);
+    if (completions.includes(query)) {
+      $(this).trigger('change');
+    }
+  });
+  $('#verseInput').on('change', function() {
+    const verse = $(this).val();
+    if (completions.includes(verse) && verse !== getVerse()) {
+      updateTree(verse);
+      updateGraph(verse);
+      updateTable(verse);
+      updateQuery(verse);
+    }
+  });
 }
 
 /**
@@ -114,21 +166,45 @@ function updateTree(verse) {
 
 /**
  * Fetches the neighborhood around a verse.
+ *
+ * Large neighborhoods are paged; the response includes a cursor for the next
+ * page (or null).
  * @param {string} verse
+ * @param {number=} cursor
  * @return {!Promise<Object>}
  */
-function getElements(verse) {
+function getElements(verse, cursor = 0) {
   const filter_mode = $('input:radio[name="edgeFilterMode"]:checked').val();
   const include_suggested = $('#includeSuggested')[0].checked;
   const data = {
     verse : verse,
     filter_mode : filter_mode,
     include_suggested : include_suggested,
+    max_nodes : MAX_NODES,
+    cursor : cursor,
   };
+  // NOTE(kearnes): The static export holds the first page of MAX_NODES
+  // neighbors (CLIENT_MAX_NODES in hotset_lib.py); later pages come from the
+  // app.
+  if (document.body.dataset.staticExport && cursor === 0) {
+    const variant = filter_mode + ':' + include_suggested;
+    return getStatic(verse, variant).catch(() => getApiElements(data));
+  }
+  return getApiElements(data);
+}
+
+/**
+ * Fetches the neighborhood around a verse from the app.
+ * @param {!Object} data
+ * @return {!Promise<Object>}
+ */
+function getApiElements(data) {
+  // NOTE(kearnes): Use GET so the browser can revalidate cached responses
+  // with If-None-Match.
+  const queryParams = new URLSearchParams(data);
   return new Promise((resolve, reject) => {
     const xhr = new XMLHttpRequest();
-    xhr.open('POST', '/elements');
-    xhr.setRequestHeader('Content-Type', 'application/json');
+    xhr.open('GET', '/elements?' + queryParams.toString());
     xhr.responseType = 'json';
     xhr.onload = function() {
       if (xhr.status === 200) {
@@ -137,10 +213,49 @@ function getElements(verse) {
         reject(JSON.stringify(data));
       }
     };
-    xhr.send(JSON.stringify(data));
+    xhr.send();
   });
 }
 
+// Cache of static export index shards, keyed by shard name.
+const staticIndex = new Map();
+
+/**
+ * Fetches a precomputed response from the static export.
+ *
+ * See build_connections.py for the layout of the export.
+ * @param {string} verse
+ * @param {?string} variant Elements variant (e.g. 'all:true'), or null for
+ *     the cross-reference table.
+ * @return {!Promise<Object>}
+ */
+async function getStatic(verse, variant) {
+  const base = document.body.dataset.staticExport;
+  const chapter = verse.substring(0, verse.lastIndexOf(':'));
+  const shard = chapter.replace(/[^A-Za-z0-9]/g, '_');
+  if (!staticIndex.has(shard)) {
+    staticIndex.set(shard, fetchJson(base + '/index/' + shard + '.json'));
+  }
+  const index = await staticIndex.get(shard);
+  const entry = index[verse];
+  const digest = variant === null ? entry.table : entry.elements[variant];
+  return fetchJson(base + '/blobs/' + digest.substring(0, 2) + '/' + digest +
+                   '.json');
+}
+
+/**
+ * Fetches and parses a JSON file.
+ * @param {string} url
+ * @return {!Promise<Object>}
+ */
+async function fetchJson(url) {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(url);
+  }
+  return response.json();
+}
+
 /**
  * Initializes the Cytoscape viewer.
  * @param {string} verse
@@ -149,7 +264,6 @@ function initGraph(verse) {
   // See https://js.cytoscape.org/#core/initialisation.
   cy = cytoscape({
     container : document.getElementById('cy'),
-    elements : getElements(verse),
     style : [
       {
         selector : 'node',
@@ -227,10 +341,6 @@ function initGraph(verse) {
         }
       },
     ],
-    layout : {
-      name : 'cola',
-      animate : false,
-    },
     autoungrabify : true,
     boxSelectionEnabled : false,
     userPanningEnabled : false,
@@ -256,6 +366,13 @@ function initGraph(verse) {
     const verse = getVerse();
     updateGraph(verse);
   });
+  $('#colorCommunities').on('change', function() { updateCommunityColors(); });
+  $('#moreNodes').on('click', function(event) {
+    event.preventDefault();
+    const verse = getVerse();
+    updateGraph(verse, false, $(this).data('cursor'));
+  });
+  updateGraph(verse);
   updateQuery(verse);
 }
 
@@ -263,29 +380,88 @@ function initGraph(verse) {
  * Updates the graph to focus on a new verse.
  * @param {string} verse
  * @param {boolean=} clear
+ * @param {number=} cursor
  */
-async function updateGraph(verse, clear = true) {
-  const elements = await getElements(verse);
+async function updateGraph(verse, clear = true, cursor = 0) {
+  const elements = await getElements(verse, cursor);
   console.log(elements);
   if (clear) {
     cy.remove('*');
   }
-  cy.add(elements);
-  const layout = cy.layout({
-    name : 'cola',
-    animate : false,
-  });
-  layout.run();
+  cy.add({nodes : elements.nodes, edges : elements.edges});
+  updateMoreNodes(elements.cursor);
+  updateCommunityColors();
+  cy.layout(getLayoutOptions(elements)).run();
+}
+
+/**
+ * Returns the layout options for a set of elements.
+ *
+ * Nodes with precomputed positions (see layout_lib.py) are placed directly;
+ * otherwise the graph is laid out in the browser. Later pages of a
+ * neighborhood share the frame of the first page.
+ * @param {!Object} elements
+ * @return {!Object}
+ */
+function getLayoutOptions(elements) {
+  if (elements.nodes.every(node => node.position !== undefined)) {
+    return {name : 'preset', fit : true, padding : 30};
+  }
+  return {name : 'cola', animate : false};
+}
+
+/**
+ * Colors nodes by community when requested.
+ */
+function updateCommunityColors() {
+  if (cy === null) {
+    return;
+  }
+  if ($('#colorCommunities')[0].checked) {
+    cy.nodes('[community]').forEach(node => {
+      const color =
+          COMMUNITY_COLORS[node.data('community') % COMMUNITY_COLORS.length];
+      node.style('background-color', color);
+    });
+  } else {
+    cy.nodes().removeStyle('background-color');
+  }
+}
+
+/**
+ * Shows or hides the link for fetching more neighbors.
+ * @param {?number|undefined} cursor
+ */
+function updateMoreNodes(cursor) {
+  if (cursor === null || cursor === undefined) {
+    $('#moreNodes').addClass('d-none');
+  } else {
+    $('#moreNodes').data('cursor', cursor).removeClass('d-none');
+  }
 }
 
 /**
  * Fetches the cross-reference table.
  * @param {string} verse
+ * @return {!Promise<string>}
  */
 function getTable(verse) {
+  if (document.body.dataset.staticExport) {
+    return getStatic(verse, null).catch(() => getApiTable(verse));
+  }
+  return getApiTable(verse);
+}
+
+/**
+ * Fetches the cross-reference table from the app.
+ * @param {string} verse
+ * @return {!Promise<string>}
+ */
+function getApiTable(verse) {
+  const queryParams = new URLSearchParams({verse : verse});
   return new Promise((resolve, reject) => {
     const xhr = new XMLHttpRequest();
-    xhr.open('POST', '/table');
+    xhr.open('GET', '/table?' + queryParams.toString());
     xhr.responseType = 'json';
     xhr.onload = function() {
       if (xhr.status === 200) {
@@ -294,7 +470,7 @@ function getTable(verse) {
         reject(verse);
       }
     };
-    xhr.send(verse);
+    xhr.send();
   });
 }
 
@@ -13,6 +13,7 @@
 # limitations under the License.
 # Short names for books (used in references).
 """Constants used in submodules."""
+import itertools
 
 BOOKS_SHORT = {
     "1 Chronicles": "1 Chr.",
@@ -204,3 +205,17 @@ VOLUMES_SHORT = {
     "Doctrine and Covenants": "D&C",
     "Pearl of Great Price": "PoGP",
 }
+
+# Standard Works order for books.
+BOOK_ORDER = {
+    book: i
+    for i, book in enumerate(
+        itertools.chain(
+            VOLUMES["Old Testament"],
+            VOLUMES["New Testament"],
+            VOLUMES["Book of Mormon"],
+            VOLUMES["Doctrine and Covenants"],
+            VOLUMES["Pearl of Great Price"],
+        )
+    )
+}
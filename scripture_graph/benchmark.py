@@ -0,0 +1,90 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Runs offline benchmarks on a synthetic corpus (see benchmark_lib).
+
+Usage:
+    benchmark.py --output=<str> [options]
+
+Options:
+    --output=<str>          Output JSON filename for the results.
+    --scale=<float>         Corpus size relative to the Standard Works (e.g. 10 or 100 for stress tests)
+                            [default: 1].
+    --max_verses=<int>      Number of verses for the quadratic benchmarks (jaccard, angular_cosine, and
+                            get_nonzero_edges) [default: 5000].
+    --seed=<int>            Random seed [default: 0].
+    --repeats=<int>         Number of timed runs for each benchmark [default: 3].
+    --benchmarks=<str>      Comma-separated subset of benchmarks to run (see benchmark_lib.BENCHMARKS).
+    --workdir=<str>         Directory for the generated corpus and data; defaults to a temporary directory.
+    --app=<str>             App directory [default: app].
+    --baseline=<str>        Baseline results to compare against; exits with an error on regressions.
+    --threshold=<float>     Allowed slowdown relative to the baseline [default: 0.2].
+    --thresholds=<str>      Comma-separated per-benchmark overrides for --threshold (e.g. "read_epub=0.5").
+
+Run from the repository root. Results are only comparable to a baseline that
+was generated with the same --scale, --seed, and --max_verses (and on the same
+machine).
+"""
+import json
+import logging
+import sys
+import tempfile
+
+import docopt
+
+from scripture_graph import benchmark_lib
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_thresholds(text: str) -> dict[str, float]:
+    """Parses per-benchmark thresholds (e.g. "read_epub=0.5,table=0.3")."""
+    thresholds = {}
+    for item in text.split(","):
+        name, value = item.split("=")
+        if name not in benchmark_lib.BENCHMARKS:
+            raise ValueError(f"unknown benchmark: {name}")
+        thresholds[name] = float(value)
+    return thresholds
+
+
+def main(**kwargs) -> None:
+    names = kwargs["--benchmarks"].split(",") if kwargs["--benchmarks"] else None
+    for name in names or []:
+        if name not in benchmark_lib.BENCHMARKS:
+            raise ValueError(f"unknown benchmark: {name}")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        context = benchmark_lib.BenchmarkContext(
+            workdir=kwargs["--workdir"] or tmpdir,
+            scale=float(kwargs["--scale"]),
+            seed=int(kwargs["--seed"]),
+            max_verses=int(kwargs["--max_verses"]),
+            app_dir=kwargs["--app"],
+        )
+        results = benchmark_lib.run_benchmarks(context, repeats=int(kwargs["--repeats"]), names=names)
+    with open(kwargs["--output"], "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    if kwargs["--baseline"]:
+        regressions = benchmark_lib.compare(
+            results,
+            benchmark_lib.load_results(kwargs["--baseline"]),
+            threshold=float(kwargs["--threshold"]),
+            thresholds=parse_thresholds(kwargs["--thresholds"]) if kwargs["--thresholds"] else None,
+        )
+        if regressions:
+            sys.exit("Benchmark regressions: " + "; ".join(regressions))
+
+
+if __name__ == "__main__":
+    main(**docopt.docopt(__doc__))
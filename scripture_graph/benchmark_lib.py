@@ -0,0 +1,555 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Offline benchmarks on a synthetic corpus.
+
+`SyntheticCorpus` generates EPUB archives with the same XHTML structure as the
+Standard Works (chapters with .titleNumber headers, .verse paragraphs, and
+.listItem footnotes; Topical Guide pages with .entry and .locator elements), at
+any multiple of the size of the Standard Works. The archives are parsed by
+graph_lib.read_epub like the real ones, so every downstream stage can run
+without network access (USE embeddings are replaced by random vectors).
+
+Stages whose cost is quadratic in the number of verses (jaccard,
+angular_cosine, and get_nonzero_edges) run on the first `max_verses` verses;
+suggested edges in the generated app data come from the same subset.
+
+Results are stored as JSON:
+
+    {"metadata": {...}, "benchmarks": {name: {"min": ..., "median": ..., "items": ...}}}
+
+and compared to a baseline with `compare`.
+"""
+import contextlib
+import dataclasses
+import functools
+import importlib.util
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Iterator, Optional
+from xml.sax import saxutils
+import zipfile
+
+import networkx as nx
+import numpy as np
+
+import scripture_graph
+from scripture_graph import build_connections
+from scripture_graph import build_graph
+from scripture_graph import graph_lib
+
+logger = logging.getLogger(__name__)
+
+# Approximate size of the Standard Works (scale=1).
+STANDARD_WORKS_VERSES = 41995
+STANDARD_WORKS_TOPICS = 3500
+
+# Shape of the synthetic corpus.
+VERSES_PER_CHAPTER = 25
+WORDS_PER_VERSE = 30
+VOCABULARY_SIZE = 12000
+FOOTNOTES_PER_VERSE = 1.0
+TOPIC_FOOTNOTE_FRACTION = 0.2
+ENTRIES_PER_TOPIC = 20
+
+# Dimension of the random stand-ins for USE embeddings.
+EMBEDDING_SIZE = 512
+
+# Number of requests timed for each app benchmark.
+NUM_APP_REQUESTS = 200
+
+# Default allowed slowdown relative to the baseline (0.2 = 20%).
+DEFAULT_THRESHOLD = 0.2
+
+_XHTML = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>{title}</title></head><body>{body}</body></html>'
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class Chapter:
+    """A synthetic chapter.
+
+    Attributes:
+        volume: Volume name (e.g. "Book of Mormon").
+        book: Long book name (e.g. "1 Nephi").
+        book_short: Short book name (e.g. "1 Ne.").
+        chapter: Chapter number.
+        num_verses: Number of verses.
+    """
+
+    volume: str
+    book: str
+    book_short: str
+    chapter: int
+    num_verses: int
+
+
+def get_topic_name(index: int) -> str:
+    """Returns a unique topic name; topic references only allow letters, so the index is spelled out in letters."""
+    letters = []
+    while True:
+        index, remainder = divmod(index, 26)
+        letters.append(chr(ord("a") + remainder))
+        if not index:
+            break
+    return f"Topic {''.join(reversed(letters)).capitalize()}"
+
+
+class SyntheticCorpus:
+    """Generates a corpus with the structure of the Standard Works."""
+
+    def __init__(self, scale: float = 1.0, seed: int = 0):
+        """Initializes the corpus.
+
+        Args:
+            scale: Size relative to the Standard Works.
+            seed: Random seed.
+        """
+        self.scale = scale
+        self.seed = seed
+        book_names = {value: key for key, value in scripture_graph.BOOKS_SHORT.items()}
+        books = [
+            (volume, book_names[book_short], book_short)
+            for volume in scripture_graph.VOLUMES_SHORT
+            for book_short in scripture_graph.VOLUMES[volume]
+        ]
+        num_chapters = max(1, round(STANDARD_WORKS_VERSES * scale / VERSES_PER_CHAPTER / len(books)))
+        self.chapters = [
+            Chapter(volume, book, book_short, chapter, VERSES_PER_CHAPTER)
+            for volume, book, book_short in books
+            for chapter in range(1, num_chapters + 1)
+        ]
+        self.verses = [
+            f"{chapter.book_short} {chapter.chapter}:{verse}"
+            for chapter in self.chapters
+            for verse in range(1, chapter.num_verses + 1)
+        ]
+        self.topics = [get_topic_name(i) for i in range(max(1, round(STANDARD_WORKS_TOPICS * scale)))]
+        self.vocabulary = np.asarray([get_topic_name(i).split()[1].lower() for i in range(VOCABULARY_SIZE)])
+        weights = 1.0 / np.arange(1, VOCABULARY_SIZE + 1)  # Zipf.
+        self._weights = weights / weights.sum()
+
+    def get_text(self, rng: np.random.Generator, num_words: int) -> str:
+        """Generates text with Zipf-distributed words."""
+        return " ".join(self.vocabulary[rng.choice(VOCABULARY_SIZE, size=num_words, p=self._weights)])
+
+    def get_reference_text(self, rng: np.random.Generator, source: int = -1) -> str:
+        """Generates footnote text with one to three scripture references and possibly a topic reference.
+
+        Args:
+            rng: Random number generator.
+            source: Index of the verse containing the footnote; it is never a target.
+
+        Returns:
+            Footnote text.
+        """
+        indices = rng.integers(len(self.verses), size=rng.integers(1, 4))
+        indices[indices == source] = (source + 1) % len(self.verses)
+        targets = [self.verses[i] for i in indices]
+        text = "; ".join(f"{target} ({target.split(':')[1]}-{int(target.split(':')[1]) + 2})" for target in targets)
+        if rng.random() < TOPIC_FOOTNOTE_FRACTION:
+            text += f". TG {self.topics[rng.integers(len(self.topics))]}"
+        return f"{text}."
+
+    def get_chapter_xhtml(self, rng: np.random.Generator, chapter: Chapter, offset: int) -> str:
+        """Generates the XHTML document for a chapter.
+
+        Args:
+            rng: Random number generator.
+            chapter: Chapter.
+            offset: Index of the first verse of the chapter in `verses`.
+
+        Returns:
+            XHTML document.
+        """
+        body = [f'<p class="titleNumber">Chapter {chapter.chapter}</p>']
+        footnotes = []
+        for verse in range(1, chapter.num_verses + 1):
+            text = saxutils.escape(self.get_text(rng, max(1, rng.poisson(WORDS_PER_VERSE))))
+            marker = '<sup class="marker">a</sup>'
+            body.append(f'<p class="verse"><span class="verseNumber">{verse}</span>{marker}{text}</p>')
+            for _ in range(rng.poisson(FOOTNOTES_PER_VERSE)):
+                reference = saxutils.escape(self.get_reference_text(rng, source=offset + verse - 1))
+                footnotes.append(f'<li class="listItem"><p class="label-verse">{verse}</p><p>{reference}</p></li>')
+        body.append(f'<ul>{"".join(footnotes)}</ul>')
+        return _XHTML.format(title=f"{chapter.book} Chapter {chapter.chapter}", body="".join(body))
+
+    def get_topic_xhtml(self, rng: np.random.Generator, topic: str) -> str:
+        """Generates the XHTML document for a Topical Guide topic."""
+        entries = []
+        for i in rng.integers(len(self.verses), size=max(1, rng.poisson(ENTRIES_PER_TOPIC))):
+            locator = saxutils.escape(self.verses[i])
+            snippet = saxutils.escape(self.get_text(rng, 8))
+            entries.append(f'<p class="entry"><span class="locator">{locator};</span> {snippet}</p>')
+        return _XHTML.format(title=topic, body="".join(entries))
+
+    def write_epubs(self, dirname: str) -> list[str]:
+        """Writes one EPUB per volume, plus one for the Topical Guide.
+
+        Returns:
+            List of EPUB filenames.
+        """
+        rng = np.random.default_rng(self.seed)
+        os.makedirs(dirname, exist_ok=True)
+        filenames = []
+        for volume, volume_short in scripture_graph.VOLUMES_SHORT.items():
+            filename = os.path.join(dirname, f"{volume_short.replace('&', '')}.epub")
+            with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+                offset = 0
+                for i, chapter in enumerate(self.chapters):
+                    if chapter.volume == volume:
+                        archive.writestr(f"OEBPS/chapter_{i:06d}.xhtml", self.get_chapter_xhtml(rng, chapter, offset))
+                    offset += chapter.num_verses
+            filenames.append(filename)
+        filename = os.path.join(dirname, "TG.epub")
+        with zipfile.ZipFile(filename, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            for i, topic in enumerate(self.topics):
+                archive.writestr(f"OEBPS/tg_{i:06d}.xhtml", self.get_topic_xhtml(rng, topic))
+        filenames.append(filename)
+        return filenames
+
+
+def read_epubs(filenames: list[str]) -> graph_lib.ScriptureGraph:
+    """Parses and merges EPUBs."""
+    merged = graph_lib.ScriptureGraph()
+    for filename in filenames:
+        parsed = graph_lib.read_epub(filename)
+        merged.verses.update(parsed.verses)
+        merged.topics.update(parsed.topics)
+        merged.references.extend(parsed.references)
+    return merged
+
+
+@contextlib.contextmanager
+def working_directory(dirname: str) -> Iterator[None]:
+    """Temporarily changes the working directory."""
+    cwd = os.getcwd()
+    os.chdir(dirname)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def load_app(app_dir: str, data_parent: str) -> Any:
+    """Loads the app module (app/main.py) in-process.
+
+    Args:
+        app_dir: Directory containing main.py and the templates.
+        data_parent: Directory containing the data directory (see app/setup.sh).
+
+    Returns:
+        The app module; its `app` attribute is the Flask app.
+    """
+    spec = importlib.util.spec_from_file_location("main", os.path.join(app_dir, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    # NOTE(kearnes): Flask finds templates relative to the module registered under the app's import name, and
+    # app/asgi.py imports the app module by name.
+    sys.modules[spec.name] = module
+    with working_directory(data_parent):
+        spec.loader.exec_module(module)
+    module.app.logger.setLevel(logging.WARNING)
+    return module
+
+
+def load_asgi_app(app_dir: str) -> Any:
+    """Loads the ASGI module (app/asgi.py) for the app module most recently loaded by `load_app`.
+
+    Returns:
+        The ASGI module; its `app` attribute is the ASGI application.
+    """
+    spec = importlib.util.spec_from_file_location("asgi", os.path.join(app_dir, "asgi.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class BenchmarkContext:
+    """Lazily generates the corpus and the intermediate results used by the benchmarks."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, workdir: str, scale: float, seed: int, max_verses: int, app_dir: str
+    ):
+        """Initializes the context.
+
+        Args:
+            workdir: Directory for generated files.
+            scale: Corpus size relative to the Standard Works.
+            seed: Random seed.
+            max_verses: Number of verses used for quadratic stages.
+            app_dir: Directory containing the app (main.py and templates).
+        """
+        self.workdir = workdir
+        self.scale = scale
+        self.seed = seed
+        self.max_verses = max_verses
+        self.app_dir = os.path.abspath(app_dir)
+        self.rng = np.random.default_rng(seed)
+
+    @functools.cached_property
+    def corpus(self) -> SyntheticCorpus:
+        """Synthetic corpus."""
+        return SyntheticCorpus(scale=self.scale, seed=self.seed)
+
+    @functools.cached_property
+    def epubs(self) -> list[str]:
+        """Generated EPUB filenames."""
+        return self.corpus.write_epubs(os.path.join(self.workdir, "epub"))
+
+    @functools.cached_property
+    def scripture_graph(self) -> graph_lib.ScriptureGraph:
+        """Parsed corpus."""
+        return read_epubs(self.epubs)
+
+    @functools.cached_property
+    def graph(self) -> nx.DiGraph:
+        """Canonical graph, including topic nodes."""
+        return graph_lib.assemble_graph(self.scripture_graph, include_topics=True)
+
+    @functools.cached_property
+    def subgraph(self) -> nx.DiGraph:
+        """Canonical graph restricted to the first `max_verses` verses (no topics)."""
+        return self.graph.subgraph(self.corpus.verses[: self.max_verses]).copy()
+
+    @functools.cached_property
+    def embeddings(self) -> np.ndarray:
+        """Random unit-length stand-ins for the USE embeddings of the subgraph verses."""
+        embeddings = self.rng.normal(size=(self.subgraph.number_of_nodes(), EMBEDDING_SIZE)).astype(np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    @functools.cached_property
+    def threshold(self) -> float:
+        """Similarity threshold that keeps about ten suggested pairs per verse (like the real embeddings)."""
+        similarity = graph_lib.angular_cosine(self.embeddings)
+        num_kept = min(similarity.size - 1, 20 * similarity.shape[0])
+        return float(np.partition(similarity.ravel(), -num_kept)[-num_kept])
+
+    @functools.cached_property
+    def graph_filename(self) -> str:
+        """Graph with suggested edges (within the subgraph), written as GraphML."""
+        graph = self.graph.copy()
+        graph_lib.add_suggested_edges(graph, graph_lib.get_jaccard_edges(self.subgraph))
+        graph_lib.add_suggested_edges(
+            graph, graph_lib.get_use_edges(self.subgraph, self.threshold, embeddings=self.embeddings)
+        )
+        filename = os.path.join(self.workdir, "scripture_graph.graphml")
+        build_graph.write_graph(graph, filename)
+        data_dir = os.path.join(self.workdir, "app", "data")
+        os.makedirs(data_dir, exist_ok=True)
+        graph_lib.write_tree(graph, os.path.join(data_dir, "tree.json"))
+        graph_lib.write_rollups(graph, os.path.join(data_dir, "rollups.json"))
+        return filename
+
+    def run_build_connections(self) -> None:
+        """Writes the app data with build_connections.py."""
+        data_dir = os.path.join(self.workdir, "app", "data")
+        build_connections.main(
+            **{
+                "--input": self.graph_filename,
+                "--output": os.path.join(data_dir, "connections.json"),
+                "--index": os.path.join(data_dir, "index.npz"),
+                "--search_index": os.path.join(data_dir, "search.npz"),
+                "--topic_index": os.path.join(data_dir, "topics.npz"),
+                "--layouts": os.path.join(data_dir, "layouts.npz"),
+                "--hot_set": os.path.join(data_dir, "hot.json"),
+                "--access_logs": None,
+                "--hot_set_size": "1000",
+                "--export_static": None,
+                "--cache_dir": None,
+                "--cache_size": "0",
+                "--force": False,
+            }
+        )
+
+    @functools.cached_property
+    def app(self) -> Any:
+        """The app module, loaded with the generated data."""
+        if not os.path.exists(os.path.join(self.workdir, "app", "data", "connections.json")):
+            self.run_build_connections()
+        return load_app(self.app_dir, os.path.join(self.workdir, "app"))
+
+    @functools.cached_property
+    def request_verses(self) -> list[str]:
+        """Verses used for app requests."""
+        verses = list(self.app.CONNECTIONS)
+        return [verses[i] for i in self.rng.choice(len(verses), size=min(NUM_APP_REQUESTS, len(verses)))]
+
+
+def _bench_parse_reference(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    rng = np.random.default_rng(context.seed)
+    texts = [context.corpus.get_reference_text(rng) for _ in range(10000)]
+    return lambda: [graph_lib.parse_reference(text) for text in texts], len(texts)
+
+
+def _bench_read_epub(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    return lambda: read_epubs(context.epubs), len(context.corpus.verses)
+
+
+def _bench_jaccard(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    graph = context.subgraph.to_undirected()
+    return lambda: graph_lib.jaccard(graph), graph.number_of_nodes()
+
+
+def _bench_angular_cosine(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    return lambda: graph_lib.angular_cosine(context.embeddings), len(context.embeddings)
+
+
+def _bench_get_nonzero_edges(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    similarity = graph_lib.angular_cosine(context.embeddings)
+    similarity[similarity < context.threshold] = 0.0
+    return lambda: graph_lib.get_nonzero_edges(context.subgraph, similarity), len(similarity)
+
+
+def _bench_build_connections(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    return context.run_build_connections, len(context.corpus.verses)
+
+
+def _bench_elements(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    app = context.app
+    render = app._render_elements.__wrapped__  # pylint: disable=protected-access
+
+    def _run():
+        for verse in context.request_verses:
+            render(app.BUILD_ID, verse, app.FilterMode.ALL, True)
+
+    return _run, len(context.request_verses)
+
+
+def _bench_table(context: BenchmarkContext) -> tuple[Callable[[], Any], int]:
+    app = context.app
+    render = app._render_table.__wrapped__  # pylint: disable=protected-access
+
+    def _run():
+        with app.app.app_context():
+            for verse in context.request_verses:
+                render(app.BUILD_ID, verse)
+
+    return _run, len(context.request_verses)
+
+
+# Benchmarks, in the order they run. Each function prepares its inputs (outside the timed region) and returns a
+# function to time and the number of items it processes.
+BENCHMARKS = {
+    "parse_reference": _bench_parse_reference,
+    "read_epub": _bench_read_epub,
+    "jaccard": _bench_jaccard,
+    "angular_cosine": _bench_angular_cosine,
+    "get_nonzero_edges": _bench_get_nonzero_edges,
+    "build_connections": _bench_build_connections,
+    "elements": _bench_elements,
+    "table": _bench_table,
+}
+
+
+def time_function(function: Callable[[], Any], repeats: int) -> list[float]:
+    """Times repeated calls to a function, in seconds."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmarks(
+    context: BenchmarkContext, repeats: int = 3, names: Optional[list[str]] = None
+) -> dict[str, dict[str, Any]]:
+    """Runs benchmarks.
+
+    Args:
+        context: BenchmarkContext.
+        repeats: Number of timed calls for each benchmark.
+        names: Optional subset of BENCHMARKS to run.
+
+    Returns:
+        Results dict with "metadata" and "benchmarks".
+    """
+    benchmarks = {}
+    for name, benchmark in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        function, items = benchmark(context)
+        times = time_function(function, repeats)
+        benchmarks[name] = {
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.mean(times),
+            "repeats": repeats,
+            "items": items,
+            "per_item": min(times) / max(items, 1),
+        }
+        logger.info(f"{name}: {min(times):.3f}s ({items} items)")
+    metadata = {
+        "scale": context.scale,
+        "seed": context.seed,
+        "max_verses": context.max_verses,
+        "num_verses": len(context.corpus.verses),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    return {"metadata": metadata, "benchmarks": benchmarks}
+
+
+def compare(
+    results: dict[str, Any],
+    baseline: dict[str, Any],
+    threshold: float = DEFAULT_THRESHOLD,
+    thresholds: Optional[dict[str, float]] = None,
+) -> list[str]:
+    """Compares results to a baseline.
+
+    Timings are compared by their minimum, which is the least noisy statistic.
+
+    Args:
+        results: Results from `run_benchmarks`.
+        baseline: Baseline results.
+        threshold: Allowed slowdown (0.2 allows the minimum to be up to 20% higher than in the baseline).
+        thresholds: Optional dict of per-benchmark thresholds that override `threshold`.
+
+    Returns:
+        List of regression messages.
+
+    Raises:
+        ValueError: If the results and baseline were generated with different corpus settings.
+    """
+    for key in ["scale", "seed", "max_verses"]:
+        if results["metadata"][key] != baseline["metadata"][key]:
+            raise ValueError(
+                f"{key} differs from the baseline: {results['metadata'][key]} vs. {baseline['metadata'][key]}"
+            )
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            continue
+        limit = (thresholds or {}).get(name, threshold)
+        ratio = result["min"] / baseline["benchmarks"][name]["min"]
+        logger.info(f"{name}: {ratio:.2f}x baseline")
+        if ratio > 1 + limit:
+            regressions.append(f"{name}: {ratio:.2f}x baseline (limit {1 + limit:.2f}x)")
+    return regressions
+
+
+def load_results(filename: str) -> dict[str, Any]:
+    """Loads benchmark results."""
+    with open(filename, encoding="utf-8") as f:
+        return json.load(f)
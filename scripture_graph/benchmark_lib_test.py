@@ -0,0 +1,45 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.benchmark_lib."""
+import pytest
+
+from scripture_graph import benchmark_lib
+
+
+def test_get_topic_name():
+    names = [benchmark_lib.get_topic_name(i) for i in range(1000)]
+    assert len(set(names)) == len(names)
+    assert all(name.replace(" ", "").isalpha() for name in names)
+
+
+def test_synthetic_corpus(tmp_path):
+    corpus = benchmark_lib.SyntheticCorpus(scale=0.01)
+    filenames = corpus.write_epubs(tmp_path.as_posix())
+    graph = benchmark_lib.read_epubs(filenames)
+    assert set(graph.verses) == set(corpus.verses)
+    assert set(graph.topics) == {f"TG {topic}" for topic in corpus.topics}
+    # Every reference target is a generated verse or topic.
+    assert {reference.target for reference in graph.references} <= set(graph.verses) | set(graph.topics)
+    assert any(reference.source in graph.topics for reference in graph.references)
+    assert any(reference.target in graph.topics for reference in graph.references)
+
+
+def test_compare():
+    metadata = {"scale": 1.0, "seed": 0, "max_verses": 10}
+    baseline = {"metadata": metadata, "benchmarks": {"a": {"min": 1.0}, "b": {"min": 1.0}}}
+    results = {"metadata": metadata, "benchmarks": {"a": {"min": 1.1}, "b": {"min": 1.5}, "c": {"min": 9.0}}}
+    assert benchmark_lib.compare(results, baseline) == ["b: 1.50x baseline (limit 1.20x)"]
+    assert not benchmark_lib.compare(results, baseline, thresholds={"b": 0.6})
+    with pytest.raises(ValueError, match="scale differs"):
+        benchmark_lib.compare({"metadata": dict(metadata, scale=2.0), "benchmarks": {}}, baseline)
@@ -14,57 +14,344 @@
 """Precomputes connections for the Connection Explorer.
 
 Usage:
-    build_connections.py --input=<str> --output=<str>
+    build_connections.py --input=<str> --output=<str> [options]
 
 Options:
-    --input=<str>       Input GraphML filename.
-    --output=<str>      Output JSON filename.
+    --input=<str>           Input GraphML filename.
+    --output=<str>          Output JSON filename.
+    --index=<str>           Output NPZ filename for the compact adjacency index (see graph_lib.Adjacency).
+    --search_index=<str>    Output NPZ filename for the full-text search index (see search_lib.SearchIndex).
+    --topic_index=<str>     Output NPZ filename for the verse x topic index (see graph_lib.TopicIndex).
+    --layouts=<str>         Output NPZ filename for precomputed neighborhood layouts (see layout_lib.Layouts).
+    --hot_set=<str>         Output JSON filename for the hot set of requests to pre-render during app warmup (see
+                            hotset_lib).
+    --access_logs=<str>     Glob pattern for access logs used to rank the hot set; verses are ranked by PageRank
+                            when no logs are given (or to fill out the hot set).
+    --hot_set_size=<int>    Maximum number of hot /elements and /table requests [default: 1000].
+    --export_static=<str>   Output directory for a static export of all explorer responses.
+    --templates=<str>       Directory containing the app templates [default: templates].
+    --num_workers=<int>     Number of export processes; 0 uses all CPUs [default: 0].
+    --cache_dir=<str>       Directory for cached stage outputs (see pipeline_lib).
+    --cache_size=<float>    Maximum cache size, in GiB [default: 8].
+    --force                 Recompute every stage and rewrite every output, ignoring the cache.
+
+With --cache_dir, the parsed input graph and the connections are cached by the
+digest of the input file, and outputs are only rewritten when they are stale.
+
+The static export contains the client's initial /elements response for every
+verse (for each filter mode and suggested-edge setting; the first page of
+hotset_lib.CLIENT_MAX_NODES neighbors, with the cursor for the next page) and
+every /table response, stored as content-addressed blobs with precompressed
+copies:
+
+    blobs/<digest[:2]>/<digest>.json{,.gz,.br}
+
+Blobs are located through one index shard per chapter, which maps each verse to
+its blob digests (see explorer_lib.get_shard_name and get_variant_name):
+
+    index/<shard>.json{,.gz,.br}
 """
+import hashlib
 import json
+import logging
+import multiprocessing
+import os
+import tempfile
+from typing import Any, Iterable, Optional
 
 import docopt
+import jinja2
 import networkx as nx
 
+from scripture_graph import explorer_lib
 from scripture_graph import graph_lib
+from scripture_graph import hotset_lib
+from scripture_graph import layout_lib
+from scripture_graph import pipeline_lib
+from scripture_graph import search_lib
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
-def main(**kwargs):
-    graph = nx.read_graphml(kwargs["--input"])
-    graph_lib.remove_topic_nodes(graph)
-    connections = {}
+# Compression settings for the static export.
+EXPORT_GZIP_LEVEL = 9
+EXPORT_BROTLI_QUALITY = 9
+
+# Per-process state for export workers; see _init_export_worker.
+_EXPORT_STATE = {}
+
+
+def export_static(
+    connections: explorer_lib.Connections,
+    output_dir: str,
+    templates: str,
+    num_workers: Optional[int] = None,
+    layouts: Optional[layout_lib.Layouts] = None,
+) -> None:
+    """Writes a static export of all explorer responses.
+
+    Args:
+        connections: Dict of connections keyed by verse.
+        output_dir: Output directory.
+        templates: Directory containing the app templates.
+        num_workers: Number of worker processes; None uses all CPUs.
+        layouts: Optional precomputed layouts; node positions are included in /elements responses.
+    """
+    chapters = explorer_lib.get_chapters(connections)
+    logger.info(f"Exporting {len(connections)} verses in {len(chapters)} chapters to {output_dir}")
+    with multiprocessing.Pool(
+        num_workers, initializer=_init_export_worker, initargs=(connections, output_dir, templates, layouts)
+    ) as pool:
+        for count, chapter in enumerate(pool.imap_unordered(_export_chapter, chapters.items()), start=1):
+            if count % 100 == 0:
+                logger.info(f"Exported {count}/{len(chapters)} chapters (last: {chapter})")
+
+
+def _init_export_worker(
+    connections: explorer_lib.Connections, output_dir: str, templates: str, layouts: Optional[layout_lib.Layouts]
+) -> None:
+    """Initializes the state for an export worker."""
+    environment = jinja2.Environment(loader=jinja2.FileSystemLoader(templates), autoescape=jinja2.select_autoescape())
+    _EXPORT_STATE["connections"] = connections
+    _EXPORT_STATE["output_dir"] = output_dir
+    _EXPORT_STATE["layouts"] = layouts
+    _EXPORT_STATE["table_template"] = environment.get_template("table.html")
+
+
+def _export_chapter(item: tuple[str, list[str]]) -> str:
+    """Exports the responses for all verses in a chapter and writes its index shard."""
+    chapter, verses = item
+    connections = _EXPORT_STATE["connections"]
+    output_dir = _EXPORT_STATE["output_dir"]
+    index = {}
+    for verse in verses:
+        elements = {}
+        positions = _EXPORT_STATE["layouts"] and _EXPORT_STATE["layouts"].get_positions(connections, verse)
+        for filter_mode in explorer_lib.FilterMode:
+            for include_suggested in [False, True]:
+                data = explorer_lib.get_elements(
+                    connections,
+                    verse=verse,
+                    filter_mode=filter_mode,
+                    include_suggested=include_suggested,
+                    max_nodes=hotset_lib.CLIENT_MAX_NODES,
+                    positions=positions,
+                )
+                variant = explorer_lib.get_variant_name(filter_mode, include_suggested)
+                elements[variant] = _write_blob(output_dir, json.dumps(data).encode("utf-8"))
+        table = _EXPORT_STATE["table_template"].render(**explorer_lib.get_table_args(connections, verse))
+        index[verse] = {"elements": elements, "table": _write_blob(output_dir, json.dumps(table).encode("utf-8"))}
+    dirname = os.path.join(output_dir, "index")
+    os.makedirs(dirname, exist_ok=True)
+    _write_compressed(
+        os.path.join(dirname, f"{explorer_lib.get_shard_name(chapter)}.json"), json.dumps(index).encode("utf-8")
+    )
+    return chapter
+
+
+def _write_blob(output_dir: str, data: bytes) -> str:
+    """Writes a content-addressed blob (if it does not already exist) and returns its digest."""
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    dirname = os.path.join(output_dir, "blobs", digest[:2])
+    filename = os.path.join(dirname, f"{digest}.json")
+    if not os.path.exists(filename):
+        os.makedirs(dirname, exist_ok=True)
+        _write_compressed(filename, data)
+    return digest
+
+
+def _write_compressed(filename: str, data: bytes) -> None:
+    """Atomically writes a file along with its gzip and brotli copies.
+
+    The uncompressed file is written last, so its presence means the set is complete.
+    """
+    compressed_gzip, compressed_br = explorer_lib.compress(
+        data, gzip_level=EXPORT_GZIP_LEVEL, brotli_quality=EXPORT_BROTLI_QUALITY
+    )
+    for suffix, contents in [(".gz", compressed_gzip), (".br", compressed_br), ("", data)]:
+        with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(filename), delete=False) as f:
+            f.write(contents)
+        os.replace(f.name, f"{filename}{suffix}")
+
+
+def _get_neighbors(graph: nx.DiGraph, verse: str) -> tuple[set[str], set[str], dict[str, float]]:
+    """Returns the incoming, outgoing, and suggested neighbors (with similarities) of a verse."""
+    incoming = set()
+    outgoing = set()
+    suggested = {}
+    for source, target in graph.in_edges(verse):
+        assert target == verse
+        kind = graph.edges[(source, target)].get("kind")
+        if kind:
+            suggested[source] = graph.edges[(source, target)].get("similarity", 0.0)
+        else:
+            incoming.add(source)
+    for source, target in graph.out_edges(verse):
+        assert source == verse
+        kind = graph.edges[(source, target)].get("kind")
+        if kind:
+            suggested[target] = graph.edges[(source, target)].get("similarity", 0.0)
+        else:
+            outgoing.add(target)
+    return incoming, outgoing, suggested
+
+
+def get_connections(graph: nx.DiGraph, verses: Optional[Iterable[str]] = None) -> explorer_lib.Connections:
+    """Builds the connections for each verse in the graph.
+
+    Neighbor lists are stored in rank order: canonical neighbors by decreasing
+    in-degree and suggested neighbors by decreasing similarity. The combined
+    "ranked" list (reciprocal neighbors first, then other canonical neighbors,
+    then suggested neighbors) lets the explorer truncate large neighborhoods in
+    O(k); each entry is a [neighbor, kind] pair.
+
+    Centrality scores, component labels, and community labels stored on the
+    nodes (see graph_lib.add_centrality, graph_lib.add_components, and
+    graph_lib.add_communities) are copied into the connections.
+
+    Args:
+        graph: Graph without topic nodes.
+        verses: Optional subset of verses to build connections for.
+
+    Returns:
+        Dict of connections keyed by verse.
+    """
+    in_degree = {}
     for verse in graph.nodes:
-        incoming = set()
-        outgoing = set()
-        suggested = set()
-        for source, target in graph.in_edges(verse):
-            assert target == verse
-            kind = graph.edges[(source, target)].get("kind")
-            if kind:
-                suggested.add(source)
-            else:
-                incoming.add(source)
-        for source, target in graph.out_edges(verse):
-            assert source == verse
-            kind = graph.edges[(source, target)].get("kind")
-            if kind:
-                suggested.add(target)
-            else:
-                outgoing.add(target)
+        in_degree[verse] = sum(1 for edge in graph.in_edges(verse) if not graph.edges[edge].get("kind"))
+
+    def _by_in_degree(nodes: set[str]) -> list[str]:
+        return sorted(nodes, key=lambda node: (-in_degree[node], node))
+
+    connections = {}
+    for verse in graph.nodes if verses is None else verses:
+        incoming, outgoing, suggested = _get_neighbors(graph, verse)
         data = graph.nodes[verse]
         connections[verse] = {
             "volume": data["volume"],
             "book": data["book"],
             "chapter": data["chapter"],
             "verse": data["verse"],
+            "in_degree": in_degree[verse],
         }
+        connections[verse].update(get_derived_attributes(data))
         if incoming:
-            connections[verse]["incoming"] = list(incoming)
+            connections[verse]["incoming"] = _by_in_degree(incoming)
         if outgoing:
-            connections[verse]["outgoing"] = list(outgoing)
+            connections[verse]["outgoing"] = _by_in_degree(outgoing)
         if suggested:
-            connections[verse]["suggested"] = list(suggested)
-    with open(kwargs["--output"], "w", encoding="utf-8") as f:
-        json.dump(connections, f, indent=2)
+            ordered = sorted(suggested.items(), key=lambda item: (-item[1], item[0]))
+            connections[verse]["suggested"] = [node for node, _ in ordered]
+        ranked = [[node, "both"] for node in _by_in_degree(incoming & outgoing)]
+        for node in _by_in_degree(incoming ^ outgoing):
+            ranked.append([node, "incoming" if node in incoming else "outgoing"])
+        ranked.extend([node, "suggested"] for node in connections[verse].get("suggested", []))
+        if ranked:
+            connections[verse]["ranked"] = ranked
+    return connections
+
+
+def get_derived_attributes(data: dict[str, Any]) -> dict[str, Any]:
+    """Returns the centrality scores, component labels, and community labels stored on a node."""
+    names = graph_lib.CENTRALITY_MEASURES + graph_lib.COMPONENT_ATTRIBUTES + graph_lib.COMMUNITY_ATTRIBUTES
+    return {name: data[name] for name in names if name in data}
+
+
+def get_search_index(graph: nx.DiGraph, connections: explorer_lib.Connections) -> search_lib.SearchIndex:
+    """Builds a full-text search index over verse text, with verses in Standard Works order."""
+    verses = explorer_lib.sort_verses(connections, list(connections))
+    texts = [graph_lib.prepare_text(graph.nodes[verse].get("text") or "") for verse in verses]
+    return search_lib.SearchIndex.from_texts(verses, texts)
+
+
+def write_json(data: Any, filename: str) -> None:
+    """Writes indented JSON."""
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def write_index(graph: nx.DiGraph, filename: str) -> None:
+    """Writes the compact adjacency index."""
+    graph_lib.Adjacency.from_graph(graph).save(filename)
+
+
+def write_layouts(connections: explorer_lib.Connections, filename: str) -> None:
+    """Writes the precomputed neighborhood layouts."""
+    layout_lib.Layouts.from_connections(connections).save(filename)
+
+
+def write_search_index(graph: nx.DiGraph, connections: explorer_lib.Connections, filename: str) -> None:
+    """Writes the full-text search index."""
+    get_search_index(graph, connections).save(filename)
+
+
+def write_topic_index(graph: nx.DiGraph, filename: str) -> None:
+    """Writes the verse x topic index."""
+    graph_lib.TopicIndex.from_graph(graph).save(filename)
+
+
+def write_hot_set(
+    graph: nx.DiGraph,
+    connections: explorer_lib.Connections,
+    log_filenames: list[str],
+    size: int,
+    filename: str,
+) -> None:
+    """Writes the hot set."""
+    elements_counts, table_counts = hotset_lib.read_access_logs(log_filenames)
+    hot_set = hotset_lib.get_hot_set(
+        connections,
+        hotset_lib.rank_verses(graph),
+        size,
+        elements_counts=elements_counts,
+        table_counts=table_counts,
+    )
+    logger.info(
+        f"Hot set has {len(hot_set['elements'])} /elements and {len(hot_set['table'])} /table requests "
+        f"(source: {hot_set['source']})"
+    )
+    write_json(hot_set, filename)
+
+
+def main(**kwargs):
+    pipeline = pipeline_lib.get_pipeline(kwargs["--cache_dir"], float(kwargs["--cache_size"]), force=kwargs["--force"])
+    digest = pipeline_lib.get_file_digest(kwargs["--input"])
+    graph = pipeline.run("read_graph", nx.read_graphml, kwargs["--input"], inputs=[digest]).value
+    if kwargs["--topic_index"]:
+        pipeline.write("topic_index", kwargs["--topic_index"], write_topic_index, graph, inputs=[digest])
+    graph_lib.remove_topic_nodes(graph)
+    connections = pipeline.run("connections", get_connections, graph, inputs=[digest])
+    pipeline.write("connections_json", kwargs["--output"], write_json, connections.value, inputs=[connections.key])
+    if kwargs["--index"]:
+        pipeline.write("index", kwargs["--index"], write_index, graph, inputs=[digest])
+    if kwargs["--layouts"]:
+        pipeline.write("layouts", kwargs["--layouts"], write_layouts, connections.value, inputs=[connections.key])
+    if kwargs["--search_index"]:
+        pipeline.write(
+            "search_index", kwargs["--search_index"], write_search_index, graph, connections.value, inputs=[digest]
+        )
+    if kwargs["--hot_set"]:
+        log_filenames = hotset_lib.get_log_filenames(kwargs["--access_logs"]) if kwargs["--access_logs"] else []
+        size = int(kwargs["--hot_set_size"])
+        pipeline.write(
+            "hot_set",
+            kwargs["--hot_set"],
+            write_hot_set,
+            graph,
+            connections.value,
+            log_filenames,
+            size,
+            inputs=[connections.key] + [pipeline_lib.get_file_digest(filename) for filename in log_filenames],
+            params={"size": size},
+        )
+    if kwargs["--export_static"]:
+        export_static(
+            connections.value,
+            output_dir=kwargs["--export_static"],
+            templates=kwargs["--templates"],
+            num_workers=int(kwargs["--num_workers"]) or None,
+            layouts=layout_lib.Layouts.load(kwargs["--layouts"]) if kwargs["--layouts"] else None,
+        )
 
 
 if __name__ == "__main__":
@@ -14,25 +14,58 @@
 """Builds a scripture graph.
 
 Usage:
-    build_graph.py --input_pattern=<str> --output=<str> [--tree=<str> --topics --suggested --threshold=<float>]
+    build_graph.py --input_pattern=<str> --output=<str> [--tree=<str> --rollups=<str> --topics --suggested]
+        [--threshold=<float>]
+        [--centrality --warm_start=<str> --components --communities --seed=<int>] [--records=<str>]
+        [--cache_dir=<str> --cache_size=<float> --force] [--profile=<str> --cprofile=<str>]
 
 Options:
     --input_pattern=<str>       Input EPUB pattern.
     --output=<str>              Output graph filename (usually *.graphml).
     --tree=<str>                Output tree filename.
+    --rollups=<str>             Output JSON filename for volume, book, and chapter rollup graphs.
     --topics                    Include topic nodes.
     --suggested                 Include suggested edges.
     --threshold=<float>         Similarity threshold [default: 0.77].
+    --centrality                Add centrality scores (see graph_lib.CENTRALITY_MEASURES) to verse nodes.
+    --warm_start=<str>          Previous graph with centrality scores, used to warm-start the power iterations.
+    --components                Add weak and strong component labels and sizes (see graph_lib.add_components).
+    --communities               Add verse community labels and sizes (see graph_lib.add_communities).
+    --seed=<int>                Random seed for community detection [default: 0].
+    --records=<str>             Output directory for per-EPUB records and USE embeddings, used by update_graph.py
+                                for incremental rebuilds (see incremental_lib.BuildRecords).
+    --cache_dir=<str>           Directory for cached stage outputs (see pipeline_lib).
+    --cache_size=<float>        Maximum cache size, in GiB [default: 8].
+    --force                     Recompute every stage and rewrite every output, ignoring the cache.
+    --profile=<str>             Output JSON filename for a profile of the build: wall time, CPU time, and peak RSS
+                                for each stage (see profile_lib), plus percentiles of per-document parse times.
+    --cprofile=<str>            With --profile, output filename for cProfile stats (see pstats) of the slowest
+                                stage. Note that this slows down every stage.
+
+The build runs as a series of stages: parse (one per EPUB) -> correct_topics ->
+assemble -> jaccard -> embeddings -> use -> derived -> graph, tree, and rollups.
+With --cache_dir, each stage is keyed by its inputs, parameters, and the code
+version, so only stages downstream of a change are recomputed; for example,
+changing --threshold reruns only the use stage (which applies the threshold to
+cached embeddings) and the stages that follow it.
+
+To profile a full build, combine --profile with --force (cached stages are
+reported, but only with the time it took to load them).
 """
-import dataclasses
 import logging
 import glob
 import json
+import os
+from typing import Any, Optional
 
 import docopt
 import networkx as nx
+import numpy as np
 
 from scripture_graph import graph_lib
+from scripture_graph import incremental_lib
+from scripture_graph import pipeline_lib
+from scripture_graph import profile_lib
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -51,47 +84,180 @@ def write_graph(graph: nx.Graph, filename: str) -> None:
         raise NotImplementedError(filename)
 
 
-def main(**kwargs) -> None:
-    scripture_graph = graph_lib.ScriptureGraph()
-    for filename in glob.glob(kwargs["--input_pattern"]):
-        logger.info(filename)
-        this_graph = graph_lib.read_epub(filename)
-        scripture_graph.update(this_graph)
-        logger.info(this_graph)
-    logger.info(scripture_graph)
-    graph = nx.DiGraph()
-    for key, verse in scripture_graph.verses.items():
-        volume = graph_lib.get_volume(verse.book)
-        graph.add_node(key, kind="verse", volume=volume, **dataclasses.asdict(verse))
-    if kwargs["--topics"]:
-        for key, topic in scripture_graph.topics.items():
-            volume = graph_lib.get_volume(topic.source)
-            graph.add_node(key, kind="topic", volume=volume, **dataclasses.asdict(topic))
-    references = graph_lib.correct_topic_references(
+def get_options(kwargs: dict[str, Any]) -> dict[str, Any]:
+    """Extracts the options that affect the graph (stored with the records for incremental rebuilds)."""
+    return {
+        "topics": kwargs["--topics"],
+        "suggested": kwargs["--suggested"],
+        "threshold": float(kwargs["--threshold"]),
+        "centrality": kwargs["--centrality"],
+        "components": kwargs["--components"],
+        "communities": kwargs["--communities"],
+        "seed": int(kwargs["--seed"]),
+    }
+
+
+def correct_references(scripture_graph: graph_lib.ScriptureGraph) -> list[graph_lib.Reference]:
+    """Corrects incomplete topic references (see graph_lib.correct_topic_references)."""
+    return graph_lib.correct_topic_references(
         verses=list(scripture_graph.verses.keys()),
         topics=list(scripture_graph.topics.keys()),
         references=scripture_graph.references,
     )
-    duplicated_edges = 0
-    for reference in references:
-        if reference.source not in graph.nodes:
-            raise KeyError(f"missing source for {reference}")
-        if reference.target not in graph.nodes:
-            raise KeyError(f"missing target for {reference}")
-        if (reference.source, reference.target) in graph.edges:
-            duplicated_edges += 1
-        else:
-            graph.add_edge(reference.source, reference.target)
-    if duplicated_edges:
-        logger.info(f"ignored {duplicated_edges} duplicated edges")
+
+
+def get_derived_attributes(
+    graph: nx.DiGraph, options: dict[str, Any], previous: Optional[dict[str, dict[str, float]]] = None
+) -> dict[str, dict[str, Any]]:
+    """Adds derived node attributes to the graph (in place) and returns them, keyed by node."""
+    incremental_lib.add_derived_attributes(graph, options, previous=previous)
+    return {
+        node: {name: data[name] for name in incremental_lib.DERIVED_ATTRIBUTES if name in data}
+        for node, data in graph.nodes(data=True)
+    }
+
+
+def add_suggested_edges(
+    pipeline: pipeline_lib.Pipeline,
+    graph: nx.DiGraph,
+    graph_key: str,
+    threshold: float,
+    records: incremental_lib.BuildRecords,
+) -> str:
+    """Runs the jaccard, embeddings, and use stages and adds suggested edges to the graph (in place).
+
+    Args:
+        pipeline: Pipeline.
+        graph: Canonical graph.
+        graph_key: Stage key for the canonical graph.
+        threshold: Similarity threshold for USE edges.
+        records: BuildRecords; the embeddings are stored here.
+
+    Returns:
+        Stage key for the graph with suggested edges.
+    """
+    jaccard = pipeline.run("jaccard", graph_lib.get_jaccard_edges, graph, inputs=[graph_key])
+    graph_lib.add_suggested_edges(graph, jaccard.value)
+    # NOTE(kearnes): Embeddings are keyed by the verse texts alone, so they survive changes to references.
+    verses = [(node, data["text"]) for node, data in graph.nodes(data=True) if data["kind"] == "verse"]
+    embeddings = pipeline.run(
+        "embeddings",
+        graph_lib.get_use_embeddings,
+        graph,
+        inputs=[pipeline_lib.get_digest(json.dumps([text for _, text in verses]).encode("utf-8"))],
+        params={"model": graph_lib.USE_MODEL_URL},
+    )
+    use = pipeline.run(
+        "use",
+        graph_lib.get_use_edges,
+        graph,
+        threshold,
+        embeddings=embeddings.value,
+        inputs=[jaccard.key, embeddings.key],
+        params={"threshold": threshold},
+    )
+    graph_lib.add_suggested_edges(graph, use.value)
+    records.embedding_nodes = np.asarray([node for node, _ in verses])
+    records.embeddings = embeddings.value
+    logger.info(f"N={graph.number_of_nodes()}, E={graph.number_of_edges()}")
+    return use.key
+
+
+def parse_epubs(
+    pipeline: pipeline_lib.Pipeline, input_pattern: str, records: incremental_lib.BuildRecords
+) -> list[str]:
+    """Runs the parse stage for each EPUB and stores the results in the records.
+
+    Returns:
+        List of parse stage keys.
+    """
+    parsed = []
+    for filename in sorted(glob.glob(input_pattern)):
+        digest = pipeline_lib.get_file_digest(filename)
+        result = pipeline.run("parse", graph_lib.read_epub, filename, inputs=[digest], label=os.path.basename(filename))
+        logger.info(f"{filename}: {result.value}")
+        records.digests[os.path.basename(filename)] = digest
+        records.graphs[os.path.basename(filename)] = result.value
+        parsed.append(result.key)
+    return parsed
+
+
+def build(**kwargs) -> None:
+    """Runs the build stages; see the module docstring for options."""
+    options = get_options(kwargs)
+    pipeline = pipeline_lib.get_pipeline(kwargs["--cache_dir"], float(kwargs["--cache_size"]), force=kwargs["--force"])
+    records = incremental_lib.BuildRecords(options=options)
+    parsed = parse_epubs(pipeline, kwargs["--input_pattern"], records)
+    scripture_graph = records.get_scripture_graph()
+    logger.info(scripture_graph)
+    references = pipeline.run("correct_topics", correct_references, scripture_graph, inputs=parsed)
+    canonical = pipeline.run(
+        "assemble",
+        graph_lib.assemble_graph,
+        scripture_graph,
+        include_topics=options["topics"],
+        references=references.value,
+        inputs=[references.key],
+        params={"topics": options["topics"]},
+    )
+    graph = canonical.value
+    graph_key = canonical.key
     logger.info(f"N={graph.number_of_nodes()}, E={graph.number_of_edges()}")
-    if kwargs["--suggested"]:
-        graph_lib.add_jaccard_edges(graph)
-        graph_lib.add_use_edges(graph, float(kwargs["--threshold"]))
-        logger.info(f"N={graph.number_of_nodes()}, E={graph.number_of_edges()}")
-    write_graph(graph, kwargs["--output"])
+    if options["suggested"]:
+        graph_key = add_suggested_edges(pipeline, graph, canonical.key, options["threshold"], records)
+    suggested_key = graph_key
+    if options["centrality"] or options["components"] or options["communities"]:
+        previous = None
+        inputs = [graph_key]
+        if kwargs["--warm_start"]:
+            previous = graph_lib.read_centrality(nx.read_graphml(kwargs["--warm_start"]))
+            logger.info(f"Warm-starting centrality from {kwargs['--warm_start']}")
+            inputs.append(pipeline_lib.get_file_digest(kwargs["--warm_start"]))
+        derived = pipeline.run(
+            "derived",
+            get_derived_attributes,
+            graph,
+            options,
+            previous=previous,
+            inputs=inputs,
+            params={name: options[name] for name in ["centrality", "components", "communities", "seed"]},
+        )
+        nx.set_node_attributes(graph, derived.value)
+        graph_key = derived.key
+    pipeline.write("graph", kwargs["--output"], write_graph, graph, inputs=[graph_key])
+    if kwargs["--records"]:
+        records.save(kwargs["--records"])
     if kwargs["--tree"]:
-        graph_lib.write_tree(graph, kwargs["--tree"])
+        # NOTE(kearnes): The tree only depends on the set of verses.
+        pipeline.write(
+            "tree",
+            kwargs["--tree"],
+            graph_lib.write_tree,
+            graph,
+            inputs=[canonical.key],
+            extra_outputs=graph_lib.get_compressed_filenames(kwargs["--tree"]),
+        )
+    if kwargs["--rollups"]:
+        pipeline.write(
+            "rollups",
+            kwargs["--rollups"],
+            graph_lib.write_rollups,
+            graph,
+            inputs=[suggested_key],
+            extra_outputs=graph_lib.get_compressed_filenames(kwargs["--rollups"]),
+        )
+
+
+def main(**kwargs) -> None:
+    profiler = profile_lib.Profiler(use_cprofile=bool(kwargs["--cprofile"])) if kwargs["--profile"] else None
+    with profile_lib.activate(profiler):
+        build(**kwargs)
+    if profiler is not None:
+        profiler.save(kwargs["--profile"])
+        logger.info(f"Wrote profile to {kwargs['--profile']}")
+        if kwargs["--cprofile"]:
+            name = profiler.dump_hottest(kwargs["--cprofile"])
+            logger.info(f"Wrote cProfile stats for stage {name} to {kwargs['--cprofile']}")
 
 
 if __name__ == "__main__":
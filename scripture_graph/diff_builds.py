@@ -0,0 +1,106 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the graphs from two builds.
+
+Usage:
+    diff_builds.py --old=<str> --new=<str> [options]
+
+Options:
+    --old=<str>                     Adjacency index (*.npz, from build_connections.py --index) or graph for the
+                                    previous build.
+    --new=<str>                     Adjacency index or graph for the new build.
+    --output=<str>                  Output JSON filename for the diff summary.
+    --max_listed=<int>              Maximum number of edges to list for each kind and change [default: 100].
+    --tolerance=<float>             Tolerance for changes in suggested edge similarities [default: 1e-6].
+    --max_removed_nodes=<int>       Fail if more than this many verses were removed.
+    --max_removed_canonical=<int>   Fail if more than this many canonical edges were removed.
+    --max_suggested_change=<float>  Fail if the fraction of suggested edges that were added, removed, or changed
+                                    (relative to the previous build) exceeds this value.
+
+Adjacency indexes load in well under a second; graphs (e.g. *.graphml) work too
+but are much slower to read. With any of the --max_* options, the script exits
+with a nonzero status when a limit is exceeded, so it can gate releases.
+"""
+import json
+import logging
+import sys
+
+import docopt
+import networkx as nx
+
+from scripture_graph import diff_lib
+from scripture_graph import graph_lib
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def load_adjacency(filename: str) -> graph_lib.Adjacency:
+    """Loads an adjacency index, building it from the verse nodes of a graph if necessary."""
+    if filename.endswith(".npz"):
+        return graph_lib.Adjacency.load(filename)
+    graph = nx.read_graphml(filename) if filename.endswith(".graphml") else nx.read_gml(filename)
+    verses = [node for node, data in graph.nodes(data=True) if data.get("kind") == "verse"]
+    return graph_lib.Adjacency.from_graph(graph.subgraph(verses))
+
+
+def check_limits(build_diff: diff_lib.BuildDiff, **kwargs) -> list[str]:
+    """Checks the diff against the --max_* options.
+
+    Returns:
+        List of failure messages.
+    """
+    failures = []
+    if kwargs["--max_removed_nodes"] is not None:
+        limit = int(kwargs["--max_removed_nodes"])
+        if len(build_diff.removed_nodes) > limit:
+            failures.append(f"{len(build_diff.removed_nodes)} verses removed (limit {limit})")
+    if kwargs["--max_removed_canonical"] is not None:
+        limit = int(kwargs["--max_removed_canonical"])
+        removed = len(build_diff.edges["canonical"].removed)
+        if removed > limit:
+            failures.append(f"{removed} canonical edges removed (limit {limit})")
+    if kwargs["--max_suggested_change"] is not None:
+        limit = float(kwargs["--max_suggested_change"])
+        changed, total = 0, 0
+        for kind, edge_diff in build_diff.edges.items():
+            if kind != "canonical":
+                changed += len(edge_diff.added) + len(edge_diff.removed) + len(edge_diff.changed)
+                total += edge_diff.old_count
+        fraction = changed / max(total, 1)
+        if fraction > limit:
+            failures.append(f"{fraction:.2%} of suggested edges changed (limit {limit:.2%})")
+    return failures
+
+
+def main(**kwargs) -> None:
+    old = load_adjacency(kwargs["--old"])
+    new = load_adjacency(kwargs["--new"])
+    build_diff = diff_lib.diff_adjacency(old, new, tolerance=float(kwargs["--tolerance"]))
+    logger.info(f"Verses: +{len(build_diff.added_nodes)} -{len(build_diff.removed_nodes)}")
+    for kind, edge_diff in build_diff.edges.items():
+        logger.info(
+            f"{kind}: {edge_diff.old_count} -> {edge_diff.new_count} edges "
+            f"(+{len(edge_diff.added)} -{len(edge_diff.removed)} ~{len(edge_diff.changed)})"
+        )
+    if kwargs["--output"]:
+        with open(kwargs["--output"], "w", encoding="utf-8") as f:
+            json.dump(build_diff.to_json(max_listed=int(kwargs["--max_listed"])), f, indent=2)
+    failures = check_limits(build_diff, **kwargs)
+    if failures:
+        sys.exit("Build diff exceeds limits: " + "; ".join(failures))
+
+
+if __name__ == "__main__":
+    main(**docopt.docopt(__doc__))
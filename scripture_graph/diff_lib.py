@@ -0,0 +1,226 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Build-to-build graph diffs.
+
+Both builds are mapped onto a shared node index (the sorted union of their node
+keys) and each edge kind is encoded as a sorted array of int64 codes
+(source * num_nodes + target). Added, removed, and changed edges then come from
+vectorized merge-joins of the sorted arrays (see `merge_join`), so comparing two
+full builds takes well under a second.
+
+Suggested edges are symmetric, so each pair is only counted once (with
+source < target in the shared index).
+"""
+import dataclasses
+from typing import Any
+
+import numpy as np
+import scipy.sparse
+
+from scripture_graph import graph_lib
+
+# Edge kinds compared by `diff_adjacency`; suggested kinds are from graph_lib.EDGE_KINDS.
+DIFF_KINDS = ("canonical",) + tuple(kind for kind in graph_lib.EDGE_KINDS if kind != "canonical")
+
+
+def merge_join(left: np.ndarray, right: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Matches two sorted arrays of unique values.
+
+    Args:
+        left: Sorted array.
+        right: Sorted array.
+
+    Returns:
+        Boolean mask over `left` of values found in `right`, and the positions of those values in `right`.
+    """
+    positions = np.searchsorted(right, left)
+    found = positions < len(right)
+    found[found] = right[positions[found]] == left[found]
+    return found, positions[found]
+
+
+def get_book(node: str) -> str:
+    """Returns the book for a verse key (e.g. "1 Ne." for "1 Ne. 3:7")."""
+    return node.rsplit(" ", 1)[0]
+
+
+@dataclasses.dataclass(frozen=True)
+class EdgeDiff:
+    """Differences for one edge kind, as edge codes over the shared node index.
+
+    Attributes:
+        added: Codes for edges only in the new build.
+        removed: Codes for edges only in the old build.
+        changed: Codes for edges in both builds whose similarity changed.
+        old_count: Number of edges in the old build.
+        new_count: Number of edges in the new build.
+    """
+
+    added: np.ndarray
+    removed: np.ndarray
+    changed: np.ndarray
+    old_count: int
+    new_count: int
+
+
+@dataclasses.dataclass(frozen=True)
+class BuildDiff:
+    """Differences between two builds.
+
+    Attributes:
+        nodes: Array of node keys in the shared node index.
+        added_nodes: Node IDs only in the new build.
+        removed_nodes: Node IDs only in the old build.
+        edges: Dict mapping edge kinds to EdgeDiffs.
+    """
+
+    nodes: np.ndarray
+    added_nodes: np.ndarray
+    removed_nodes: np.ndarray
+    edges: dict[str, EdgeDiff]
+
+    def decode(self, codes: np.ndarray) -> list[tuple[str, str]]:
+        """Converts edge codes to (source, target) tuples."""
+        sources, targets = np.divmod(codes, len(self.nodes))
+        return list(zip(self.nodes[sources].tolist(), self.nodes[targets].tolist()))
+
+    def get_book_counts(self) -> dict[str, dict[str, dict[str, int]]]:
+        """Counts added, removed, and changed edges by the book of the source verse.
+
+        Returns:
+            Nested dict of {book: {kind: {"added": count, ...}}}; books without changes are omitted.
+        """
+        books, book_ids = np.unique([get_book(node) for node in self.nodes.tolist()], return_inverse=True)
+        counts = {}
+        for kind, edge_diff in self.edges.items():
+            for name in ("added", "removed", "changed"):
+                sources = getattr(edge_diff, name) // len(self.nodes)
+                for book_id, count in enumerate(np.bincount(book_ids[sources], minlength=len(books)).tolist()):
+                    if count:
+                        counts.setdefault(str(books[book_id]), {}).setdefault(kind, {})[name] = count
+        return counts
+
+    def to_json(self, max_listed: int = 0) -> dict[str, Any]:
+        """Summarizes the diff.
+
+        Args:
+            max_listed: Maximum number of edges to list for each kind and change type.
+
+        Returns:
+            JSON-serializable dict.
+        """
+        data = {
+            "nodes": {
+                "added": self.nodes[self.added_nodes].tolist()[:max_listed],
+                "removed": self.nodes[self.removed_nodes].tolist()[:max_listed],
+                "num_added": len(self.added_nodes),
+                "num_removed": len(self.removed_nodes),
+            },
+            "edges": {},
+            "books": self.get_book_counts(),
+        }
+        for kind, edge_diff in self.edges.items():
+            data["edges"][kind] = {"old": edge_diff.old_count, "new": edge_diff.new_count}
+            for name in ("added", "removed", "changed"):
+                codes = getattr(edge_diff, name)
+                data["edges"][kind][f"num_{name}"] = len(codes)
+                data["edges"][kind][name] = [list(edge) for edge in self.decode(codes[:max_listed])]
+        return data
+
+
+def _get_codes(
+    matrix: scipy.sparse.csr_matrix, mapping: np.ndarray, num_nodes: int, symmetric: bool = False
+) -> tuple[np.ndarray, np.ndarray]:
+    """Encodes the edges of a CSR matrix over the shared node index.
+
+    Args:
+        matrix: CSR matrix over the node IDs of one build.
+        mapping: Array mapping the node IDs of the build to shared node IDs.
+        num_nodes: Number of shared nodes.
+        symmetric: Whether the matrix is symmetric; if so, only edges with source < target are kept.
+
+    Returns:
+        Sorted edge codes and the corresponding matrix values.
+    """
+    coo = matrix.tocoo()
+    sources, targets = mapping[coo.row], mapping[coo.col]
+    data = coo.data
+    if symmetric:
+        mask = sources < targets
+        sources, targets, data = sources[mask], targets[mask], data[mask]
+    codes = sources.astype(np.int64) * num_nodes + targets
+    order = np.argsort(codes, kind="stable")
+    return codes[order], data[order]
+
+
+def _get_suggested(adjacency: graph_lib.Adjacency, kind: str) -> scipy.sparse.csr_matrix:
+    """Returns the suggested similarity matrix restricted to a single edge kind."""
+    kinds = adjacency.suggested_kinds.tocoo()
+    mask = kinds.data == graph_lib.EDGE_KINDS.index(kind)
+    # NOTE(kearnes): `suggested` and `suggested_kinds` share a sparsity structure, so the COO entries align.
+    similarities = adjacency.suggested.tocoo()
+    return scipy.sparse.csr_matrix(
+        (similarities.data[mask], (kinds.row[mask], kinds.col[mask])), shape=adjacency.suggested.shape
+    )
+
+
+def _diff_codes(old: tuple[np.ndarray, np.ndarray], new: tuple[np.ndarray, np.ndarray], tolerance: float) -> EdgeDiff:
+    """Diffs two sets of sorted edge codes (and values)."""
+    (old_codes, old_values), (new_codes, new_values) = old, new
+    found, positions = merge_join(old_codes, new_codes)
+    in_old = np.zeros(len(new_codes), dtype=bool)
+    in_old[positions] = True
+    changed = np.abs(old_values[found].astype(np.float64) - new_values[positions]) > tolerance
+    return EdgeDiff(
+        added=new_codes[~in_old],
+        removed=old_codes[~found],
+        changed=old_codes[found][changed],
+        old_count=len(old_codes),
+        new_count=len(new_codes),
+    )
+
+
+def diff_adjacency(old: graph_lib.Adjacency, new: graph_lib.Adjacency, tolerance: float = 1e-6) -> BuildDiff:
+    """Compares two builds.
+
+    Args:
+        old: Adjacency index for the previous build.
+        new: Adjacency index for the new build.
+        tolerance: Absolute tolerance for changes in suggested edge similarities.
+
+    Returns:
+        BuildDiff.
+    """
+    nodes = np.union1d(old.nodes, new.nodes)
+    old_mapping = np.searchsorted(nodes, old.nodes)
+    new_mapping = np.searchsorted(nodes, new.nodes)
+    in_old = np.zeros(len(nodes), dtype=bool)
+    in_old[old_mapping] = True
+    in_new = np.zeros(len(nodes), dtype=bool)
+    in_new[new_mapping] = True
+    edges = {}
+    for kind in DIFF_KINDS:
+        if kind == "canonical":
+            old_edges = _get_codes(old.canonical, old_mapping, len(nodes))
+            new_edges = _get_codes(new.canonical, new_mapping, len(nodes))
+        else:
+            old_edges = _get_codes(_get_suggested(old, kind), old_mapping, len(nodes), symmetric=True)
+            new_edges = _get_codes(_get_suggested(new, kind), new_mapping, len(nodes), symmetric=True)
+        edges[kind] = _diff_codes(old_edges, new_edges, tolerance)
+    return BuildDiff(
+        nodes=nodes,
+        added_nodes=np.flatnonzero(in_new & ~in_old),
+        removed_nodes=np.flatnonzero(in_old & ~in_new),
+        edges=edges,
+    )
@@ -0,0 +1,93 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.diff_lib."""
+import networkx as nx
+import numpy as np
+import pytest
+
+from scripture_graph import diff_lib
+from scripture_graph import graph_lib
+
+
+def _add_verses(graph, book, chapter, verses):
+    for verse in verses:
+        graph.add_node(f"{book} {chapter}:{verse}", kind="verse", book=book, chapter=chapter, verse=verse)
+
+
+@pytest.fixture(name="old_graph")
+def old_graph_fixture():
+    """Graph for the previous build."""
+    graph = nx.DiGraph()
+    _add_verses(graph, "1 Ne.", 3, range(1, 8))
+    _add_verses(graph, "Alma", 32, range(1, 6))
+    graph.add_edge("1 Ne. 3:7", "Alma 32:1")
+    graph.add_edge("Alma 32:1", "Alma 32:2")
+    graph.add_edge("Alma 32:2", "Alma 32:3")
+    for source, target, kind, similarity in [
+        ("Alma 32:4", "Alma 32:5", "jaccard", 0.5),
+        ("1 Ne. 3:1", "1 Ne. 3:2", "use", 0.8),
+        ("1 Ne. 3:2", "1 Ne. 3:3", "use", 0.9),
+    ]:
+        graph.add_edge(source, target, kind=kind, similarity=similarity)
+        graph.add_edge(target, source, kind=kind, similarity=similarity)
+    return graph
+
+
+def test_merge_join():
+    found, positions = diff_lib.merge_join(np.array([1, 3, 5, 9]), np.array([0, 3, 4, 5]))
+    assert found.tolist() == [False, True, True, False]
+    assert positions.tolist() == [1, 3]
+    found, positions = diff_lib.merge_join(np.array([1, 2]), np.array([], dtype=int))
+    assert not found.any()
+
+
+def test_diff_adjacency(old_graph):
+    new_graph = old_graph.copy()
+    new_graph.remove_node("Alma 32:3")  # Removes Alma 32:2 -> Alma 32:3.
+    _add_verses(new_graph, "Alma", 33, [1])
+    new_graph.add_edge("Alma 33:1", "Alma 32:1")
+    new_graph.edges["1 Ne. 3:1", "1 Ne. 3:2"]["similarity"] = 0.85
+    new_graph.edges["1 Ne. 3:2", "1 Ne. 3:1"]["similarity"] = 0.85
+    new_graph.remove_edges_from([("1 Ne. 3:2", "1 Ne. 3:3"), ("1 Ne. 3:3", "1 Ne. 3:2")])
+    old = graph_lib.Adjacency.from_graph(old_graph)
+    new = graph_lib.Adjacency.from_graph(new_graph)
+    build_diff = diff_lib.diff_adjacency(old, new)
+    assert build_diff.nodes[build_diff.added_nodes].tolist() == ["Alma 33:1"]
+    assert build_diff.nodes[build_diff.removed_nodes].tolist() == ["Alma 32:3"]
+    canonical = build_diff.edges["canonical"]
+    assert build_diff.decode(canonical.added) == [("Alma 33:1", "Alma 32:1")]
+    assert build_diff.decode(canonical.removed) == [("Alma 32:2", "Alma 32:3")]
+    assert (canonical.old_count, canonical.new_count) == (3, 3)
+    use = build_diff.edges["use"]
+    # Suggested edges are counted once per pair.
+    assert (use.old_count, use.new_count) == (2, 1)
+    assert len(use.added) == 0
+    assert build_diff.decode(use.removed) == [("1 Ne. 3:2", "1 Ne. 3:3")]
+    assert build_diff.decode(use.changed) == [("1 Ne. 3:1", "1 Ne. 3:2")]
+    jaccard = build_diff.edges["jaccard"]
+    assert len(jaccard.added) + len(jaccard.removed) + len(jaccard.changed) == 0
+    assert build_diff.get_book_counts() == {
+        "1 Ne.": {"use": {"removed": 1, "changed": 1}},
+        "Alma": {"canonical": {"added": 1, "removed": 1}},
+    }
+    data = build_diff.to_json(max_listed=10)
+    assert data["nodes"]["num_added"] == 1
+    assert data["edges"]["use"]["changed"] == [["1 Ne. 3:1", "1 Ne. 3:2"]]
+
+
+def test_diff_adjacency_unchanged(old_graph):
+    adjacency = graph_lib.Adjacency.from_graph(old_graph)
+    build_diff = diff_lib.diff_adjacency(adjacency, adjacency)
+    assert not build_diff.get_book_counts()
+    assert not build_diff.to_json()["edges"]["canonical"]["added"]
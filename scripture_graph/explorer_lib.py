@@ -0,0 +1,419 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Rendering utilities shared by the Connection Explorer app and its static export."""
+import enum
+import gzip
+import itertools
+import re
+from typing import Any, Iterable, Optional, Union
+from urllib import parse
+
+import brotli
+
+import scripture_graph
+
+# pylint: disable=too-many-arguments
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-locals
+
+Connections = dict[str, dict[str, Union[int, str, list[str]]]]
+Elements = dict[str, Any]
+
+URL_BASE = "https://www.churchofjesuschrist.org/study/scriptures/"
+
+
+class FilterMode(enum.Enum):
+    """Edge filter mode."""
+
+    ALL = enum.auto()
+    INCOMING = enum.auto()
+    OUTGOING = enum.auto()
+
+
+def get_edges(connections: Connections, verse: str) -> tuple[list[str], list[str], list[str]]:
+    """Fetches the incoming, outgoing, and suggested neighbors of a verse."""
+    data = connections[verse]
+    incoming = data.get("incoming", [])
+    outgoing = data.get("outgoing", [])
+    suggested = data.get("suggested", [])
+    return incoming, outgoing, suggested
+
+
+def get_ranked_edges(
+    connections: Connections, verse: str, include_suggested: bool, max_nodes: int, cursor: int = 0
+) -> tuple[list[str], list[str], list[str], Optional[int]]:
+    """Fetches one page of neighbors from the precomputed ranking (see build_connections.get_connections).
+
+    Suggested neighbors are ranked last, so this runs in O(max_nodes).
+
+    Args:
+        connections: Dict of connections keyed by verse.
+        verse: Verse to fetch.
+        include_suggested: Whether to include suggested neighbors.
+        max_nodes: Maximum number of neighbors to return.
+        cursor: Position in the ranked neighbor list to start from.
+
+    Returns:
+        incoming: Incoming neighbors.
+        outgoing: Outgoing neighbors.
+        suggested: Suggested neighbors.
+        next_cursor: Cursor for the next page, or None if there are no more neighbors.
+
+    Raises:
+        ValueError: If `max_nodes` is not positive or `cursor` is outside the ranked neighbor list.
+    """
+    ranked = connections[verse].get("ranked", [])
+    if max_nodes < 1:
+        raise ValueError(f"max_nodes must be positive: {max_nodes}")
+    if not 0 <= cursor <= len(ranked):
+        raise ValueError(f"cursor out of range: {cursor}")
+    incoming, outgoing, suggested = [], [], []
+    position = cursor
+    while position < len(ranked) and position - cursor < max_nodes:
+        node, kind = ranked[position]
+        if kind == "suggested":
+            if not include_suggested:
+                break
+            suggested.append(node)
+        if kind in {"both", "incoming"}:
+            incoming.append(node)
+        if kind in {"both", "outgoing"}:
+            outgoing.append(node)
+        position += 1
+    if position == len(ranked) or (ranked[position][1] == "suggested" and not include_suggested):
+        next_cursor = None
+    else:
+        next_cursor = position
+    return incoming, outgoing, suggested, next_cursor
+
+
+def get_elements(
+    connections: Connections,
+    verse: str,
+    filter_mode: FilterMode,
+    include_suggested: bool,
+    max_nodes: Optional[int] = None,
+    cursor: int = 0,
+    positions: Optional[dict[str, tuple[int, int]]] = None,
+) -> Elements:
+    """Renders the neighborhood around a verse.
+
+    The output order follows the order of the neighbor lists in `connections`,
+    so rendering the same build twice gives identical output.
+
+    Args:
+        connections: Dict of connections keyed by verse.
+        verse: Verse to render.
+        filter_mode: FilterMode.
+        include_suggested: Whether to include suggested edges.
+        max_nodes: If set, only the top `max_nodes` neighbors (in rank order, starting at `cursor`) are
+            returned; see get_ranked_edges.
+        cursor: Position in the ranked neighbor list to start from. Pages after the first do not repeat
+            the node for `verse`.
+        positions: Optional dict mapping nodes to precomputed (x, y) positions (see layout_lib), which are
+            added to the node elements for the client's preset layout.
+
+    Returns:
+        Cytoscape elements. If `max_nodes` is set, "cursor" contains the cursor for the next page (or None).
+
+    Raises:
+        ValueError: If `max_nodes` or `cursor` is invalid (see get_ranked_edges), or `cursor` is set without
+            `max_nodes`.
+    """
+    if max_nodes is None:
+        if cursor:
+            raise ValueError(f"cursor requires max_nodes: {cursor}")
+        incoming, outgoing, suggested = get_edges(connections, verse)
+    else:
+        incoming, outgoing, suggested, next_cursor = get_ranked_edges(
+            connections, verse=verse, include_suggested=include_suggested, max_nodes=max_nodes, cursor=cursor
+        )
+    # NOTE(skearnes): We drop suggested nodes if they are not requested. Filtered-out nodes
+    # are still drawn but are deemphasized for visual clarity.
+    if not include_suggested:
+        suggested = []
+    incoming_set = set(incoming)
+    outgoing_set = set(outgoing)
+    suggested_set = set(suggested)
+    unique_nodes = dict.fromkeys(itertools.chain([verse] if cursor == 0 else [], incoming, outgoing, suggested))
+    nodes = []
+    for node in unique_nodes:
+        if filter_mode == FilterMode.ALL:
+            keep = node in incoming_set or node in outgoing_set
+        elif filter_mode == FilterMode.INCOMING:
+            keep = node in incoming_set
+        else:
+            keep = node in outgoing_set
+        keep = keep or node == verse or node in suggested_set
+        element = {"data": get_node_data(connections, node, keep=keep)}
+        if positions is not None and node in positions:
+            element["position"] = dict(zip("xy", positions[node]))
+        nodes.append(element)
+    in_only = [node for node in incoming if node not in outgoing_set]
+    out_only = [node for node in outgoing if node not in incoming_set]
+    both = [node for node in incoming if node in outgoing_set]
+    edges = []
+    for source in in_only:
+        edges.append(
+            {
+                "data": {
+                    "id": f"{verse} <- {source}",
+                    "source": source,
+                    "target": verse,
+                    "kind": "incoming",
+                    "keep": filter_mode in {FilterMode.ALL, FilterMode.INCOMING},
+                }
+            }
+        )
+    for target in out_only:
+        edges.append(
+            {
+                "data": {
+                    "id": f"{verse} -> {target}",
+                    "source": verse,
+                    "target": target,
+                    "kind": "outgoing",
+                    "keep": filter_mode in {FilterMode.ALL, FilterMode.OUTGOING},
+                }
+            }
+        )
+    for other in both:
+        edges.append(
+            {
+                "data": {
+                    "id": f"{verse} <-> {other}",
+                    "source": verse,
+                    "target": other,
+                    "kind": "both",
+                    "keep": True,
+                }
+            }
+        )
+    for node in suggested:
+        edges.append(
+            {
+                "data": {
+                    "id": f"{verse} <?> {node}",
+                    "source": verse,
+                    "target": node,
+                    "kind": "suggested",
+                    "keep": include_suggested,
+                }
+            }
+        )
+    # Use attribute presence for matching in CSS.
+    for node in nodes:
+        if not node["data"]["keep"]:
+            node["data"]["hide"] = True
+    for edge in edges:
+        if not edge["data"]["keep"]:
+            edge["data"]["hide"] = True
+    if max_nodes is not None:
+        return {"nodes": nodes, "edges": edges, "cursor": next_cursor}
+    return {"nodes": nodes, "edges": edges}
+
+
+def get_batch_elements(
+    connections: Connections, verses: Iterable[str], filter_mode: FilterMode, include_suggested: bool
+) -> Elements:
+    """Renders the merged neighborhood around several verses.
+
+    Each verse is rendered with the same semantics as `get_elements`. Nodes are
+    merged by ID and edges are merged by the connection they represent (e.g.
+    "A -> B" and "B <- A" are the same edge); a merged element is kept if it is
+    kept in any of the individual neighborhoods.
+
+    Args:
+        connections: Dict of connections keyed by verse.
+        verses: Verses to render.
+        filter_mode: FilterMode.
+        include_suggested: Whether to include suggested edges.
+
+    Returns:
+        Cytoscape elements.
+    """
+    nodes = {}
+    edges = {}
+    for verse in verses:
+        elements = get_elements(connections, verse=verse, filter_mode=filter_mode, include_suggested=include_suggested)
+        for node in elements["nodes"]:
+            _merge_element(nodes, node["data"]["id"], node)
+        for edge in elements["edges"]:
+            data = edge["data"]
+            if data["kind"] in {"both", "suggested"}:
+                key = (data["kind"],) + tuple(sorted([data["source"], data["target"]]))
+            else:
+                key = ("directed", data["source"], data["target"])
+            _merge_element(edges, key, edge)
+    return {"nodes": list(nodes.values()), "edges": list(edges.values())}
+
+
+def _merge_element(
+    elements: dict[Any, dict[str, dict[str, Any]]], key: Any, element: dict[str, dict[str, Any]]
+) -> None:
+    """Merges an element into `elements`, keeping it if either copy is kept."""
+    if key not in elements:
+        elements[key] = element
+    elif element["data"]["keep"] and not elements[key]["data"]["keep"]:
+        elements[key]["data"]["keep"] = True
+        elements[key]["data"].pop("hide", None)
+
+
+def get_node_data(connections: Connections, node: str, keep: bool) -> dict[str, Any]:
+    """Builds the Cytoscape data for a node, including its community (if known) for coloring."""
+    data = {"id": node, "keep": keep}
+    community = connections.get(node, {}).get("community")
+    if community is not None:
+        data["community"] = community
+    return data
+
+
+def get_subgraph_elements(
+    nodes: list[str],
+    distances: list[int],
+    edges: list[tuple[str, str, str]],
+    connections: Optional[Connections] = None,
+) -> Elements:
+    """Renders a multi-hop subgraph.
+
+    Args:
+        nodes: Node keys.
+        distances: Hop distance of each node from the focus node.
+        edges: List of (source, target, kind) tuples; see graph_lib.Adjacency.get_subgraph_edges.
+        connections: Optional dict of connections keyed by verse, used for node communities.
+
+    Returns:
+        Cytoscape elements.
+    """
+    separators = {"outgoing": "->", "both": "<->", "suggested": "<?>"}
+    return {
+        "nodes": [
+            {"data": {**get_node_data(connections or {}, node, keep=True), "distance": distance}}
+            for node, distance in zip(nodes, distances)
+        ],
+        "edges": [
+            {
+                "data": {
+                    "id": f"{source} {separators[kind]} {target}",
+                    "source": source,
+                    "target": target,
+                    "kind": kind,
+                    "keep": True,
+                }
+            }
+            for source, target, kind in edges
+        ],
+    }
+
+
+def get_rollup_elements(rollup: dict[str, list], kinds: Iterable[str], parent: Optional[str] = None) -> Elements:
+    """Renders a rollup graph (see graph_lib.get_rollups).
+
+    Args:
+        rollup: Rollup graph for a single level.
+        kinds: Edge kinds, in the order of the counts in each rollup edge.
+        parent: If set, only nodes with this parent (e.g. the books in a volume) and the edges among them are
+            included.
+
+    Returns:
+        Cytoscape elements. Edges have a "count" field for each edge kind and a "total" field.
+    """
+    kinds = list(kinds)
+    nodes = [node for node in rollup["nodes"] if parent is None or node["parent"] == parent]
+    node_ids = {node["id"] for node in nodes}
+    edges = []
+    for source, target, *counts in rollup["edges"]:
+        if source not in node_ids or target not in node_ids:
+            continue
+        data = {"id": f"{source} -> {target}", "source": source, "target": target, **dict(zip(kinds, counts))}
+        data["total"] = sum(counts)
+        edges.append({"data": data})
+    return {"nodes": [{"data": node} for node in nodes], "edges": edges}
+
+
+def get_chapters(connections: Connections) -> dict[str, list[str]]:
+    """Groups verses by chapter (e.g. "Alma 32"), with verses in Standard Works order."""
+    chapters = {}
+    for verse in sort_verses(connections, list(connections)):
+        chapters.setdefault(get_chapter(verse), []).append(verse)
+    return chapters
+
+
+def get_table_args(connections: Connections, verse: str) -> dict[str, Any]:
+    """Builds the template arguments for the cross-reference table (table.html)."""
+    args = {
+        "verse": verse.replace(" ", "\xa0"),  # Non-breaking space.
+        "verse_url": get_verse_url(connections, verse),
+    }
+    incoming, outgoing, suggested = get_edges(connections, verse)
+    args["incoming"] = [(source, get_verse_url(connections, source)) for source in sort_verses(connections, incoming)]
+    args["outgoing"] = [(target, get_verse_url(connections, target)) for target in sort_verses(connections, outgoing)]
+    args["suggested"] = [(node, get_verse_url(connections, node)) for node in sort_verses(connections, suggested)]
+    return args
+
+
+def get_verse_url(connections: Connections, verse: str) -> str:
+    """Creates a URL for the verse text."""
+    node = connections[verse]
+    volume = scripture_graph.VOLUMES_SHORT[node["volume"]].lower()
+    if volume == "bom":
+        volume = "bofm"
+    elif volume == "d&c":
+        volume = "dc-testament"
+    elif volume == "pogp":
+        volume = "pgp"
+    book = node["book"].lower()
+    book_replacements = {
+        " ": "-",
+        ".": "",
+        "&": "",
+        "—": "-",
+    }
+    for old, new in book_replacements.items():
+        book = book.replace(old, new)
+    if book == "d&c":
+        book = "dc"
+    chapter = node["chapter"]
+    i = node["verse"]
+    return parse.urljoin(URL_BASE, f"{volume}/{book}/{chapter}.{i}?lang=eng#p{i}#{i}")
+
+
+def sort_verses(connections: Connections, verses: list[str]) -> list[str]:
+    """Sorts verses in Standard Works order."""
+
+    def _sort_verses(verse: str) -> tuple[int, int, int]:
+        node = connections[verse]
+        return scripture_graph.BOOK_ORDER[node["book"]], node["chapter"], node["verse"]
+
+    return sorted(verses, key=_sort_verses)
+
+
+def get_chapter(verse: str) -> str:
+    """Returns the chapter key for a verse (e.g. "1 Ne. 3:7" -> "1 Ne. 3")."""
+    return verse.rsplit(":", maxsplit=1)[0]
+
+
+def get_shard_name(chapter: str) -> str:
+    """Returns the static export shard name for a chapter; must match getShardName in script.js."""
+    return re.sub(r"[^A-Za-z0-9]", "_", chapter)
+
+
+def get_variant_name(filter_mode: FilterMode, include_suggested: bool) -> str:
+    """Returns the static export key for a set of /elements parameters; must match script.js."""
+    return f"{filter_mode.name.lower()}:{str(include_suggested).lower()}"
+
+
+def compress(data: bytes, gzip_level: int = 9, brotli_quality: int = 11) -> tuple[bytes, bytes]:
+    """Returns gzip- and brotli-compressed copies of `data`."""
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0), brotli.compress(data, quality=brotli_quality)
@@ -0,0 +1,176 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.explorer_lib."""
+import pytest
+
+from scripture_graph import explorer_lib
+
+
+@pytest.fixture(name="connections")
+def connections_fixture():
+    """Small set of connections."""
+
+    def _node(book, chapter, verse, **kwargs):
+        return {"volume": "Book of Mormon", "book": book, "chapter": chapter, "verse": verse, **kwargs}
+
+    return {
+        "1 Ne. 3:7": _node("1 Ne.", 3, 7, incoming=["Alma 32:21", "Mosiah 2:17"], outgoing=["Alma 32:21"]),
+        "Alma 32:21": _node("Alma", 32, 21, incoming=["1 Ne. 3:7"], outgoing=["1 Ne. 3:7"], community=0),
+        "Mosiah 2:17": _node("Mosiah", 2, 17, outgoing=["1 Ne. 3:7"], suggested=["Ether 12:6"]),
+        "Ether 12:6": _node("Ether", 12, 6, suggested=["Mosiah 2:17"]),
+    }
+
+
+@pytest.mark.parametrize(
+    "filter_mode,include_suggested,expected_hidden",
+    [
+        (explorer_lib.FilterMode.ALL, True, set()),
+        (explorer_lib.FilterMode.INCOMING, False, set()),
+        (explorer_lib.FilterMode.OUTGOING, False, {"Mosiah 2:17", "1 Ne. 3:7 <- Mosiah 2:17"}),
+    ],
+)
+def test_get_elements(connections, filter_mode, include_suggested, expected_hidden):
+    elements = explorer_lib.get_elements(connections, "1 Ne. 3:7", filter_mode, include_suggested)
+    assert [node["data"]["id"] for node in elements["nodes"]] == ["1 Ne. 3:7", "Alma 32:21", "Mosiah 2:17"]
+    assert {edge["data"]["id"]: edge["data"]["kind"] for edge in elements["edges"]} == {
+        "1 Ne. 3:7 <- Mosiah 2:17": "incoming",
+        "1 Ne. 3:7 <-> Alma 32:21": "both",
+    }
+    hidden = {element["data"]["id"] for element in elements["nodes"] + elements["edges"] if "hide" in element["data"]}
+    assert hidden == expected_hidden
+    assert {node["data"]["id"]: node["data"].get("community") for node in elements["nodes"]}["Alma 32:21"] == 0
+
+
+def test_get_table_args(connections):
+    args = explorer_lib.get_table_args(connections, "1 Ne. 3:7")
+    assert [name for name, _ in args["incoming"]] == ["Mosiah 2:17", "Alma 32:21"]
+    assert args["verse_url"].endswith("bofm/1-ne/3.7?lang=eng#p7#7")
+
+
+@pytest.mark.parametrize(
+    "chapter,expected",
+    [
+        ("1 Ne. 3", "1_Ne__3"),
+        ("D&C 13", "D_C_13"),
+        ("JS—H 1", "JS_H_1"),
+    ],
+)
+def test_get_shard_name(chapter, expected):
+    assert explorer_lib.get_shard_name(chapter) == expected
+
+
+def test_get_batch_elements(connections):
+    elements = explorer_lib.get_batch_elements(
+        connections, ["1 Ne. 3:7", "Mosiah 2:17"], explorer_lib.FilterMode.OUTGOING, include_suggested=True
+    )
+    assert [node["data"]["id"] for node in elements["nodes"]] == [
+        "1 Ne. 3:7",
+        "Alma 32:21",
+        "Mosiah 2:17",
+        "Ether 12:6",
+    ]
+    # "1 Ne. 3:7 <- Mosiah 2:17" is hidden around 1 Ne. 3:7 but kept around Mosiah 2:17.
+    assert {edge["data"]["id"]: "hide" in edge["data"] for edge in elements["edges"]} == {
+        "1 Ne. 3:7 <- Mosiah 2:17": False,
+        "1 Ne. 3:7 <-> Alma 32:21": False,
+        "Mosiah 2:17 <?> Ether 12:6": False,
+    }
+
+
+def test_get_chapters(connections):
+    assert explorer_lib.get_chapters(connections) == {
+        "1 Ne. 3": ["1 Ne. 3:7"],
+        "Mosiah 2": ["Mosiah 2:17"],
+        "Alma 32": ["Alma 32:21"],
+        "Ether 12": ["Ether 12:6"],
+    }
+
+
+@pytest.mark.parametrize(
+    "include_suggested,cursor,expected_ids,expected_cursor",
+    [
+        (True, 0, ["1 Ne. 3:7", "Alma 32:21", "Mosiah 2:17"], 2),
+        (True, 2, ["Ether 12:6"], None),
+        (False, 0, ["1 Ne. 3:7", "Alma 32:21", "Mosiah 2:17"], None),
+    ],
+)
+def test_get_elements_paged(connections, include_suggested, cursor, expected_ids, expected_cursor):
+    connections["1 Ne. 3:7"]["ranked"] = [
+        ["Alma 32:21", "both"],
+        ["Mosiah 2:17", "incoming"],
+        ["Ether 12:6", "suggested"],
+    ]
+    elements = explorer_lib.get_elements(
+        connections,
+        "1 Ne. 3:7",
+        explorer_lib.FilterMode.ALL,
+        include_suggested=include_suggested,
+        max_nodes=2,
+        cursor=cursor,
+    )
+    assert [node["data"]["id"] for node in elements["nodes"]] == expected_ids
+    assert elements["cursor"] == expected_cursor
+
+
+@pytest.mark.parametrize(
+    "max_nodes,cursor,expected_ids",
+    [
+        (2, 3, []),
+        (2, 4, None),
+        (2, -1, None),
+        (0, 0, None),
+        (None, 1, None),
+    ],
+)
+def test_get_elements_paged_bounds(connections, max_nodes, cursor, expected_ids):
+    connections["1 Ne. 3:7"]["ranked"] = [
+        ["Alma 32:21", "both"],
+        ["Mosiah 2:17", "incoming"],
+        ["Ether 12:6", "suggested"],
+    ]
+    kwargs = {"filter_mode": explorer_lib.FilterMode.ALL, "include_suggested": True, "max_nodes": max_nodes}
+    if expected_ids is None:
+        with pytest.raises(ValueError):
+            explorer_lib.get_elements(connections, "1 Ne. 3:7", cursor=cursor, **kwargs)
+        return
+    elements = explorer_lib.get_elements(connections, "1 Ne. 3:7", cursor=cursor, **kwargs)
+    assert [node["data"]["id"] for node in elements["nodes"]] == expected_ids
+    assert elements["cursor"] is None
+
+
+def test_get_rollup_elements():
+    rollup = {
+        "nodes": [
+            {"id": "1 Ne.", "parent": "Book of Mormon", "verses": 618},
+            {"id": "Alma", "parent": "Book of Mormon", "verses": 1975},
+            {"id": "John", "parent": "New Testament", "verses": 879},
+        ],
+        "edges": [["1 Ne.", "Alma", 3, 1, 0], ["John", "Alma", 2, 0, 1]],
+    }
+    elements = explorer_lib.get_rollup_elements(rollup, ["canonical", "jaccard", "use"], parent="Book of Mormon")
+    assert [node["data"]["id"] for node in elements["nodes"]] == ["1 Ne.", "Alma"]
+    assert elements["edges"] == [
+        {
+            "data": {
+                "id": "1 Ne. -> Alma",
+                "source": "1 Ne.",
+                "target": "Alma",
+                "canonical": 3,
+                "jaccard": 1,
+                "use": 0,
+                "total": 4,
+            }
+        }
+    ]
+    assert len(explorer_lib.get_rollup_elements(rollup, ["canonical", "jaccard", "use"])["edges"]) == 2
@@ -13,33 +13,66 @@
 # limitations under the License.
 """Utilities for parsing scriptures EPUB into verses and references."""
 import collections
+import concurrent.futures
 import dataclasses
+import functools
+import gzip
+import heapq
 import io
 import json
 import logging
 import os
 import re
+import time
 from typing import Optional
 import zipfile
 
+import brotli
 from lxml import cssselect
 from lxml import etree
 import networkx as nx
 import numpy as np
 import pandas as pd
-import tensorflow_hub as hub
+import scipy.sparse
+import scipy.sparse.linalg
 
 import scripture_graph
+from scripture_graph import profile_lib
 
 logger = logging.getLogger(__name__)
 
+# pylint: disable=too-many-arguments
 # pylint: disable=too-many-branches
+# pylint: disable=too-many-lines
 # pylint: disable=too-many-locals
 
 # XML namespaces.
 NAMESPACES = {"default": "http://www.w3.org/1999/xhtml"}
 
 
+# Model used for USE embeddings (see `add_use_edges`).
+USE_MODEL_URL = "https://tfhub.dev/google/universal-sentence-encoder-large/5"
+
+# Edge kinds used in `Adjacency`.
+EDGE_KINDS = ("canonical", "jaccard", "use")
+
+# Centrality measures computed by `get_centrality` and stored as node attributes.
+CENTRALITY_MEASURES = ("pagerank", "hub", "authority", "katz")
+
+# Bit flags for the direction of topic citations in `TopicIndex`.
+TOPIC_CITES_VERSE = 1
+VERSE_CITES_TOPIC = 2
+
+# Levels for rollup graphs (see `get_rollups`), from coarsest to finest.
+ROLLUP_LEVELS = ("volume", "book", "chapter")
+
+# Community labels added by `add_communities` and stored as node attributes.
+COMMUNITY_ATTRIBUTES = ("community", "community_size")
+
+# Component labels and sizes added by `add_components` and stored as node attributes.
+COMPONENT_ATTRIBUTES = ("weak_component", "weak_component_size", "strong_component", "strong_component_size")
+
+
 def get_volume(book: str) -> str:
     """Returns the containing volume for a book."""
     for volume, books in scripture_graph.VOLUMES.items():
@@ -113,6 +146,24 @@ def read_epub(filename: str) -> ScriptureGraph:
         ScriptureGraph.
     """
     graph = ScriptureGraph()
+    with zipfile.ZipFile(filename) as archive:
+        for info in archive.infolist():
+            if not info.filename.endswith(".xhtml"):
+                continue
+            start = time.perf_counter()
+            read_member(graph, archive.read(info), os.path.basename(info.filename))
+            profile_lib.record("read_epub_member", time.perf_counter() - start)
+    return graph
+
+
+def read_member(graph: ScriptureGraph, data: bytes, basename: str) -> None:
+    """Parses a single XHTML document from an EPUB archive and adds its contents to the graph.
+
+    Args:
+        graph: ScriptureGraph (modified in place).
+        data: Document contents.
+        basename: Document basename; determines how (and whether) the document is parsed.
+    """
     skipped = (
         "abr_fac",
         "bofm",
@@ -133,37 +184,30 @@ def read_epub(filename: str) -> ScriptureGraph:
         "ot.",
         "quad",
     )
-    with zipfile.ZipFile(filename) as archive:
-        for info in archive.infolist():
-            if not info.filename.endswith(".xhtml"):
-                continue
-            data = io.BytesIO(archive.read(info))
-            tree = etree.parse(data)
-            basename = os.path.basename(info.filename)
-            if basename.startswith("bd_"):
-                continue
-            if basename.startswith("tg_"):
-                topic = get_title(tree)
-                key = f"TG {topic}"
-                graph.topics[key] = Topic(source="TG", title=topic)
-                graph.references.extend(read_topic(tree, source=key))
-                continue
-            if basename.startswith("triple-index_"):
-                topic = get_title(tree)
-                key = f"ITC {topic}"
-                graph.topics[key] = Topic(source="ITC", title=topic)
-                graph.references.extend(read_topic(tree, source=key))
-                continue
-            if basename.startswith(skipped):
-                continue
-            book, chapter = read_headers(tree)
-            if not chapter:
-                continue
-            graph.verses.update(read_verses(tree, book, chapter))
-            if book == "JS—H":
-                continue  # JS—H has no references.
-            graph.references.extend(read_references(tree, book, chapter))
-    return graph
+    tree = etree.parse(io.BytesIO(data))
+    if basename.startswith("bd_"):
+        return
+    if basename.startswith("tg_"):
+        topic = get_title(tree)
+        key = f"TG {topic}"
+        graph.topics[key] = Topic(source="TG", title=topic)
+        graph.references.extend(read_topic(tree, source=key))
+        return
+    if basename.startswith("triple-index_"):
+        topic = get_title(tree)
+        key = f"ITC {topic}"
+        graph.topics[key] = Topic(source="ITC", title=topic)
+        graph.references.extend(read_topic(tree, source=key))
+        return
+    if basename.startswith(skipped):
+        return
+    book, chapter = read_headers(tree)
+    if not chapter:
+        return
+    graph.verses.update(read_verses(tree, book, chapter))
+    if book == "JS—H":
+        return  # JS—H has no references.
+    graph.references.extend(read_references(tree, book, chapter))
 
 
 def get_title(tree) -> str:
@@ -573,6 +617,54 @@ def _translate_topic(topic: str, topics: list[str]) -> str:
     raise ValueError(f"no suitable translation for {topic}")
 
 
+def add_references(graph: nx.DiGraph, references: list[Reference]) -> None:
+    """Adds canonical reference edges to the graph (in place), ignoring duplicates."""
+    duplicated_edges = 0
+    for reference in references:
+        if reference.source not in graph.nodes:
+            raise KeyError(f"missing source for {reference}")
+        if reference.target not in graph.nodes:
+            raise KeyError(f"missing target for {reference}")
+        if (reference.source, reference.target) in graph.edges:
+            duplicated_edges += 1
+        else:
+            graph.add_edge(reference.source, reference.target)
+    if duplicated_edges:
+        logger.info(f"ignored {duplicated_edges} duplicated edges")
+
+
+def assemble_graph(
+    scripture_graph_: ScriptureGraph, include_topics: bool = False, references: Optional[list[Reference]] = None
+) -> nx.DiGraph:
+    """Builds a graph of verses (and optionally topics) with canonical reference edges.
+
+    Args:
+        scripture_graph_: Parsed verses, topics, and references.
+        include_topics: Whether to include topic nodes.
+        references: Optional list of corrected references (see `correct_topic_references`); if not provided,
+            the references in `scripture_graph_` are corrected here.
+
+    Returns:
+        DiGraph.
+    """
+    graph = nx.DiGraph()
+    for key, verse in scripture_graph_.verses.items():
+        volume = get_volume(verse.book)
+        graph.add_node(key, kind="verse", volume=volume, **dataclasses.asdict(verse))
+    if include_topics:
+        for key, topic in scripture_graph_.topics.items():
+            volume = get_volume(topic.source)
+            graph.add_node(key, kind="topic", volume=volume, **dataclasses.asdict(topic))
+    if references is None:
+        references = correct_topic_references(
+            verses=list(scripture_graph_.verses.keys()),
+            topics=list(scripture_graph_.topics.keys()),
+            references=scripture_graph_.references,
+        )
+    add_references(graph, references)
+    return graph
+
+
 def remove_topic_nodes(graph: nx.Graph) -> None:
     """Drops topic nodes from the graph."""
     logger.info("Dropping topic nodes")
@@ -600,7 +692,11 @@ def remove_suggested_edges(graph: nx.Graph) -> None:
 
 
 def write_tree(graph: nx.Graph, filename: str) -> None:
-    """Writes a JSON navigation tree."""
+    """Writes a JSON navigation tree.
+
+    The tree is written in minified form, along with precompressed gzip and
+    brotli copies (see `write_compressed`) that can be served directly.
+    """
     graph = graph.copy()
     remove_topic_nodes(graph)
     source = []
@@ -632,7 +728,24 @@ def write_tree(graph: nx.Graph, filename: str) -> None:
             volume_children = volume_children[0]["children"]
         source.append({"title": volume, "key": volume, "folder": True, "children": volume_children})
     with open(filename, "w", encoding="utf-8") as f:
-        json.dump(source, f, indent=2)
+        json.dump(source, f, separators=(",", ":"))
+    write_compressed(filename)
+
+
+def get_compressed_filenames(filename: str) -> list[str]:
+    """Returns the filenames of the compressed copies written by `write_compressed`."""
+    return [f"{filename}.gz", f"{filename}.br"]
+
+
+def write_compressed(filename: str) -> None:
+    """Writes gzip (*.gz) and brotli (*.br) copies of a file."""
+    with open(filename, "rb") as f:
+        data = f.read()
+    gz_filename, br_filename = get_compressed_filenames(filename)
+    with open(gz_filename, "wb") as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    with open(br_filename, "wb") as f:
+        f.write(brotli.compress(data))
 
 
 def get_verses(graph: nx.Graph, book: str) -> dict[int, list[str]]:
@@ -669,20 +782,30 @@ def jaccard(graph: nx.Graph) -> np.ndarray:
     return similarity
 
 
-def angular_cosine(embeddings: np.ndarray) -> np.ndarray:
+def angular_cosine(embeddings: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
     """Computes pairwise angular cosine similarities.
 
     https://en.wikipedia.org/wiki/Cosine_similarity#Angular_distance_and_similarity
+
+    Args:
+        embeddings: N x D array of embeddings.
+        rows: Optional array of row indices; if provided, only these rows of the similarity matrix are computed.
+
+    Returns:
+        N x N (or len(rows) x N) similarity matrix.
     """
-    ab = embeddings @ embeddings.T
-    assert ab.shape == (embeddings.shape[0], embeddings.shape[0])
-    aa = np.square(embeddings).sum(axis=1, keepdims=True)
-    assert aa.shape == (embeddings.shape[0], 1)
-    bb = aa.T
+    if rows is None:
+        rows = np.arange(embeddings.shape[0])
+    ab = embeddings[rows] @ embeddings.T
+    assert ab.shape == (len(rows), embeddings.shape[0])
+    squares = np.square(embeddings).sum(axis=1, keepdims=True)
+    aa = squares[rows]
+    assert aa.shape == (len(rows), 1)
+    bb = squares.T
     assert bb.shape == (1, embeddings.shape[0])
     similarity = 1 - np.arccos(ab / (aa * bb)) / np.pi
     np.nan_to_num(similarity, copy=False)
-    similarity[np.diag_indices_from(similarity)] = 0.0
+    similarity[np.arange(len(rows)), rows] = 0.0
     return similarity
 
 
@@ -693,9 +816,16 @@ def prepare_text(text: str) -> str:
 
 def get_embeddings(graph: nx.Graph, model_url: str, batch_size: Optional[int] = None) -> np.ndarray:
     """Computes verse embeddings using a pretrained NLP model."""
-    verses = []
-    for node in graph.nodes:
-        verses.append(prepare_text(graph.nodes[node]["text"]))
+    return embed_texts([graph.nodes[node]["text"] for node in graph.nodes], model_url, batch_size=batch_size)
+
+
+def embed_texts(texts: list[str], model_url: str, batch_size: Optional[int] = None) -> np.ndarray:
+    """Computes text embeddings using a pretrained NLP model."""
+    verses = [prepare_text(text) for text in texts]
+    # NOTE(kearnes): TensorFlow is slow to import and is only needed for building graphs, so it is
+    # imported here rather than at the top level (the Connection Explorer imports this module).
+    import tensorflow_hub as hub  # pylint: disable=import-outside-toplevel
+
     model = hub.load(model_url)
     if batch_size:
         embeddings = []
@@ -711,17 +841,23 @@ def get_embeddings(graph: nx.Graph, model_url: str, batch_size: Optional[int] =
     return model(verses).numpy()
 
 
-def _add_suggested_edges(graph: nx.DiGraph, suggested: pd.DataFrame, kind: str) -> None:
-    """Adds suggested edges to the graph."""
+def add_suggested_edges(graph: nx.DiGraph, suggested: pd.DataFrame) -> None:
+    """Adds suggested edges (see `get_jaccard_edges` and `get_use_edges`) to the graph."""
     logger.info(f"Adding {suggested.shape[0]} suggested edges")
     for row in suggested.itertuples():
-        graph.add_edge(row.a, row.b, kind=kind)
-        graph.add_edge(row.b, row.a, kind=kind)
-    suggested["kind"] = kind
+        graph.add_edge(row.a, row.b, kind=row.kind, similarity=float(row.similarity))
+        graph.add_edge(row.b, row.a, kind=row.kind, similarity=float(row.similarity))
 
 
 def add_jaccard_edges(digraph: nx.DiGraph) -> pd.DataFrame:
-    """Adds suggested edges to the graph using Jaccard similarity.
+    """Adds suggested edges to the graph using Jaccard similarity (see `get_jaccard_edges`)."""
+    suggested = get_jaccard_edges(digraph)
+    add_suggested_edges(digraph, suggested)
+    return suggested
+
+
+def get_jaccard_edges(digraph: nx.DiGraph) -> pd.DataFrame:
+    """Finds suggested edges using Jaccard similarity.
 
     Keeps all nonzero similarity pairs with at least two shared neighbors. Note
     that the added edges are based on similarities in an undirected graph, and
@@ -731,33 +867,61 @@ def add_jaccard_edges(digraph: nx.DiGraph) -> pd.DataFrame:
         digraph: The original cross-reference graph.
 
     Returns:
-        DataFrame containing unique pairs that were added to the graph.
+        DataFrame containing unique pairs to add to the graph.
     """
     graph = digraph.to_undirected()
     remove_topic_nodes(graph)
-    similarity = jaccard(graph)
-    nonzero = get_nonzero_edges(graph, similarity)
+    with profile_lib.stage("jaccard"):
+        similarity = jaccard(graph)
+    with profile_lib.stage("get_nonzero_edges"):
+        nonzero = get_nonzero_edges(graph, similarity)
     mask = (~nonzero.exists) & (nonzero.intersection > 1)
     suggested = nonzero[mask].copy()
-    _add_suggested_edges(digraph, suggested, kind="jaccard")
+    suggested["kind"] = "jaccard"
+    return suggested
+
+
+def add_use_edges(digraph: nx.DiGraph, threshold: float, embeddings: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """Adds suggested edges to the graph using USE embedding similarity (see `get_use_edges`)."""
+    suggested = get_use_edges(digraph, threshold, embeddings=embeddings)
+    add_suggested_edges(digraph, suggested)
     return suggested
 
 
-def add_use_edges(digraph: nx.DiGraph, threshold: float) -> pd.DataFrame:
-    """Adds suggested edges to the graph using USE embedding similarity."""
-    model_url = "https://tfhub.dev/google/universal-sentence-encoder-large/5"
+def get_use_edges(digraph: nx.DiGraph, threshold: float, embeddings: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """Finds suggested edges using USE embedding similarity.
+
+    Args:
+        digraph: The cross-reference graph, including any Jaccard edges.
+        threshold: Similarity threshold.
+        embeddings: Optional precomputed embeddings (see `get_use_embeddings`), with rows in the order of the
+            verse nodes in `digraph`.
+
+    Returns:
+        DataFrame containing unique pairs to add to the graph.
+    """
     graph = digraph.copy()
     remove_topic_nodes(graph)
-    embeddings = get_embeddings(graph, model_url=model_url, batch_size=1000)
-    similarity = angular_cosine(embeddings)
+    if embeddings is None:
+        with profile_lib.stage("get_embeddings"):
+            embeddings = get_use_embeddings(graph)
+    with profile_lib.stage("angular_cosine"):
+        similarity = angular_cosine(embeddings)
     similarity[similarity < threshold] = 0.0
-    nonzero = get_nonzero_edges(graph, similarity)
+    with profile_lib.stage("get_nonzero_edges"):
+        nonzero = get_nonzero_edges(graph, similarity)
     mask = ~nonzero.exists
     suggested = nonzero[mask].copy()
-    _add_suggested_edges(digraph, suggested, kind="use")
+    suggested["kind"] = "use"
     return suggested
 
 
+def get_use_embeddings(graph: nx.Graph) -> np.ndarray:
+    """Computes USE embeddings for the verse nodes in a graph, in node order."""
+    texts = [data["text"] for _, data in graph.nodes(data=True) if data["kind"] == "verse"]
+    return embed_texts(texts, USE_MODEL_URL, batch_size=1000)
+
+
 def get_nonzero_edges(graph: nx.Graph, similarity: np.ndarray) -> pd.DataFrame:
     """Builds a list of nonzero edges."""
     nodes = np.asarray(graph.nodes())
@@ -790,3 +954,1086 @@ def get_nonzero_edges(graph: nx.Graph, similarity: np.ndarray) -> pd.DataFrame:
     df["exists"] = exists
     logger.info(f"Previously existing pairs: {df.exists.sum()}")
     return df
+
+
+def _sort_verses(graph: nx.Graph, nodes) -> list[str]:
+    """Sorts verse nodes in Standard Works order."""
+
+    def _sort_key(node: str) -> tuple[int, int, int]:
+        data = graph.nodes[node]
+        return scripture_graph.BOOK_ORDER[data["book"]], int(data["chapter"]), int(data["verse"])
+
+    return sorted(nodes, key=_sort_key)
+
+
+@dataclasses.dataclass(frozen=True)
+class Adjacency:
+    """Compact sparse adjacency index over verse nodes.
+
+    Node IDs are positions in `nodes`, which are sorted in Standard Works order
+    so that chapters and books occupy contiguous ID ranges.
+
+    Attributes:
+        nodes: Array of node keys (e.g. "1 Ne. 3:7").
+        canonical: N x N CSR matrix with canonical[i, j] = 1 if i references j.
+        suggested: Symmetric N x N CSR matrix of suggested edge similarities.
+        suggested_kinds: N x N CSR matrix of suggested edge kinds (indices into
+            EDGE_KINDS), with the same sparsity structure as `suggested`.
+    """
+
+    nodes: np.ndarray
+    canonical: scipy.sparse.csr_matrix
+    suggested: scipy.sparse.csr_matrix
+    suggested_kinds: scipy.sparse.csr_matrix
+    _matrices: dict = dataclasses.field(default_factory=dict, compare=False, repr=False)
+
+    @classmethod
+    def from_graph(cls, graph: nx.DiGraph) -> "Adjacency":
+        """Builds an index from a graph without topic nodes."""
+        nodes = _sort_verses(graph, graph.nodes)
+        index = {node: i for i, node in enumerate(nodes)}
+        canonical_rows, canonical_cols = [], []
+        suggested_rows, suggested_cols, similarities, kinds = [], [], [], []
+        for source, target, data in graph.edges(data=True):
+            kind = data.get("kind")
+            if kind:
+                suggested_rows.append(index[source])
+                suggested_cols.append(index[target])
+                # NOTE(kearnes): Older graphs do not record similarities; use 1 so the edge is kept.
+                similarities.append(data.get("similarity", 1.0))
+                kinds.append(EDGE_KINDS.index(kind))
+            else:
+                canonical_rows.append(index[source])
+                canonical_cols.append(index[target])
+        shape = (len(nodes), len(nodes))
+        canonical = scipy.sparse.csr_matrix(
+            (np.ones(len(canonical_rows), dtype=np.int8), (canonical_rows, canonical_cols)), shape=shape
+        )
+        suggested = scipy.sparse.csr_matrix(
+            (np.asarray(similarities, dtype=np.float32), (suggested_rows, suggested_cols)), shape=shape
+        )
+        suggested_kinds = scipy.sparse.csr_matrix(
+            (np.asarray(kinds, dtype=np.int8), (suggested_rows, suggested_cols)), shape=shape
+        )
+        return cls(nodes=np.asarray(nodes), canonical=canonical, suggested=suggested, suggested_kinds=suggested_kinds)
+
+    def save(self, filename: str) -> None:
+        """Writes the index to an (uncompressed, for fast loading) NPZ file."""
+        arrays = {"nodes": self.nodes}
+        for name in ["canonical", "suggested", "suggested_kinds"]:
+            matrix = getattr(self, name)
+            arrays[f"{name}_data"] = matrix.data
+            arrays[f"{name}_indices"] = matrix.indices
+            arrays[f"{name}_indptr"] = matrix.indptr
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename: str) -> "Adjacency":
+        """Loads an index written by `save`."""
+        with np.load(filename) as data:
+            nodes = data["nodes"]
+            kwargs = {}
+            for name in ["canonical", "suggested", "suggested_kinds"]:
+                kwargs[name] = scipy.sparse.csr_matrix(
+                    (data[f"{name}_data"], data[f"{name}_indices"], data[f"{name}_indptr"]),
+                    shape=(len(nodes), len(nodes)),
+                )
+        return cls(nodes=nodes, **kwargs)
+
+    @functools.cached_property
+    def index(self) -> dict[str, int]:
+        """Dict mapping node keys to node IDs."""
+        return {node: i for i, node in enumerate(self.nodes.tolist())}
+
+    @functools.cached_property
+    def in_degree(self) -> np.ndarray:
+        """Canonical in-degree for each node."""
+        return np.asarray(self.canonical.sum(axis=0)).ravel()
+
+    def get_matrix(self, direction: str = "all", include_suggested: bool = False) -> scipy.sparse.csr_matrix:
+        """Returns the (cached) adjacency matrix used for traversals.
+
+        Args:
+            direction: Which canonical edges to follow: "outgoing" (i references j),
+                "incoming" (j references i), or "all" (either).
+            include_suggested: Whether to also follow suggested edges.
+
+        Returns:
+            N x N CSR matrix; row i contains the neighbors of i.
+        """
+        key = (direction, include_suggested)
+        if key not in self._matrices:
+            if direction == "outgoing":
+                matrix = self.canonical
+            elif direction == "incoming":
+                matrix = self.canonical.T.tocsr()
+            elif direction == "all":
+                matrix = self.canonical + self.canonical.T
+            else:
+                raise ValueError(f"unsupported direction: {direction}")
+            if include_suggested:
+                matrix = matrix + self.suggested
+            matrix = matrix.astype(bool).tocsr()
+            matrix.sort_indices()
+            self._matrices[key] = matrix
+        return self._matrices[key]
+
+    def get_subgraph_edges(self, node_ids: np.ndarray, include_suggested: bool = False) -> list[tuple[int, int, str]]:
+        """Returns the edges among a set of nodes.
+
+        Args:
+            node_ids: Array of node IDs.
+            include_suggested: Whether to include suggested edges.
+
+        Returns:
+            List of (source, target, kind) tuples, where kind is "outgoing" for a
+            one-way reference from source to target, "both" for reciprocal
+            references, or "suggested". Reciprocal and suggested edges are only
+            listed once, with source < target.
+        """
+        node_ids = np.asarray(node_ids)
+        canonical = self.canonical[node_ids][:, node_ids].tocoo()
+        pairs = set(zip(canonical.row.tolist(), canonical.col.tolist()))
+        edges = []
+        for i, j in sorted(pairs):
+            if (j, i) in pairs:
+                if i < j:
+                    edges.append((int(node_ids[i]), int(node_ids[j]), "both"))
+            else:
+                edges.append((int(node_ids[i]), int(node_ids[j]), "outgoing"))
+        if include_suggested:
+            suggested = scipy.sparse.triu(self.suggested[node_ids][:, node_ids]).tocoo()
+            for i, j in sorted(zip(suggested.row.tolist(), suggested.col.tolist())):
+                if (i, j) not in pairs and (j, i) not in pairs:
+                    edges.append((int(node_ids[i]), int(node_ids[j]), "suggested"))
+        return edges
+
+
+def get_neighbors(matrix: scipy.sparse.csr_matrix, rows: np.ndarray) -> np.ndarray:
+    """Gathers the (possibly repeated) column indices for a set of CSR rows."""
+    starts = matrix.indptr[rows]
+    lengths = matrix.indptr[rows + 1] - starts
+    total = lengths.sum()
+    if not total:
+        return np.zeros(0, dtype=matrix.indices.dtype)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    return matrix.indices[offsets]
+
+
+@dataclasses.dataclass(frozen=True)
+class TopicIndex:
+    """Sparse verse x topic incidence index.
+
+    Verse IDs are positions in `verses` (in Standard Works order, as in `Adjacency`) and topic IDs are positions
+    in `topics` (sorted by key). Each verse row lists the topics that cite it or that it cites; the transposed
+    matrix is precomputed so that both verse and topic lookups are CSR row slices.
+
+    Attributes:
+        verses: Array of verse keys (e.g. "1 Ne. 3:7").
+        topics: Array of topic keys (e.g. "TG Faith").
+        incidence: V x T CSR matrix; the value is a bit mask of TOPIC_CITES_VERSE and VERSE_CITES_TOPIC.
+        transpose: T x V CSR matrix; the transpose of `incidence`.
+    """
+
+    verses: np.ndarray
+    topics: np.ndarray
+    incidence: scipy.sparse.csr_matrix
+    transpose: scipy.sparse.csr_matrix
+
+    @classmethod
+    def from_graph(cls, graph: nx.DiGraph) -> "TopicIndex":
+        """Builds an index from a graph with topic nodes."""
+        verses = _sort_verses(graph, (node for node, kind in graph.nodes(data="kind") if kind == "verse"))
+        topics = sorted(node for node, kind in graph.nodes(data="kind") if kind == "topic")
+        verse_index = {node: i for i, node in enumerate(verses)}
+        topic_index = {node: i for i, node in enumerate(topics)}
+        rows, cols, flags = [], [], []
+        for source, target in graph.edges:
+            if source in topic_index and target in verse_index:
+                rows.append(verse_index[target])
+                cols.append(topic_index[source])
+                flags.append(TOPIC_CITES_VERSE)
+            elif source in verse_index and target in topic_index:
+                rows.append(verse_index[source])
+                cols.append(topic_index[target])
+                flags.append(VERSE_CITES_TOPIC)
+        # NOTE(kearnes): Duplicate entries are summed, so reciprocal citations combine into a single bit mask.
+        incidence = scipy.sparse.csr_matrix(
+            (np.asarray(flags, dtype=np.int8), (rows, cols)), shape=(len(verses), len(topics))
+        )
+        incidence.sum_duplicates()
+        return cls(
+            verses=np.asarray(verses), topics=np.asarray(topics), incidence=incidence, transpose=incidence.T.tocsr()
+        )
+
+    def save(self, filename: str) -> None:
+        """Writes the index to an (uncompressed, for fast loading) NPZ file."""
+        np.savez(
+            filename,
+            verses=self.verses,
+            topics=self.topics,
+            data=self.incidence.data,
+            indices=self.incidence.indices,
+            indptr=self.incidence.indptr,
+        )
+
+    @classmethod
+    def load(cls, filename: str) -> "TopicIndex":
+        """Loads an index written by `save`."""
+        with np.load(filename) as data:
+            verses = data["verses"]
+            topics = data["topics"]
+            incidence = scipy.sparse.csr_matrix(
+                (data["data"], data["indices"], data["indptr"]), shape=(len(verses), len(topics))
+            )
+        return cls(verses=verses, topics=topics, incidence=incidence, transpose=incidence.T.tocsr())
+
+    @functools.cached_property
+    def verse_index(self) -> dict[str, int]:
+        """Dict mapping verse keys to verse IDs."""
+        return {verse: i for i, verse in enumerate(self.verses.tolist())}
+
+    @functools.cached_property
+    def topic_index(self) -> dict[str, int]:
+        """Dict mapping topic keys to topic IDs."""
+        return {topic: i for i, topic in enumerate(self.topics.tolist())}
+
+    @functools.cached_property
+    def topic_sizes(self) -> np.ndarray:
+        """Number of verses for each topic."""
+        return np.diff(self.transpose.indptr)
+
+    def get_topics(self, verse: str) -> list[str]:
+        """Returns the topics for a verse, sorted by key."""
+        i = self.verse_index[verse]
+        return self.topics[self.incidence.indices[self.incidence.indptr[i] : self.incidence.indptr[i + 1]]].tolist()
+
+    def get_verses(self, topic: str, k: Optional[int] = None, offset: int = 0) -> tuple[list[str], int]:
+        """Returns a page of the verses for a topic.
+
+        Args:
+            topic: Topic key.
+            k: Maximum number of verses; None returns all of them.
+            offset: Number of verses to skip.
+
+        Returns:
+            List of verses in Standard Works order and the total number of verses for the topic.
+
+        Raises:
+            ValueError: If `k` is not positive or `offset` is negative.
+        """
+        if k is not None and k < 1:
+            raise ValueError(f"k must be positive: {k}")
+        if offset < 0:
+            raise ValueError(f"offset must be non-negative: {offset}")
+        i = self.topic_index[topic]
+        start, stop = self.transpose.indptr[i], self.transpose.indptr[i + 1]
+        begin = min(start + offset, stop)
+        end = stop if k is None else min(begin + k, stop)
+        return self.verses[self.transpose.indices[begin:end]].tolist(), int(stop - start)
+
+    def get_cocited_topics(self, verse: str, k: int = 10) -> list[tuple[str, float]]:
+        """Ranks the topics that are co-cited with a verse.
+
+        With the incidence matrix A (binarized) and the indicator row a of the source verse, the number of topics
+        shared with each verse is s = A a^T, and each topic is scored by the co-cited verses it contains,
+        (A^T s)_t / sqrt(|t|); the normalization keeps very large topics (e.g. "TG Jesus Christ") from dominating.
+        Both products are computed as CSR row gathers, so the cost is proportional to the size of the topics
+        involved rather than the size of the index. Topics of the source verse are excluded.
+
+        Args:
+            verse: Source verse.
+            k: Maximum number of topics.
+
+        Returns:
+            List of (topic, score) tuples in order of decreasing score.
+
+        Raises:
+            ValueError: If `k` is not positive.
+        """
+        if k < 1:
+            raise ValueError(f"k must be positive: {k}")
+        i = self.verse_index[verse]
+        own_topics = self.incidence.indices[self.incidence.indptr[i] : self.incidence.indptr[i + 1]]
+        cocited, shared = np.unique(get_neighbors(self.transpose, own_topics), return_counts=True)
+        mask = cocited != i
+        cocited, shared = cocited[mask], shared[mask]
+        lengths = np.diff(self.incidence.indptr)[cocited]
+        counts = np.bincount(
+            get_neighbors(self.incidence, cocited), weights=np.repeat(shared, lengths), minlength=len(self.topics)
+        )
+        scores = counts / np.sqrt(np.maximum(self.topic_sizes, 1))
+        scores[own_topics] = 0
+        candidates = np.flatnonzero(scores)
+        # Sort by decreasing score, then by topic key.
+        order = np.lexsort((candidates, -scores[candidates]))[:k]
+        return [(str(self.topics[j]), float(scores[j])) for j in candidates[order]]
+
+
+def get_neighborhood(
+    adjacency: Adjacency,
+    source: str,
+    hops: int,
+    direction: str = "all",
+    include_suggested: bool = False,
+    max_nodes: Optional[int] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Finds the k-hop neighborhood around a node with breadth-first search.
+
+    Args:
+        adjacency: Adjacency index.
+        source: Source node key.
+        hops: Maximum number of hops.
+        direction: Which canonical edges to follow; see `Adjacency.get_matrix`.
+        include_suggested: Whether to follow suggested edges.
+        max_nodes: Maximum number of nodes to return (including the source). When
+            the budget is exceeded, nodes with higher in-degree are preferred
+            within the last level.
+
+    Returns:
+        node_ids: Array of node IDs in order of discovery.
+        distances: Array of hop distances from the source.
+    """
+    matrix = adjacency.get_matrix(direction=direction, include_suggested=include_suggested)
+    visited = np.zeros(len(adjacency.nodes), dtype=bool)
+    frontier = np.asarray([adjacency.index[source]])
+    visited[frontier] = True
+    node_ids = [frontier]
+    distances = [np.zeros(1, dtype=np.int32)]
+    count = 1
+    for distance in range(1, hops + 1):
+        if max_nodes is not None and count >= max_nodes:
+            break
+        neighbors = np.unique(get_neighbors(matrix, frontier))
+        frontier = neighbors[~visited[neighbors]]
+        if not frontier.size:
+            break
+        if max_nodes is not None and count + frontier.size > max_nodes:
+            order = np.argsort(-adjacency.in_degree[frontier], kind="stable")
+            frontier = np.sort(frontier[order[: max_nodes - count]])
+        visited[frontier] = True
+        node_ids.append(frontier)
+        distances.append(np.full(frontier.size, distance, dtype=np.int32))
+        count += frontier.size
+    return np.concatenate(node_ids), np.concatenate(distances)
+
+
+def get_related(
+    adjacency: Adjacency,
+    source: str,
+    k: int = 10,
+    alpha: float = 0.15,
+    epsilon: float = 1e-4,
+    direction: str = "all",
+    include_suggested: bool = False,
+    exclude_neighbors: bool = False,
+) -> list[tuple[str, float]]:
+    """Ranks nodes related to a source node by approximate personalized PageRank.
+
+    Uses the local push algorithm of Andersen, Chung, and Lang (2006): residual
+    probability mass is pushed out from the source until every node holds less
+    than `epsilon` times its degree. Pushes are applied to all active nodes at
+    once, and only the neighbors of pushed nodes are checked for activity.
+    Scores and residuals are only stored for the nodes that have been reached,
+    so the work done depends on `alpha` and `epsilon` (at most
+    O(1 / (alpha * epsilon)) pushes) rather than on the size of the graph.
+
+    Args:
+        adjacency: Adjacency index.
+        source: Source node key.
+        k: Number of related nodes to return.
+        alpha: Teleport (restart) probability; larger values keep the scores
+            closer to the source.
+        epsilon: Residual tolerance; smaller values are more accurate but touch
+            more of the graph.
+        direction: Which canonical edges to follow; see `Adjacency.get_matrix`.
+        include_suggested: Whether to follow suggested edges.
+        exclude_neighbors: If True, direct neighbors of the source are not returned.
+
+    Returns:
+        List of up to `k` (node, score) tuples sorted by decreasing score. The
+        source node is never included.
+    """
+    matrix = adjacency.get_matrix(direction=direction, include_suggested=include_suggested)
+    source_id = adjacency.index[source]
+    # Sorted IDs of the nodes reached so far, with aligned scores and residuals; `active` holds positions in
+    # node_ids.
+    node_ids = np.asarray([source_id])
+    scores = np.zeros(1)
+    residuals = np.ones(1)
+    active = np.zeros(1, dtype=np.int64)
+    while active.size:
+        active_ids = node_ids[active]
+        degree = matrix.indptr[active_ids + 1] - matrix.indptr[active_ids]
+        mass = residuals[active]
+        residuals[active] = 0.0
+        dangling = degree == 0
+        # NOTE(kearnes): Mass at a dangling node has nowhere to go, so it is kept.
+        scores[active] += np.where(dangling, mass, alpha * mass)
+        shares = np.repeat((1 - alpha) * mass[~dangling] / degree[~dangling], degree[~dangling])
+        candidates, inverse = np.unique(get_neighbors(matrix, active_ids[~dangling]), return_inverse=True)
+        reached = np.union1d(node_ids, candidates)
+        if reached.size > node_ids.size:
+            positions = np.searchsorted(reached, node_ids)
+            grown_scores, grown_residuals = np.zeros(reached.size), np.zeros(reached.size)
+            grown_scores[positions] = scores
+            grown_residuals[positions] = residuals
+            node_ids, scores, residuals = reached, grown_scores, grown_residuals
+        positions = np.searchsorted(node_ids, candidates)
+        residuals[positions] += np.bincount(inverse, weights=shares, minlength=candidates.size)
+        remaining = residuals[positions]
+        degree = matrix.indptr[candidates + 1] - matrix.indptr[candidates]
+        active = positions[(remaining > 0) & (remaining >= epsilon * degree)]
+    mask = (node_ids != source_id) & (scores > 0)
+    if exclude_neighbors:
+        mask &= ~np.isin(node_ids, get_neighbors(matrix, np.asarray([source_id])))
+    node_ids, scores = node_ids[mask], scores[mask]
+    # Sort by decreasing score, breaking ties by node order.
+    order = np.lexsort((node_ids, -scores))[:k]
+    return [(str(node), float(score)) for node, score in zip(adjacency.nodes[node_ids[order]], scores[order])]
+
+
+def get_shortest_paths(
+    adjacency: Adjacency,
+    source: str,
+    target: str,
+    k: int = 1,
+    include_suggested: bool = False,
+    directed: bool = True,
+) -> list[list[str]]:
+    """Finds the k shortest chains of references between two nodes.
+
+    Uses Yen's algorithm for k > 1, with bidirectional breadth-first search for
+    each shortest-path query.
+
+    Args:
+        adjacency: Adjacency index.
+        source: Source node key.
+        target: Target node key.
+        k: Number of paths to return.
+        include_suggested: Whether to follow suggested edges.
+        directed: If True, canonical edges are only followed from the citing
+            verse to the cited verse; otherwise they are followed either way.
+
+    Returns:
+        List of up to `k` simple paths (lists of node keys), shortest first.
+    """
+    if directed:
+        forward = adjacency.get_matrix(direction="outgoing", include_suggested=include_suggested)
+        backward = adjacency.get_matrix(direction="incoming", include_suggested=include_suggested)
+    else:
+        forward = backward = adjacency.get_matrix(direction="all", include_suggested=include_suggested)
+    source_id = adjacency.index[source]
+    target_id = adjacency.index[target]
+    path = _bidirectional_search(forward, backward, source_id, target_id, set(), set())
+    if path is None:
+        return []
+    paths = [path]
+    candidates = []
+    seen = {tuple(path)}
+    while len(paths) < k:
+        previous = paths[-1]
+        for i in range(len(previous) - 1):
+            root = previous[: i + 1]
+            banned_edges = set()
+            for other in paths:
+                if other[: i + 1] == root:
+                    banned_edges.add((other[i], other[i + 1]))
+                    if not directed:
+                        banned_edges.add((other[i + 1], other[i]))
+            spur = _bidirectional_search(forward, backward, root[-1], target_id, set(root[:-1]), banned_edges)
+            if spur is not None:
+                candidate = root[:-1] + spur
+                if tuple(candidate) not in seen:
+                    seen.add(tuple(candidate))
+                    heapq.heappush(candidates, (len(candidate), candidate))
+        if not candidates:
+            break
+        paths.append(heapq.heappop(candidates)[1])
+    return [adjacency.nodes[path].tolist() for path in paths]
+
+
+def _bidirectional_search(
+    forward: scipy.sparse.csr_matrix,
+    backward: scipy.sparse.csr_matrix,
+    source: int,
+    target: int,
+    banned_nodes: set[int],
+    banned_edges: set[tuple[int, int]],
+) -> Optional[list[int]]:
+    """Finds a shortest path with bidirectional breadth-first search.
+
+    Args:
+        forward: Adjacency matrix; row i contains the successors of i.
+        backward: Transpose of `forward`; row i contains the predecessors of i.
+        source: Source node ID.
+        target: Target node ID.
+        banned_nodes: Node IDs that may not be visited.
+        banned_edges: (source, target) edges that may not be used.
+
+    Returns:
+        List of node IDs from source to target, or None if no path exists.
+    """
+    if source == target:
+        return [source]
+    # Maps visited nodes to (parent, depth) in each search tree.
+    forward_tree = {source: (None, 0)}
+    backward_tree = {target: (None, 0)}
+    forward_frontier = [source]
+    backward_frontier = [target]
+    while forward_frontier and backward_frontier:
+        # Expand the smaller frontier by one full level, then pick the best meeting point.
+        expand_forward = len(forward_frontier) <= len(backward_frontier)
+        if expand_forward:
+            matrix, tree, other_tree, frontier = forward, forward_tree, backward_tree, forward_frontier
+        else:
+            matrix, tree, other_tree, frontier = backward, backward_tree, forward_tree, backward_frontier
+        next_frontier = []
+        best_length, meeting = None, None
+        for node in frontier:
+            depth = tree[node][1] + 1
+            for neighbor in matrix.indices[matrix.indptr[node] : matrix.indptr[node + 1]].tolist():
+                if neighbor in tree or neighbor in banned_nodes:
+                    continue
+                edge = (node, neighbor) if expand_forward else (neighbor, node)
+                if edge in banned_edges:
+                    continue
+                tree[neighbor] = (node, depth)
+                next_frontier.append(neighbor)
+                if neighbor in other_tree:
+                    length = depth + other_tree[neighbor][1]
+                    if best_length is None or length < best_length:
+                        best_length, meeting = length, neighbor
+        if meeting is not None:
+            return _join_trees(forward_tree, backward_tree, meeting)
+        if expand_forward:
+            forward_frontier = next_frontier
+        else:
+            backward_frontier = next_frontier
+    return None
+
+
+def _join_trees(
+    forward_tree: dict[int, tuple[Optional[int], int]],
+    backward_tree: dict[int, tuple[Optional[int], int]],
+    meeting: int,
+) -> list[int]:
+    """Builds a path through the meeting point of two search trees."""
+    path = []
+    node = meeting
+    while node is not None:
+        path.append(node)
+        node = forward_tree[node][0]
+    path.reverse()
+    node = backward_tree[meeting][0]
+    while node is not None:
+        path.append(node)
+        node = backward_tree[node][0]
+    return path
+
+
+def pagerank(
+    matrix: scipy.sparse.csr_matrix,
+    alpha: float = 0.85,
+    tol: float = 1e-10,
+    max_iter: int = 100,
+    start: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Computes PageRank by power iteration; equivalent to nx.pagerank.
+
+    Args:
+        matrix: N x N adjacency matrix; row i contains the nodes that i links to.
+        alpha: Damping factor.
+        tol: Convergence tolerance (per node, in L1 norm).
+        max_iter: Maximum number of iterations.
+        start: Initial scores (e.g. from a previous build); uniform by default.
+
+    Returns:
+        Array of scores that sum to 1.
+
+    Raises:
+        nx.PowerIterationFailedConvergence: If the scores did not converge.
+    """
+    size = matrix.shape[0]
+    out_degree = np.diff(matrix.indptr)
+    dangling = out_degree == 0
+    inverse_degree = np.divide(1.0, out_degree, out=np.zeros(size), where=~dangling)
+    transpose = matrix.T.tocsr().astype(float)
+    scores = _get_start(start, size)
+    for _ in range(max_iter):
+        previous = scores
+        scores = (
+            alpha * (transpose @ (previous * inverse_degree) + previous[dangling].sum() / size) + (1 - alpha) / size
+        )
+        if np.abs(scores - previous).sum() < size * tol:
+            return scores
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+def hits(
+    matrix: scipy.sparse.csr_matrix, tol: float = 1e-10, max_iter: int = 100, start: Optional[np.ndarray] = None
+) -> tuple[np.ndarray, np.ndarray]:
+    """Computes HITS hub and authority scores by power iteration; equivalent to nx.hits.
+
+    Args:
+        matrix: N x N adjacency matrix; row i contains the nodes that i links to.
+        tol: Convergence tolerance (in L1 norm).
+        max_iter: Maximum number of iterations.
+        start: Initial hub scores (e.g. from a previous build); uniform by default.
+
+    Returns:
+        hubs: Array of hub scores that sum to 1.
+        authorities: Array of authority scores that sum to 1.
+
+    Raises:
+        nx.PowerIterationFailedConvergence: If the scores did not converge.
+    """
+    matrix = matrix.astype(float)
+    transpose = matrix.T.tocsr()
+    hubs = _get_start(start, matrix.shape[0])
+    for _ in range(max_iter):
+        previous = hubs
+        authorities = transpose @ hubs
+        hubs = matrix @ authorities
+        # NOTE(kearnes): Normalize by the maximum (as networkx does) to keep the scores from overflowing.
+        hubs /= hubs.max() or 1.0
+        authorities /= authorities.max() or 1.0
+        if np.abs(hubs - previous).sum() < tol:
+            return _normalize(hubs), _normalize(authorities)
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+def katz(
+    matrix: scipy.sparse.csr_matrix,
+    alpha: Optional[float] = None,
+    beta: float = 1.0,
+    tol: float = 1e-10,
+    max_iter: int = 1000,
+    start: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Computes Katz centrality by power iteration; equivalent to nx.katz_centrality.
+
+    Args:
+        matrix: N x N adjacency matrix; row i contains the nodes that i links to.
+        alpha: Attenuation factor; must be less than the reciprocal of the largest
+            eigenvalue of the matrix. If None, 90% of that bound is used.
+        beta: Weight given to each node.
+        tol: Convergence tolerance (per node, in L1 norm).
+        max_iter: Maximum number of iterations.
+        start: Initial scores (e.g. from a previous build); zeros by default.
+
+    Returns:
+        Array of scores with unit L2 norm.
+
+    Raises:
+        nx.PowerIterationFailedConvergence: If the scores did not converge.
+    """
+    transpose = matrix.T.tocsr().astype(float)
+    size = matrix.shape[0]
+    if alpha is None:
+        alpha = 0.9 / max(get_spectral_radius(matrix), 1.0)
+    if start is None:
+        scores = np.zeros(size)
+    else:
+        # NOTE(kearnes): Stored scores are normalized, so choose the scale that best satisfies the fixed point.
+        residual = start - alpha * (transpose @ start)
+        scores = start * beta * residual.sum() / (residual @ residual or 1.0)
+    for _ in range(max_iter):
+        previous = scores
+        scores = alpha * (transpose @ previous) + beta
+        if np.abs(scores - previous).sum() < size * tol:
+            return scores / (np.linalg.norm(scores) or 1.0)
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+def get_spectral_radius(matrix: scipy.sparse.csr_matrix) -> float:
+    """Estimates the magnitude of the largest eigenvalue of a sparse matrix."""
+    if matrix.shape[0] < 3 or not matrix.nnz:
+        return float(np.abs(np.linalg.eigvals(matrix.toarray())).max(initial=0.0))
+    eigenvalues = scipy.sparse.linalg.eigs(matrix.astype(float), k=1, which="LM", return_eigenvectors=False)
+    return float(np.abs(eigenvalues).max())
+
+
+def _get_start(start: Optional[np.ndarray], size: int) -> np.ndarray:
+    """Returns normalized initial scores, defaulting to uniform."""
+    if start is None or not start.sum():
+        return np.full(size, 1.0 / size)
+    return _normalize(np.asarray(start, dtype=float))
+
+
+def _normalize(scores: np.ndarray) -> np.ndarray:
+    """Scales scores to sum to 1."""
+    return scores / (scores.sum() or 1.0)
+
+
+def get_centrality(
+    adjacency: Adjacency,
+    previous: Optional[dict[str, dict[str, float]]] = None,
+    tol: float = 1e-10,
+    max_iter: int = 1000,
+) -> dict[str, np.ndarray]:
+    """Computes centrality scores over canonical edges.
+
+    Args:
+        adjacency: Adjacency index.
+        previous: Optional dict mapping each of CENTRALITY_MEASURES to previous
+            per-node scores (e.g. from `read_centrality`), used to warm-start the
+            power iterations. Nodes without previous scores start at the mean.
+        tol: Convergence tolerance.
+        max_iter: Maximum number of iterations for each measure.
+
+    Returns:
+        Dict mapping each of CENTRALITY_MEASURES to an array of scores aligned with
+        `adjacency.nodes`.
+    """
+    starts = {}
+    for name in CENTRALITY_MEASURES:
+        if previous and previous.get(name):
+            values = np.asarray([previous[name].get(node, np.nan) for node in adjacency.nodes.tolist()])
+            starts[name] = np.nan_to_num(values, nan=np.nanmean(values) if np.isfinite(values).any() else 0.0)
+        else:
+            starts[name] = None
+    matrix = adjacency.canonical
+    scores = {"pagerank": pagerank(matrix, tol=tol, max_iter=max_iter, start=starts["pagerank"])}
+    scores["hub"], scores["authority"] = hits(matrix, tol=tol, max_iter=max_iter, start=starts["hub"])
+    scores["katz"] = katz(matrix, tol=tol, max_iter=max_iter, start=starts["katz"])
+    return scores
+
+
+def add_centrality(graph: nx.DiGraph, previous: Optional[dict[str, dict[str, float]]] = None) -> None:
+    """Adds centrality scores to the verse nodes of a graph (in place); see `get_centrality`."""
+    verses = [node for node, kind in graph.nodes(data="kind") if kind == "verse"]
+    adjacency = Adjacency.from_graph(graph.subgraph(verses))
+    for name, values in get_centrality(adjacency, previous=previous).items():
+        nx.set_node_attributes(graph, dict(zip(adjacency.nodes.tolist(), values.tolist())), name=name)
+
+
+def read_centrality(graph: nx.Graph) -> dict[str, dict[str, float]]:
+    """Reads the centrality scores stored on a graph by `add_centrality`."""
+    return {name: nx.get_node_attributes(graph, name) for name in CENTRALITY_MEASURES}
+
+
+@dataclasses.dataclass
+class Components:
+    """A partition of the nodes of a graph, such as its connected components or communities.
+
+    Components are labeled in order of decreasing size (ties are broken by the
+    smallest node ID in each component), so label 0 is the largest component.
+
+    Attributes:
+        labels: Array of component labels for each node.
+        sizes: Array of component sizes, indexed by label.
+    """
+
+    labels: np.ndarray
+    sizes: np.ndarray
+
+    @classmethod
+    def from_labels(cls, labels: np.ndarray) -> "Components":
+        """Relabels components (given arbitrary integer labels) in order of decreasing size."""
+        _, first, inverse, counts = np.unique(labels, return_index=True, return_inverse=True, return_counts=True)
+        order = np.lexsort((first, -counts))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.size)
+        return cls(labels=rank[inverse.ravel()], sizes=counts[order])
+
+    @property
+    def histogram(self) -> dict[int, int]:
+        """Maps each component size to the number of components with that size."""
+        sizes, counts = np.unique(self.sizes, return_counts=True)
+        return dict(zip(sizes[::-1].tolist(), counts[::-1].tolist()))
+
+
+def get_weak_components(matrix: scipy.sparse.csr_matrix) -> Components:
+    """Finds weakly connected components with array-based union-find.
+
+    Each round hooks the root of every edge endpoint onto the smaller of the two
+    roots, then compresses paths by pointer jumping until every node points at
+    its root. Edges within a single tree are dropped between rounds.
+
+    Args:
+        matrix: N x N adjacency matrix.
+
+    Returns:
+        Components.
+    """
+    coo = matrix.tocoo()
+    rows, cols = coo.row, coo.col
+    parent = np.arange(matrix.shape[0])
+    while True:
+        row_roots, col_roots = parent[rows], parent[cols]
+        mask = row_roots != col_roots
+        if not mask.any():
+            break
+        rows, cols, row_roots, col_roots = rows[mask], cols[mask], row_roots[mask], col_roots[mask]
+        np.minimum.at(parent, np.maximum(row_roots, col_roots), np.minimum(row_roots, col_roots))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return Components.from_labels(parent)
+
+
+def get_strong_components(matrix: scipy.sparse.csr_matrix) -> Components:
+    """Finds strongly connected components with an iterative version of Tarjan's algorithm.
+
+    Args:
+        matrix: N x N adjacency matrix; row i contains the nodes that i links to.
+
+    Returns:
+        Components.
+    """
+    indptr = matrix.indptr.tolist()
+    indices = matrix.indices.tolist()
+    size = matrix.shape[0]
+    order = [-1] * size  # Discovery order.
+    lowlink = [0] * size
+    on_stack = [False] * size
+    labels = [-1] * size
+    stack = []
+    counter = 0
+    num_components = 0
+    for root in range(size):
+        if order[root] >= 0:
+            continue
+        order[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        # Each work item is a node and the position of its next unexplored edge.
+        work = [(root, indptr[root])]
+        while work:
+            node, position = work[-1]
+            end = indptr[node + 1]
+            while position < end:
+                child = indices[position]
+                position += 1
+                if order[child] < 0:
+                    work[-1] = (node, position)
+                    order[child] = lowlink[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, indptr[child]))
+                    break
+                if on_stack[child]:
+                    lowlink[node] = min(lowlink[node], order[child])
+            else:
+                work.pop()
+                if lowlink[node] == order[node]:
+                    member = None
+                    while member != node:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        labels[member] = num_components
+                    num_components += 1
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+    return Components.from_labels(np.asarray(labels))
+
+
+def get_canonical_matrix(graph: nx.DiGraph) -> tuple[list[str], scipy.sparse.csr_matrix]:
+    """Builds a sparse matrix of canonical edges for any graph (including topic nodes).
+
+    Returns:
+        nodes: List of node keys, in graph order.
+        matrix: N x N CSR matrix with matrix[i, j] = 1 if i references j.
+    """
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    rows, cols = [], []
+    for source, target, kind in graph.edges(data="kind"):
+        if not kind:
+            rows.append(index[source])
+            cols.append(index[target])
+    matrix = scipy.sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(len(nodes), len(nodes)))
+    return nodes, matrix
+
+
+def add_components(graph: nx.DiGraph) -> None:
+    """Adds weak and strong component labels and sizes (over canonical edges) to each node (in place)."""
+    nodes, matrix = get_canonical_matrix(graph)
+    for prefix, components in [("weak", get_weak_components(matrix)), ("strong", get_strong_components(matrix))]:
+        logger.info(f"Found {components.sizes.size} {prefix} components (largest: {components.sizes[0]})")
+        nx.set_node_attributes(graph, dict(zip(nodes, components.labels.tolist())), name=f"{prefix}_component")
+        sizes = components.sizes[components.labels].tolist()
+        nx.set_node_attributes(graph, dict(zip(nodes, sizes)), name=f"{prefix}_component_size")
+
+
+def get_communities(
+    matrix: scipy.sparse.csr_matrix,
+    seed: int = 0,
+    max_iter: int = 100,
+    tol: float = 1e-3,
+    num_threads: Optional[int] = None,
+) -> Components:
+    """Detects communities with semi-synchronous label propagation.
+
+    Every node starts in its own community. In each round a random half of the
+    nodes adopts the label with the largest total edge weight among its
+    neighbors; updating only half of the nodes keeps synchronous updates from
+    oscillating. Ties are broken in favor of the current label and then by a
+    random priority over labels. Only "dirty" nodes (with a neighbor that changed
+    labels since their last update) are recomputed, and rounds stop once fewer
+    than `tol` of the nodes are dirty.
+
+    The best labels for each round are computed over chunks of nodes in a thread
+    pool (numpy releases the GIL for the sorts and reductions). All random draws
+    are made up front, so the result only depends on `seed`.
+
+    Args:
+        matrix: Symmetric N x N matrix of edge weights.
+        seed: Random seed.
+        max_iter: Maximum number of rounds.
+        tol: Fraction of dirty nodes below which the propagation stops.
+        num_threads: Number of threads; None uses one per CPU.
+
+    Returns:
+        Components.
+    """
+    matrix = matrix.tocsr()
+    size = matrix.shape[0]
+    degree = np.diff(matrix.indptr)
+    num_threads = num_threads or os.cpu_count() or 1
+    rng = np.random.default_rng(seed)
+    labels = np.arange(size)
+    dirty = np.ones(size, dtype=bool)
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        for iteration in range(max_iter):
+            priority = rng.permutation(size)
+            nodes = np.flatnonzero(dirty & (rng.random(size) < 0.5))
+            dirty[nodes] = False
+            num_chunks = max(1, min(num_threads, degree[nodes].sum() // 100_000))
+            get_best_labels = functools.partial(_get_best_labels, matrix, labels, priority)
+            best = np.concatenate(list(executor.map(get_best_labels, np.array_split(nodes, num_chunks))))
+            mask = best != labels[nodes]
+            labels[nodes[mask]] = best[mask]
+            dirty[get_neighbors(matrix, nodes[mask])] = True
+            logger.debug(f"Label propagation round {iteration}: {mask.sum()} changes, {dirty.sum()} dirty nodes")
+            if dirty.sum() < tol * size:
+                break
+    return Components.from_labels(labels)
+
+
+def _get_best_labels(
+    matrix: scipy.sparse.csr_matrix, labels: np.ndarray, priority: np.ndarray, nodes: np.ndarray
+) -> np.ndarray:
+    """Finds the heaviest neighboring label for each node; isolated nodes keep their labels."""
+    starts = matrix.indptr[nodes]
+    lengths = matrix.indptr[nodes + 1] - starts
+    best = labels[nodes]
+    total = lengths.sum()
+    if not total:
+        return best
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+    rows = np.repeat(np.arange(nodes.size, dtype=np.int64), lengths)
+    # Sum the weights for each (row, label) pair.
+    keys, inverse = np.unique(rows * labels.size + labels[matrix.indices[offsets]], return_inverse=True)
+    totals = np.bincount(inverse.ravel(), weights=matrix.data[offsets], minlength=keys.size)
+    pair_rows, pair_labels = keys // labels.size, keys % labels.size
+    # The last entry for each row has the largest total (then the current label, then the highest priority).
+    order = np.lexsort((priority[pair_labels], pair_labels == best[pair_rows], totals, pair_rows))
+    last = order[np.append(pair_rows[order][1:] != pair_rows[order][:-1], True)]
+    best[pair_rows[last]] = pair_labels[last]
+    return best
+
+
+def add_communities(
+    graph: nx.DiGraph, include_topics: bool = False, include_suggested: bool = True, seed: int = 0
+) -> None:
+    """Adds community labels and sizes to the nodes of a graph (in place); see `get_communities`.
+
+    Canonical references have weight 1 in each direction (so reciprocal references
+    have weight 2), and suggested edges are weighted by their similarity.
+
+    Args:
+        graph: Graph.
+        include_topics: Whether to cluster topic nodes along with verses.
+        include_suggested: Whether to use suggested edges.
+        seed: Random seed.
+    """
+    subgraph = graph if include_topics else graph.subgraph(n for n, kind in graph.nodes(data="kind") if kind == "verse")
+    nodes, canonical = get_canonical_matrix(subgraph)
+    matrix = (canonical + canonical.T).astype(np.float32)
+    if include_suggested:
+        index = {node: i for i, node in enumerate(nodes)}
+        rows, cols, similarities = [], [], []
+        for source, target, data in subgraph.edges(data=True):
+            if data.get("kind"):
+                rows.append(index[source])
+                cols.append(index[target])
+                similarities.append(data.get("similarity", 1.0))
+        suggested = scipy.sparse.csr_matrix((similarities, (rows, cols)), shape=matrix.shape, dtype=np.float32)
+        matrix = matrix + suggested.maximum(suggested.T)
+    communities = get_communities(matrix.tocsr(), seed=seed)
+    logger.info(f"Found {communities.sizes.size} communities (largest: {communities.sizes[0]})")
+    nx.set_node_attributes(graph, dict(zip(nodes, communities.labels.tolist())), name="community")
+    sizes = communities.sizes[communities.labels].tolist()
+    nx.set_node_attributes(graph, dict(zip(nodes, sizes)), name="community_size")
+
+
+def get_rollups(graph: nx.DiGraph) -> dict[str, dict]:
+    """Aggregates verse-level edges into volume, book, and chapter graphs.
+
+    Edges are counted separately for each of EDGE_KINDS, in the direction they
+    are stored (so each suggested edge is counted in both directions). Edges
+    within a group are kept as self-loops.
+
+    Args:
+        graph: Graph; topic nodes are ignored.
+
+    Returns:
+        Dict mapping each of ROLLUP_LEVELS to a dict with "nodes" (a list of dicts
+        with "id", "parent", and "verses" keys, in Standard Works order) and
+        "edges" (a list of [source, target, *counts] lists, with counts in
+        EDGE_KINDS order).
+    """
+    verses = [node for node, kind in graph.nodes(data="kind") if kind == "verse"]
+    adjacency = Adjacency.from_graph(graph.subgraph(verses))
+    nodes = pd.DataFrame([graph.nodes[node] for node in adjacency.nodes.tolist()])
+    nodes["chapter"] = nodes["book"] + " " + nodes["chapter"].astype(str)
+    canonical = adjacency.canonical.tocoo()
+    suggested = adjacency.suggested_kinds.tocoo()
+    edges = pd.DataFrame(
+        {
+            "source": np.concatenate([canonical.row, suggested.row]),
+            "target": np.concatenate([canonical.col, suggested.col]),
+            "kind": np.concatenate([np.zeros(canonical.nnz, dtype=np.int8), suggested.data]),
+        }
+    )
+    parents = {"volume": None, "book": "volume", "chapter": "book"}
+    rollups = {}
+    for level in ROLLUP_LEVELS:
+        # NOTE(kearnes): Nodes are in Standard Works order, so unsorted codes follow that order too.
+        codes, names = pd.factorize(nodes[level], sort=False)
+        groups = nodes.groupby(codes, sort=True)
+        counts = (
+            pd.DataFrame({"source": codes[edges["source"]], "target": codes[edges["target"]], "kind": edges["kind"]})
+            .groupby(["source", "target", "kind"])
+            .size()
+            .unstack("kind", fill_value=0)
+            .reindex(columns=range(len(EDGE_KINDS)), fill_value=0)
+        )
+        sizes = groups.size().tolist()
+        if parents[level]:
+            parent_names = groups[parents[level]].first().tolist()
+        else:
+            parent_names = [None] * len(names)
+        rollup_nodes = [
+            {"id": name, "parent": parent, "verses": size} for name, parent, size in zip(names, parent_names, sizes)
+        ]
+        rollup_edges = []
+        for (source, target), row in zip(counts.index, counts.to_numpy().tolist()):
+            rollup_edges.append([names[source], names[target], *row])
+        rollups[level] = {"nodes": rollup_nodes, "edges": rollup_edges}
+        logger.info(f"Rollup for {level}: {len(rollup_nodes)} nodes and {len(rollup_edges)} edges")
+    return rollups
+
+
+def write_rollups(graph: nx.DiGraph, filename: str) -> None:
+    """Writes rollup graphs (see `get_rollups`) to JSON, along with compressed copies."""
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(get_rollups(graph), f, separators=(",", ":"))
+    write_compressed(filename)
@@ -14,6 +14,8 @@
 """Tests for scripture_graph.graph_lib."""
 from collections import Counter
 
+import networkx as nx
+import numpy as np
 import pytest
 
 from scripture_graph import graph_lib
@@ -76,3 +78,236 @@ def test_parse_reference(text, expected):
 )
 def test_correct_topic_references(topics, references, expected):
     assert Counter(graph_lib.correct_topic_references(["1 Ne. 3:7"], topics, references)) == Counter(expected)
+
+
+@pytest.fixture(name="graph")
+def graph_fixture():
+    """Small cross-reference graph."""
+    graph = nx.DiGraph()
+    for verse in range(1, 7):
+        graph.add_node(f"Alma 32:{verse}", kind="verse", volume="Book of Mormon", book="Alma", chapter=32, verse=verse)
+    graph.add_node("1 Ne. 3:7", kind="verse", volume="Book of Mormon", book="1 Ne.", chapter=3, verse=7)
+    # 1 Ne. 3:7 -> Alma 32:1 <-> Alma 32:2 -> Alma 32:3 -> Alma 32:4; Alma 32:5 <?> Alma 32:1.
+    graph.add_edge("1 Ne. 3:7", "Alma 32:1")
+    graph.add_edge("Alma 32:1", "Alma 32:2")
+    graph.add_edge("Alma 32:2", "Alma 32:1")
+    graph.add_edge("Alma 32:2", "Alma 32:3")
+    graph.add_edge("Alma 32:3", "Alma 32:4")
+    graph.add_edge("Alma 32:5", "Alma 32:1", kind="jaccard", similarity=0.5)
+    graph.add_edge("Alma 32:1", "Alma 32:5", kind="jaccard", similarity=0.5)
+    return graph
+
+
+@pytest.fixture(name="adjacency")
+def adjacency_fixture(graph):
+    """Adjacency index for the graph fixture."""
+    return graph_lib.Adjacency.from_graph(graph)
+
+
+def test_adjacency(adjacency, tmp_path):
+    # Nodes are sorted in Standard Works order.
+    assert adjacency.nodes.tolist()[:2] == ["1 Ne. 3:7", "Alma 32:1"]
+    assert adjacency.canonical.nnz == 5
+    assert adjacency.suggested.nnz == 2
+    filename = (tmp_path / "index.npz").as_posix()
+    adjacency.save(filename)
+    loaded = graph_lib.Adjacency.load(filename)
+    assert loaded.nodes.tolist() == adjacency.nodes.tolist()
+    assert (loaded.canonical != adjacency.canonical).nnz == 0
+    assert (loaded.suggested != adjacency.suggested).nnz == 0
+
+
+@pytest.mark.parametrize(
+    "direction,include_suggested,max_nodes,expected",
+    [
+        ("outgoing", False, None, {"Alma 32:1": 0, "Alma 32:2": 1, "Alma 32:3": 2}),
+        ("incoming", False, None, {"Alma 32:1": 0, "1 Ne. 3:7": 1, "Alma 32:2": 1}),
+        ("all", True, None, {"Alma 32:1": 0, "1 Ne. 3:7": 1, "Alma 32:2": 1, "Alma 32:5": 1, "Alma 32:3": 2}),
+        ("all", True, 3, {"Alma 32:1": 0, "1 Ne. 3:7": 1, "Alma 32:2": 1}),
+    ],
+)
+def test_get_neighborhood(adjacency, direction, include_suggested, max_nodes, expected):
+    node_ids, distances = graph_lib.get_neighborhood(
+        adjacency, "Alma 32:1", hops=2, direction=direction, include_suggested=include_suggested, max_nodes=max_nodes
+    )
+    assert dict(zip(adjacency.nodes[node_ids].tolist(), distances.tolist())) == expected
+
+
+def test_get_subgraph_edges(adjacency):
+    node_ids = [adjacency.index[node] for node in ["1 Ne. 3:7", "Alma 32:1", "Alma 32:2", "Alma 32:5"]]
+    edges = adjacency.get_subgraph_edges(node_ids, include_suggested=True)
+    assert [(adjacency.nodes[i], adjacency.nodes[j], kind) for i, j, kind in edges] == [
+        ("1 Ne. 3:7", "Alma 32:1", "outgoing"),
+        ("Alma 32:1", "Alma 32:2", "both"),
+        ("Alma 32:1", "Alma 32:5", "suggested"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "source,target,kwargs,expected",
+    [
+        ("1 Ne. 3:7", "Alma 32:4", {}, [["1 Ne. 3:7", "Alma 32:1", "Alma 32:2", "Alma 32:3", "Alma 32:4"]]),
+        ("Alma 32:4", "1 Ne. 3:7", {}, []),
+        ("Alma 32:4", "Alma 32:2", {"directed": False}, [["Alma 32:4", "Alma 32:3", "Alma 32:2"]]),
+        ("Alma 32:5", "Alma 32:2", {"directed": False}, []),
+        ("Alma 32:5", "Alma 32:2", {"include_suggested": True}, [["Alma 32:5", "Alma 32:1", "Alma 32:2"]]),
+        ("Alma 32:1", "Alma 32:1", {}, [["Alma 32:1"]]),
+    ],
+)
+def test_get_shortest_paths(adjacency, source, target, kwargs, expected):
+    assert graph_lib.get_shortest_paths(adjacency, source, target, **kwargs) == expected
+
+
+def test_get_k_shortest_paths():
+    graph = nx.DiGraph()
+    # Two routes from A to D: A -> B -> D and A -> C -> E -> D.
+    for verse in range(1, 6):
+        graph.add_node(f"Alma 32:{verse}", kind="verse", volume="Book of Mormon", book="Alma", chapter=32, verse=verse)
+    graph.add_edges_from(
+        [("Alma 32:1", "Alma 32:2"), ("Alma 32:2", "Alma 32:4"), ("Alma 32:1", "Alma 32:3")]
+        + [("Alma 32:3", "Alma 32:5"), ("Alma 32:5", "Alma 32:4")]
+    )
+    adjacency = graph_lib.Adjacency.from_graph(graph)
+    paths = graph_lib.get_shortest_paths(adjacency, "Alma 32:1", "Alma 32:4", k=3)
+    assert paths == [
+        ["Alma 32:1", "Alma 32:2", "Alma 32:4"],
+        ["Alma 32:1", "Alma 32:3", "Alma 32:5", "Alma 32:4"],
+    ]
+
+
+@pytest.mark.parametrize(
+    "kwargs,expected",
+    [
+        ({}, ["Alma 32:2", "1 Ne. 3:7", "Alma 32:3", "Alma 32:4"]),
+        ({"include_suggested": True, "k": 3}, ["Alma 32:2", "1 Ne. 3:7", "Alma 32:5"]),
+        ({"exclude_neighbors": True}, ["Alma 32:3", "Alma 32:4"]),
+        ({"direction": "incoming"}, ["1 Ne. 3:7", "Alma 32:2"]),
+    ],
+)
+def test_get_related(adjacency, kwargs, expected):
+    related = graph_lib.get_related(adjacency, "Alma 32:1", epsilon=1e-6, **kwargs)
+    assert [node for node, _ in related] == expected
+    scores = [score for _, score in related]
+    assert scores == sorted(scores, reverse=True)
+    assert 0 < sum(scores) < 1
+
+
+def test_get_centrality(graph, adjacency):
+    canonical = graph.edge_subgraph([edge for edge in graph.edges if not graph.edges[edge].get("kind")]).copy()
+    canonical.add_nodes_from(graph)
+    hubs, authorities = nx.hits(canonical, tol=1e-12)
+    expected = {
+        "pagerank": nx.pagerank(canonical, tol=1e-12),
+        "hub": hubs,
+        "authority": authorities,
+        "katz": nx.katz_centrality(canonical, alpha=0.5, tol=1e-12),
+    }
+    scores = graph_lib.get_centrality(adjacency)
+    scores["katz"] = graph_lib.katz(adjacency.canonical, alpha=0.5)
+    for name in graph_lib.CENTRALITY_MEASURES:
+        np.testing.assert_allclose(scores[name], [expected[name][node] for node in adjacency.nodes], atol=1e-8)
+    # Warm starts converge to the same scores.
+    graph_lib.add_centrality(graph)
+    previous = graph_lib.read_centrality(graph)
+    assert set(previous["pagerank"]) == set(graph.nodes)
+    warm = graph_lib.get_centrality(adjacency, previous=previous)
+    for name in graph_lib.CENTRALITY_MEASURES:
+        np.testing.assert_allclose(warm[name], [previous[name][node] for node in adjacency.nodes], atol=1e-8)
+
+
+def test_get_components(graph):
+    nodes, matrix = graph_lib.get_canonical_matrix(graph)
+    weak = graph_lib.get_weak_components(matrix)
+    # Alma 32:5 and Alma 32:6 only have suggested edges (or none).
+    assert weak.sizes.tolist() == [5, 1, 1]
+    assert weak.histogram == {5: 1, 1: 2}
+    strong = graph_lib.get_strong_components(matrix)
+    assert strong.histogram == {2: 1, 1: 5}
+    assert {node for node, label in zip(nodes, strong.labels) if label == 0} == {"Alma 32:1", "Alma 32:2"}
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_get_components_random(seed):
+    random_graph = nx.gnp_random_graph(300, 0.006, seed=seed, directed=True)
+    matrix = nx.to_scipy_sparse_array(random_graph, format="csr")
+    for components, expected in [
+        (graph_lib.get_weak_components(matrix), nx.weakly_connected_components(random_graph)),
+        (graph_lib.get_strong_components(matrix), nx.strongly_connected_components(random_graph)),
+    ]:
+        expected = sorted(expected, key=lambda component: (-len(component), min(component)))
+        assert components.sizes.tolist() == [len(component) for component in expected]
+        for label, component in enumerate(expected):
+            assert set(np.flatnonzero(components.labels == label).tolist()) == component
+
+
+def test_get_communities():
+    # Two 5-cliques joined by a single edge.
+    clique_graph = nx.barbell_graph(5, 0)
+    matrix = nx.to_scipy_sparse_array(clique_graph, format="csr")
+    communities = graph_lib.get_communities(matrix, seed=0)
+    assert communities.sizes.tolist() == [5, 5]
+    assert len(set(communities.labels[:5].tolist())) == len(set(communities.labels[5:].tolist())) == 1
+    # Results do not depend on the number of threads.
+    for seed in range(5):
+        labels = graph_lib.get_communities(matrix, seed=seed, num_threads=1).labels
+        np.testing.assert_array_equal(graph_lib.get_communities(matrix, seed=seed, num_threads=4).labels, labels)
+
+
+def test_add_communities(graph):
+    graph_lib.add_communities(graph)
+    communities = nx.get_node_attributes(graph, "community")
+    assert set(communities) == set(graph.nodes)
+    assert communities["Alma 32:1"] == communities["Alma 32:2"]
+    assert graph.nodes["Alma 32:6"]["community_size"] == 1
+
+
+def test_get_rollups(graph):
+    graph.add_node("Mosiah 2:17", kind="verse", volume="Book of Mormon", book="Mosiah", chapter=2, verse=17)
+    graph.add_edge("Mosiah 2:17", "Alma 32:1")
+    graph.add_node("TG Faith", kind="topic")
+    graph.add_edge("TG Faith", "Alma 32:1")
+    rollups = graph_lib.get_rollups(graph)
+    assert rollups["volume"] == {
+        "nodes": [{"id": "Book of Mormon", "parent": None, "verses": 8}],
+        "edges": [["Book of Mormon", "Book of Mormon", 6, 2, 0]],
+    }
+    assert [node["id"] for node in rollups["book"]["nodes"]] == ["1 Ne.", "Mosiah", "Alma"]
+    assert rollups["chapter"]["nodes"][1] == {"id": "Mosiah 2", "parent": "Mosiah", "verses": 1}
+    assert rollups["book"]["edges"] == [
+        ["1 Ne.", "Alma", 1, 0, 0],
+        ["Mosiah", "Alma", 1, 0, 0],
+        ["Alma", "Alma", 4, 2, 0],
+    ]
+
+
+def test_topic_index(graph, tmp_path):
+    for topic in ["TG Faith", "TG Hope", "TG Obedience"]:
+        graph.add_node(topic, kind="topic")
+    for verse in ["Alma 32:1", "Alma 32:2", "Alma 32:3"]:
+        graph.add_edge("TG Faith", verse)
+    graph.add_edge("Alma 32:1", "TG Faith")
+    graph.add_edge("TG Hope", "Alma 32:2")
+    graph.add_edge("TG Hope", "Alma 32:4")
+    graph.add_edge("1 Ne. 3:7", "TG Obedience")
+    index = graph_lib.TopicIndex.from_graph(graph)
+    assert index.topics.tolist() == ["TG Faith", "TG Hope", "TG Obedience"]
+    assert index.incidence[index.verse_index["Alma 32:1"], 0] == (
+        graph_lib.TOPIC_CITES_VERSE | graph_lib.VERSE_CITES_TOPIC
+    )
+    filename = (tmp_path / "topics.npz").as_posix()
+    index.save(filename)
+    index = graph_lib.TopicIndex.load(filename)
+    assert index.get_topics("Alma 32:2") == ["TG Faith", "TG Hope"]
+    assert index.get_topics("Alma 32:6") == []
+    assert index.get_verses("TG Faith") == (["Alma 32:1", "Alma 32:2", "Alma 32:3"], 3)
+    assert index.get_verses("TG Faith", k=1, offset=1) == (["Alma 32:2"], 3)
+    assert index.get_verses("TG Faith", offset=5) == ([], 3)
+    # Alma 32:1 shares TG Faith with Alma 32:2, which is also in TG Hope.
+    assert index.get_cocited_topics("Alma 32:1") == [("TG Hope", pytest.approx(1 / np.sqrt(2)))]
+    assert index.get_cocited_topics("Alma 32:6") == []
+    with pytest.raises(ValueError, match="must be positive"):
+        index.get_verses("TG Faith", k=0)
+    with pytest.raises(ValueError, match="must be non-negative"):
+        index.get_verses("TG Faith", offset=-1)
+    with pytest.raises(ValueError, match="must be positive"):
+        index.get_cocited_topics("Alma 32:1", k=-1)
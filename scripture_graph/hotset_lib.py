@@ -0,0 +1,189 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Hot sets of popular Connection Explorer requests.
+
+A hot set lists the /elements and /table requests that a fresh app instance
+pre-renders during warmup, most popular first. Popularity comes from access
+logs when they are available; any remaining slots are filled with verses in
+order of PageRank, using the parameters of the client's initial request.
+
+The hot set is stored as JSON:
+
+    {
+        "source": "access_logs",
+        "elements": [{"verse": ..., "filter_mode": ..., "include_suggested": ..., "max_nodes": ...}, ...],
+        "table": [<verse>, ...]
+    }
+"""
+import collections
+import dataclasses
+import glob
+import gzip
+import re
+import urllib.parse
+from typing import Any, Iterable, Iterator, Optional
+
+import networkx as nx
+
+from scripture_graph import graph_lib
+from scripture_graph.explorer_lib import Connections, FilterMode
+
+# Parameters of the client's /elements requests before the user changes any settings; must match the defaults in
+# index.html and MAX_NODES in script.js. The static export (see build_connections.py) also pages by CLIENT_MAX_NODES.
+CLIENT_FILTER_MODE = "all"
+CLIENT_INCLUDE_SUGGESTED = True
+CLIENT_MAX_NODES = 100
+
+# Matches /elements and /table requests with a query string, in common/combined log format lines as well as
+# exported request logs that contain full URLs.
+REQUEST_PATTERN = re.compile(r"/(elements|table)\?([^\s\"']+)")
+
+
+@dataclasses.dataclass(frozen=True)
+class ElementsRequest:
+    """Parameters for an /elements request (see app/main.py).
+
+    Attributes:
+        verse: Verse key.
+        filter_mode: FilterMode name (lowercase).
+        include_suggested: Whether to include suggested edges.
+        max_nodes: Maximum number of neighbors; None returns all of them.
+    """
+
+    verse: str
+    filter_mode: str = CLIENT_FILTER_MODE
+    include_suggested: bool = CLIENT_INCLUDE_SUGGESTED
+    max_nodes: Optional[int] = CLIENT_MAX_NODES
+
+    def to_json(self) -> dict[str, Any]:
+        """Returns the request parameters as a dict."""
+        return dataclasses.asdict(self)
+
+
+def _parse_elements_request(query: dict[str, list[str]]) -> Optional[ElementsRequest]:
+    """Parses the query string of an /elements request; returns None for unsupported or paged requests."""
+    try:
+        verse = query["verse"][0]
+        filter_mode = query["filter_mode"][0].lower()
+        include_suggested = query["include_suggested"][0].lower() == "true"
+        max_nodes = int(query["max_nodes"][0]) if "max_nodes" in query else None
+        cursor = int(query.get("cursor", ["0"])[0])
+    except (KeyError, ValueError):
+        return None
+    if cursor or filter_mode.upper() not in FilterMode.__members__:
+        return None
+    return ElementsRequest(verse, filter_mode, include_suggested, max_nodes)
+
+
+def parse_access_log(lines: Iterable[str]) -> tuple[collections.Counter, collections.Counter]:
+    """Counts /elements and /table requests in access log lines.
+
+    Only GET requests are logged with their parameters, so POST requests are not counted. Requests for later pages
+    of large neighborhoods (nonzero cursors) are ignored.
+
+    Args:
+        lines: Log lines.
+
+    Returns:
+        Counter of ElementsRequests and Counter of /table verses.
+    """
+    elements, table = collections.Counter(), collections.Counter()
+    for line in lines:
+        match = REQUEST_PATTERN.search(line)
+        if not match:
+            continue
+        query = urllib.parse.parse_qs(match.group(2))
+        if match.group(1) == "table":
+            if "verse" in query:
+                table[query["verse"][0]] += 1
+            continue
+        request = _parse_elements_request(query)
+        if request is not None:
+            elements[request] += 1
+    return elements, table
+
+
+def _read_lines(filename: str) -> Iterator[str]:
+    """Reads lines from a (possibly gzipped) log file."""
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "rt", encoding="utf-8", errors="replace") as f:
+        yield from f
+
+
+def read_access_logs(filenames: Iterable[str]) -> tuple[collections.Counter, collections.Counter]:
+    """Counts requests in a set of access log files; see `parse_access_log`."""
+    elements, table = collections.Counter(), collections.Counter()
+    for filename in filenames:
+        file_elements, file_table = parse_access_log(_read_lines(filename))
+        elements.update(file_elements)
+        table.update(file_table)
+    return elements, table
+
+
+def get_log_filenames(pattern: str) -> list[str]:
+    """Expands a glob pattern for access logs."""
+    filenames = sorted(glob.glob(pattern))
+    if not filenames:
+        raise ValueError(f"no access logs match {pattern}")
+    return filenames
+
+
+def rank_verses(graph: nx.DiGraph) -> list[str]:
+    """Ranks the verses in a graph by PageRank (computed here if the graph does not already have scores)."""
+    verses = [node for node, kind in graph.nodes(data="kind") if kind == "verse"]
+    scores = nx.get_node_attributes(graph, "pagerank")
+    if not all(verse in scores for verse in verses):
+        adjacency = graph_lib.Adjacency.from_graph(graph.subgraph(verses))
+        scores = dict(zip(adjacency.nodes.tolist(), graph_lib.pagerank(adjacency.canonical).tolist()))
+    # Ties are broken by verse key so that the ranking is deterministic.
+    return sorted(verses, key=lambda verse: (-scores[verse], verse))
+
+
+def get_hot_set(
+    connections: Connections,
+    ranking: list[str],
+    size: int,
+    elements_counts: Optional[collections.Counter] = None,
+    table_counts: Optional[collections.Counter] = None,
+) -> dict[str, Any]:
+    """Builds a hot set.
+
+    Args:
+        connections: Connections; requests for verses that are not in the current build are dropped.
+        ranking: Verses in order of decreasing importance (see `rank_verses`), used to fill the hot set.
+        size: Maximum number of requests for each route.
+        elements_counts: Optional Counter of ElementsRequests from access logs.
+        table_counts: Optional Counter of /table verses from access logs.
+
+    Returns:
+        Dict containing the hot set.
+    """
+    elements, table = {}, {}
+    for request, _ in (elements_counts or collections.Counter()).most_common():
+        if len(elements) < size and request.verse in connections:
+            elements[request] = None
+    for verse, _ in (table_counts or collections.Counter()).most_common():
+        if len(table) < size and verse in connections:
+            table[verse] = None
+    source = "access_logs" if elements or table else "centrality"
+    for verse in ranking:
+        if len(elements) >= size and len(table) >= size:
+            break
+        if verse not in connections:
+            continue
+        if len(elements) < size:
+            elements.setdefault(ElementsRequest(verse), None)
+        if len(table) < size:
+            table.setdefault(verse, None)
+    return {"source": source, "elements": [request.to_json() for request in elements], "table": list(table)}
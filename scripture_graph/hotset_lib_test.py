@@ -0,0 +1,75 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.hotset_lib."""
+import collections
+import gzip
+
+import networkx as nx
+import pytest
+
+from scripture_graph import hotset_lib
+
+
+def test_parse_access_log():
+    lines = [
+        '1.2.3.4 - - [19/Oct/2026:06:00:00 +0000] "GET /elements?verse=1+Ne.+3%3A7&filter_mode=all'
+        '&include_suggested=true&max_nodes=100&cursor=0 HTTP/1.1" 200 512',
+        '1.2.3.4 - - [19/Oct/2026:06:00:01 +0000] "GET /elements?verse=1+Ne.+3%3A7&filter_mode=all'
+        '&include_suggested=true&max_nodes=100&cursor=0 HTTP/1.1" 304 0',
+        '{"requestUrl": "https://example.com/elements?verse=D%26C+1%3A1&filter_mode=incoming'
+        '&include_suggested=false&max_nodes=100&cursor=0"}',
+        '"GET /elements?verse=Alma+32%3A21&filter_mode=all&include_suggested=true&max_nodes=100&cursor=100 HTTP/1.1"',
+        '"GET /elements?verse=Alma+32%3A21&filter_mode=sideways&include_suggested=true HTTP/1.1"',
+        '"GET /table?verse=Alma+32%3A21 HTTP/1.1" 200 100',
+        '"GET /tree HTTP/1.1" 200 100',
+    ]
+    elements, table = hotset_lib.parse_access_log(lines)
+    assert elements == {
+        hotset_lib.ElementsRequest("1 Ne. 3:7"): 2,
+        hotset_lib.ElementsRequest("D&C 1:1", "incoming", False, 100): 1,
+    }
+    assert table == {"Alma 32:21": 1}
+
+
+def test_read_access_logs(tmp_path):
+    with gzip.open(tmp_path / "a.log.gz", "wt") as f:
+        f.write('"GET /table?verse=Alma+32%3A21 HTTP/1.1" 200 100\n')
+    with open(tmp_path / "b.log", "w") as f:
+        f.write('"GET /table?verse=Alma+32%3A21 HTTP/1.1" 200 100\n')
+    filenames = hotset_lib.get_log_filenames(str(tmp_path / "*.log*"))
+    _, table = hotset_lib.read_access_logs(filenames)
+    assert table == {"Alma 32:21": 2}
+    with pytest.raises(ValueError, match="no access logs"):
+        hotset_lib.get_log_filenames(str(tmp_path / "*.txt"))
+
+
+def test_get_hot_set():
+    graph = nx.DiGraph()
+    for i, verse in enumerate("abcd", start=1):
+        graph.add_node(verse, kind="verse", book="Alma", chapter=32, verse=i)
+    graph.add_edges_from([("a", "c"), ("b", "c"), ("c", "d")])
+    ranking = hotset_lib.rank_verses(graph)
+    assert ranking[:2] == ["d", "c"]
+    connections = {verse: {} for verse in "abcd"}
+    hot_set = hotset_lib.get_hot_set(connections, ranking, size=2)
+    assert hot_set["source"] == "centrality"
+    assert [request["verse"] for request in hot_set["elements"]] == ["d", "c"]
+    assert hot_set["table"] == ["d", "c"]
+    elements_counts = {hotset_lib.ElementsRequest("b", "incoming", False, None): 5, hotset_lib.ElementsRequest("z"): 9}
+    hot_set = hotset_lib.get_hot_set(connections, ranking, size=2, elements_counts=collections.Counter(elements_counts))
+    assert hot_set["source"] == "access_logs"
+    assert hot_set["elements"] == [
+        {"verse": "b", "filter_mode": "incoming", "include_suggested": False, "max_nodes": None},
+        {"verse": "d", "filter_mode": "all", "include_suggested": True, "max_nodes": 100},
+    ]
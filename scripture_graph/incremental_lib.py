@@ -0,0 +1,442 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incremental graph updates for revisions to individual EPUB archives.
+
+A full build (build_graph.py --records) stores the parsed records for each EPUB
+along with the USE embedding for each verse (see `BuildRecords`). An update
+(update_graph.py) reparses only the EPUBs whose contents changed, diffs the
+canonical graph against the stored records (see `diff_graphs`), and patches the
+previous graph:
+
+* Jaccard edges are recomputed only for verses whose canonical neighborhood
+  changed; every other pair of verses has unchanged neighborhoods.
+* USE edges are recomputed only for verses whose text or canonical
+  neighborhood changed, using the stored embeddings for all other verses.
+"""
+import dataclasses
+import json
+import logging
+import os
+from typing import Any, Optional
+
+import networkx as nx
+import numpy as np
+import scipy.sparse
+
+from scripture_graph import graph_lib
+from scripture_graph import pipeline_lib
+
+logger = logging.getLogger(__name__)
+
+# pylint: disable=too-many-branches
+# pylint: disable=too-many-locals
+
+# Files in a records directory (along with one JSON file of records for each EPUB).
+MANIFEST_FILENAME = "manifest.json"
+EMBEDDINGS_FILENAME = "embeddings.npz"
+
+# Number of similarity rows to compute at once when updating USE edges.
+USE_BATCH_SIZE = 256
+
+# Node attributes that are computed from the whole graph rather than parsed from the EPUBs.
+DERIVED_ATTRIBUTES = graph_lib.CENTRALITY_MEASURES + graph_lib.COMPONENT_ATTRIBUTES + graph_lib.COMMUNITY_ATTRIBUTES
+
+
+def to_records(graph: graph_lib.ScriptureGraph) -> dict[str, Any]:
+    """Converts a ScriptureGraph to JSON-serializable records."""
+    return {
+        "verses": {key: dataclasses.asdict(verse) for key, verse in graph.verses.items()},
+        "topics": {key: dataclasses.asdict(topic) for key, topic in graph.topics.items()},
+        "references": [[reference.source, reference.target] for reference in graph.references],
+    }
+
+
+def from_records(records: dict[str, Any]) -> graph_lib.ScriptureGraph:
+    """Converts records written by `to_records` back to a ScriptureGraph."""
+    return graph_lib.ScriptureGraph(
+        verses={key: graph_lib.Verse(**value) for key, value in records["verses"].items()},
+        topics={key: graph_lib.Topic(**value) for key, value in records["topics"].items()},
+        references=[graph_lib.Reference(source, target) for source, target in records["references"]],
+    )
+
+
+@dataclasses.dataclass
+class BuildRecords:
+    """Parsed records from a full build.
+
+    Attributes:
+        options: Dict of build options (e.g. {"topics": True, "threshold": 0.77}).
+        digests: Dict mapping EPUB basenames to SHA-256 digests.
+        graphs: Dict mapping EPUB basenames to the ScriptureGraph parsed from each archive.
+        embedding_nodes: Array of verse keys for the rows of `embeddings`.
+        embeddings: USE embeddings for each verse, or None if suggested edges were not built.
+    """
+
+    options: dict[str, Any]
+    digests: dict[str, str] = dataclasses.field(default_factory=dict)
+    graphs: dict[str, graph_lib.ScriptureGraph] = dataclasses.field(default_factory=dict)
+    embedding_nodes: Optional[np.ndarray] = None
+    embeddings: Optional[np.ndarray] = None
+
+    def add(self, filename: str) -> graph_lib.ScriptureGraph:
+        """Parses an EPUB and stores its records."""
+        basename = os.path.basename(filename)
+        self.digests[basename] = pipeline_lib.get_file_digest(filename)
+        self.graphs[basename] = graph_lib.read_epub(filename)
+        return self.graphs[basename]
+
+    def update(self, filenames: list[str]) -> list[str]:
+        """Reparses new or modified EPUBs and drops records for missing EPUBs.
+
+        Args:
+            filenames: List of EPUB filenames.
+
+        Returns:
+            Sorted list of basenames whose records changed.
+        """
+        changed = sorted(set(self.digests) - {os.path.basename(filename) for filename in filenames})
+        for basename in changed:
+            logger.info(f"Dropping records for {basename}")
+            del self.digests[basename]
+            del self.graphs[basename]
+        for filename in filenames:
+            basename = os.path.basename(filename)
+            if self.digests.get(basename) != pipeline_lib.get_file_digest(filename):
+                logger.info(f"Reparsing {filename}")
+                self.add(filename)
+                changed.append(basename)
+        return sorted(changed)
+
+    def get_scripture_graph(self) -> graph_lib.ScriptureGraph:
+        """Combines the records from all EPUBs."""
+        combined = graph_lib.ScriptureGraph()
+        for basename in sorted(self.graphs):
+            combined.update(self.graphs[basename])
+        return combined
+
+    def get_embeddings(self, nodes: list[str]) -> np.ndarray:
+        """Returns the stored embeddings for a list of verses."""
+        index = {node: i for i, node in enumerate(self.embedding_nodes.tolist())}
+        return self.embeddings[[index[node] for node in nodes]]
+
+    def update_embeddings(self, graph: nx.DiGraph, changed: set[str]) -> np.ndarray:
+        """Updates the stored embeddings to match the verses in a graph.
+
+        Args:
+            graph: Updated graph.
+            changed: Verses whose text changed (or that were added).
+
+        Returns:
+            Embeddings with rows in the order of the verse nodes in `graph`.
+        """
+        verses = _get_verses(graph)
+        stored = {} if self.embeddings is None else {node: i for i, node in enumerate(self.embedding_nodes.tolist())}
+        missing = [node for node in verses if node in changed or node not in stored]
+        logger.info(f"Computing embeddings for {len(missing)} verses")
+        if missing:
+            computed = graph_lib.embed_texts(
+                [graph.nodes[node]["text"] for node in missing], graph_lib.USE_MODEL_URL, batch_size=1000
+            )
+        else:
+            computed = np.zeros((0, self.embeddings.shape[1]), dtype=self.embeddings.dtype)
+        index = {node: i for i, node in enumerate(missing)}
+        embeddings = np.stack(
+            [computed[index[node]] if node in index else self.embeddings[stored[node]] for node in verses]
+        )
+        self.embedding_nodes, self.embeddings = np.asarray(verses), embeddings
+        return embeddings
+
+    def save(self, dirname: str) -> None:
+        """Writes the records to a directory."""
+        os.makedirs(dirname, exist_ok=True)
+        for basename, graph in self.graphs.items():
+            with open(os.path.join(dirname, f"{basename}.json"), "w", encoding="utf-8") as f:
+                json.dump(to_records(graph), f)
+        if self.embeddings is not None:
+            np.savez(os.path.join(dirname, EMBEDDINGS_FILENAME), nodes=self.embedding_nodes, embeddings=self.embeddings)
+        # NOTE(kearnes): The manifest is written last, so it only lists records that were written successfully.
+        with open(os.path.join(dirname, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"options": self.options, "digests": self.digests}, f, indent=2)
+
+    @classmethod
+    def load(cls, dirname: str) -> "BuildRecords":
+        """Loads records written by `save`."""
+        with open(os.path.join(dirname, MANIFEST_FILENAME), encoding="utf-8") as f:
+            manifest = json.load(f)
+        records = cls(options=manifest["options"], digests=manifest["digests"])
+        for basename in records.digests:
+            with open(os.path.join(dirname, f"{basename}.json"), encoding="utf-8") as f:
+                records.graphs[basename] = from_records(json.load(f))
+        embeddings_filename = os.path.join(dirname, EMBEDDINGS_FILENAME)
+        if os.path.exists(embeddings_filename):
+            with np.load(embeddings_filename) as data:
+                records.embedding_nodes = data["nodes"]
+                records.embeddings = data["embeddings"]
+        return records
+
+
+@dataclasses.dataclass
+class GraphDiff:
+    """Differences between two canonical graphs (see `graph_lib.assemble_graph`).
+
+    Attributes:
+        added_nodes: Nodes that were added.
+        removed_nodes: Nodes that were removed.
+        changed_nodes: Nodes whose attributes (e.g. verse text) changed.
+        added_edges: Canonical edges that were added.
+        removed_edges: Canonical edges that were removed.
+    """
+
+    added_nodes: set[str] = dataclasses.field(default_factory=set)
+    removed_nodes: set[str] = dataclasses.field(default_factory=set)
+    changed_nodes: set[str] = dataclasses.field(default_factory=set)
+    added_edges: set[tuple[str, str]] = dataclasses.field(default_factory=set)
+    removed_edges: set[tuple[str, str]] = dataclasses.field(default_factory=set)
+
+    def __bool__(self) -> bool:
+        return any(dataclasses.astuple(self))
+
+    def __repr__(self) -> str:
+        counts = ", ".join(f"{field.name}={len(getattr(self, field.name))}" for field in dataclasses.fields(self))
+        return f"GraphDiff({counts})"
+
+
+def diff_graphs(old: nx.DiGraph, new: nx.DiGraph) -> GraphDiff:
+    """Compares two canonical graphs."""
+    diff = GraphDiff(added_nodes=set(new.nodes) - set(old.nodes), removed_nodes=set(old.nodes) - set(new.nodes))
+    for node in set(old.nodes) & set(new.nodes):
+        if old.nodes[node] != new.nodes[node]:
+            diff.changed_nodes.add(node)
+    diff.added_edges = set(new.edges) - set(old.edges)
+    diff.removed_edges = set(old.edges) - set(new.edges)
+    return diff
+
+
+def get_touched_verses(old: nx.DiGraph, new: nx.DiGraph, diff: GraphDiff) -> set[str]:
+    """Finds verses whose canonical verse neighborhoods changed.
+
+    Args:
+        old: Previous canonical graph.
+        new: Updated canonical graph.
+        diff: GraphDiff between `old` and `new`.
+
+    Returns:
+        Set of verses in `new`.
+    """
+
+    def _is_verse(node: str) -> bool:
+        return (new.nodes[node] if node in new else old.nodes[node])["kind"] == "verse"
+
+    touched = set(diff.added_nodes)
+    for edge in diff.added_edges | diff.removed_edges:
+        # NOTE(kearnes): Topic neighbors are ignored, since topic nodes are removed before computing suggestions.
+        if all(_is_verse(node) for node in edge):
+            touched.update(edge)
+    return {node for node in touched if node in new and _is_verse(node)}
+
+
+def apply_diff(graph: nx.DiGraph, canonical: nx.DiGraph, diff: GraphDiff) -> None:
+    """Applies a diff to a graph (in place).
+
+    Args:
+        graph: Previous graph, which may include suggested edges and derived node attributes.
+        canonical: Updated canonical graph (see `graph_lib.assemble_graph`).
+        diff: GraphDiff between the previous and updated canonical graphs.
+    """
+    graph.remove_nodes_from(diff.removed_nodes)
+    for node in diff.added_nodes:
+        graph.add_node(node, **canonical.nodes[node])
+    for node in diff.changed_nodes:
+        data = graph.nodes[node]
+        derived = {key: data[key] for key in DERIVED_ATTRIBUTES if key in data}
+        data.clear()
+        data.update(canonical.nodes[node], **derived)
+    for edge in diff.removed_edges:
+        if edge in graph.edges:
+            graph.remove_edge(*edge)
+    for edge in diff.added_edges:
+        # NOTE(kearnes): Replace any suggested edge between the same pair of verses.
+        if edge in graph.edges:
+            graph.remove_edge(*edge)
+        graph.add_edge(*edge)
+
+
+def _get_verses(graph: nx.DiGraph) -> list[str]:
+    """Returns the verse nodes in a graph, in node order."""
+    return [node for node, kind in graph.nodes(data="kind") if kind == "verse"]
+
+
+def _remove_suggested_edges(graph: nx.DiGraph, nodes: set[str], kind: str) -> set[str]:
+    """Removes suggested edges of a given kind that touch any of the given nodes; returns their endpoints."""
+    drop = []
+    for node in nodes:
+        for source, target, edge_kind in graph.out_edges(node, data="kind"):
+            if edge_kind == kind:
+                drop.extend([(source, target), (target, source)])
+    graph.remove_edges_from(drop)
+    return {node for edge in drop for node in edge}
+
+
+def _add_suggested_edges(graph: nx.DiGraph, pairs: list[tuple[str, str, float]], kind: str) -> set[str]:
+    """Adds bidirectional suggested edges; returns their endpoints."""
+    for a, b, similarity in pairs:
+        graph.add_edge(a, b, kind=kind, similarity=similarity)
+        graph.add_edge(b, a, kind=kind, similarity=similarity)
+    return {node for a, b, _ in pairs for node in (a, b)}
+
+
+def update_jaccard_edges(graph: nx.DiGraph, rows: set[str]) -> set[str]:
+    """Recomputes the Jaccard edges for a set of verses (see `graph_lib.add_jaccard_edges`).
+
+    Args:
+        graph: Graph to update (in place).
+        rows: Verses whose canonical neighborhoods changed.
+
+    Returns:
+        Set of verses whose Jaccard edges may have changed.
+    """
+    changed = _remove_suggested_edges(graph, rows, kind="jaccard")
+    if not rows:
+        return changed
+    nodes = _get_verses(graph)
+    index = {node: i for i, node in enumerate(nodes)}
+    edges = [(index[u], index[v]) for u, v, kind in graph.edges(data="kind") if not kind and u in index and v in index]
+    sources, targets = np.asarray(edges, dtype=np.int64).reshape(-1, 2).T
+    # Undirected canonical adjacency matrix (including any self-references).
+    adjacency = scipy.sparse.csr_matrix(
+        (
+            np.ones(2 * len(edges), dtype=np.int64),
+            (np.concatenate([sources, targets]), np.concatenate([targets, sources])),
+        ),
+        shape=(len(nodes), len(nodes)),
+    )
+    adjacency.data[:] = 1
+    degree = np.asarray(adjacency.sum(axis=1)).ravel()
+    row_ids = np.asarray(sorted(index[node] for node in rows))
+    intersection = (adjacency[row_ids] @ adjacency.T).tocoo()
+    i, j = row_ids[intersection.row], intersection.col
+    mask = (i != j) & (intersection.data > 1) & (np.asarray(adjacency[i, j]).ravel() == 0)
+    i, j, shared = i[mask], j[mask], intersection.data[mask]
+    similarity = shared / (degree[i] + degree[j] - shared)
+    pairs = [(nodes[a], nodes[b], float(value)) for a, b, value in zip(i.tolist(), j.tolist(), similarity.tolist())]
+    return changed | _add_suggested_edges(graph, pairs, kind="jaccard")
+
+
+def update_use_edges(graph: nx.DiGraph, rows: set[str], embeddings: np.ndarray, threshold: float) -> set[str]:
+    """Recomputes the USE edges for a set of verses (see `graph_lib.add_use_edges`).
+
+    Args:
+        graph: Graph to update (in place); Jaccard edges must already be up to date.
+        rows: Verses whose text or canonical neighborhoods changed.
+        embeddings: USE embeddings, with rows in the order of the verse nodes in `graph`.
+        threshold: Similarity threshold.
+
+    Returns:
+        Set of verses whose USE edges may have changed.
+    """
+    changed = _remove_suggested_edges(graph, rows, kind="use")
+    nodes = _get_verses(graph)
+    index = {node: i for i, node in enumerate(nodes)}
+    row_ids = np.asarray(sorted(index[node] for node in rows), dtype=np.int64)
+    pairs = []
+    for start in range(0, len(row_ids), USE_BATCH_SIZE):
+        batch = row_ids[start : start + USE_BATCH_SIZE]
+        similarity = graph_lib.angular_cosine(embeddings, rows=batch)
+        for i, j in zip(*np.nonzero(similarity >= threshold)):
+            a, b = nodes[batch[i]], nodes[j]
+            if (a, b) not in graph.edges and (b, a) not in graph.edges and similarity[i, j] > 0:
+                pairs.append((a, b, float(similarity[i, j])))
+    return changed | _add_suggested_edges(graph, pairs, kind="use")
+
+
+def add_derived_attributes(
+    graph: nx.DiGraph, options: dict[str, Any], previous: Optional[dict[str, dict[str, float]]] = None
+) -> None:
+    """Adds centrality scores, components, and communities according to the build options.
+
+    Args:
+        graph: Graph to update (in place).
+        options: Dict of build options (see `BuildRecords`).
+        previous: Optional centrality scores from a previous build, used to warm-start the power iterations.
+    """
+    if options["centrality"]:
+        graph_lib.add_centrality(graph, previous=previous)
+    if options["components"]:
+        graph_lib.add_components(graph)
+    if options["communities"]:
+        graph_lib.add_communities(graph, seed=options["seed"])
+
+
+def compare_graphs(expected: nx.DiGraph, actual: nx.DiGraph, tolerance: float = 1e-6) -> list[str]:
+    """Compares an incrementally updated graph to a clean build.
+
+    Centrality scores are compared up to `tolerance`, and components are compared as partitions (labels depend
+    on node order). Community labels are not compared, since label propagation depends on node order.
+
+    Args:
+        expected: Graph from a clean build.
+        actual: Incrementally updated graph.
+        tolerance: Absolute tolerance for similarities and centrality scores.
+
+    Returns:
+        List of human-readable differences.
+    """
+    differences = [f"missing node: {node}" for node in sorted(set(expected.nodes) - set(actual.nodes))]
+    differences.extend(f"extra node: {node}" for node in sorted(set(actual.nodes) - set(expected.nodes)))
+    common = sorted(set(expected.nodes) & set(actual.nodes))
+    for node in common:
+        expected_data, actual_data = expected.nodes[node], actual.nodes[node]
+        for key in sorted(set(expected_data) | set(actual_data)):
+            if key in graph_lib.CENTRALITY_MEASURES and key in expected_data and key in actual_data:
+                if abs(expected_data[key] - actual_data[key]) <= tolerance:
+                    continue
+            elif key in graph_lib.COMPONENT_ATTRIBUTES or key in graph_lib.COMMUNITY_ATTRIBUTES:
+                continue
+            elif expected_data.get(key) == actual_data.get(key):
+                continue
+            differences.append(f"node {node}: {key}={actual_data.get(key)!r} (expected {expected_data.get(key)!r})")
+    for name in ("weak_component", "strong_component"):
+        if _get_partition(expected, name, common) != _get_partition(actual, name, common):
+            differences.append(f"{name} partitions differ")
+    expected_edges = {(u, v): (kind, similarity) for u, v, kind, similarity in _iter_edges(expected)}
+    actual_edges = {(u, v): (kind, similarity) for u, v, kind, similarity in _iter_edges(actual)}
+    for edge in sorted(expected_edges.keys() | actual_edges.keys()):
+        if edge not in actual_edges:
+            differences.append(f"missing edge: {edge} {expected_edges[edge]}")
+        elif edge not in expected_edges:
+            differences.append(f"extra edge: {edge} {actual_edges[edge]}")
+        else:
+            (expected_kind, expected_similarity), (actual_kind, actual_similarity) = (
+                expected_edges[edge],
+                actual_edges[edge],
+            )
+            if expected_kind != actual_kind or abs(expected_similarity - actual_similarity) > tolerance:
+                differences.append(f"edge {edge}: {actual_edges[edge]} (expected {expected_edges[edge]})")
+    return differences
+
+
+def _iter_edges(graph: nx.DiGraph):
+    """Yields (source, target, kind, similarity) tuples."""
+    for source, target, data in graph.edges(data=True):
+        yield source, target, data.get("kind"), data.get("similarity", 0.0)
+
+
+def _get_partition(graph: nx.DiGraph, name: str, nodes: list[str]) -> set[frozenset[str]]:
+    """Groups nodes by a label attribute."""
+    groups = {}
+    for node in nodes:
+        label = graph.nodes[node].get(name)
+        if label is not None:
+            groups.setdefault(label, set()).add(node)
+    return {frozenset(group) for group in groups.values()}
@@ -0,0 +1,101 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.incremental_lib."""
+import hashlib
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from scripture_graph import graph_lib
+from scripture_graph import incremental_lib
+
+THRESHOLD = 0.6
+
+
+def _embed(texts: list[str]) -> np.ndarray:
+    """Deterministic stand-in for (unit length) USE embeddings."""
+    seeds = [int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:8], 16) for text in texts]
+    embeddings = np.stack([np.random.default_rng(seed).normal(size=8) for seed in seeds])
+    return (embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _build(scripture_graph: graph_lib.ScriptureGraph) -> nx.DiGraph:
+    """Runs a clean build with suggested edges."""
+    graph = graph_lib.assemble_graph(scripture_graph, include_topics=True)
+    graph_lib.add_jaccard_edges(graph)
+    verses = [data["text"] for _, data in graph.nodes(data=True) if data["kind"] == "verse"]
+    graph_lib.add_use_edges(graph, THRESHOLD, embeddings=_embed(verses))
+    return graph
+
+
+def _scripture_graph(verses: list[int], references: list[tuple[int, int]], texts: dict[int, str]):
+    """Builds a ScriptureGraph with verses in Alma 32 and a single topic."""
+    verses = {
+        f"Alma 32:{i}": graph_lib.Verse(book="Alma", chapter=32, verse=i, text=texts.get(i, f"verse {i}"))
+        for i in verses
+    }
+    graph = graph_lib.ScriptureGraph(verses=verses, topics={"TG Faith": graph_lib.Topic(source="TG", title="Faith")})
+    graph.references = [graph_lib.Reference(f"Alma 32:{a}", f"Alma 32:{b}") for a, b in references]
+    graph.references.append(graph_lib.Reference("TG Faith", "Alma 32:1"))
+    return graph
+
+
+@pytest.fixture(name="old")
+def old_fixture():
+    """Records for the previous build."""
+    references = [(1, 2), (1, 3), (2, 3), (4, 2), (4, 3), (5, 6), (6, 7), (7, 5), (8, 1), (8, 2), (3, 3)]
+    return _scripture_graph(list(range(1, 9)), references, texts={})
+
+
+@pytest.fixture(name="new")
+def new_fixture():
+    """Records after a revision."""
+    # Drops Alma 32:8, adds Alma 32:9, rewires a few references, and revises the text of Alma 32:5.
+    references = [(1, 2), (1, 3), (2, 3), (4, 2), (5, 6), (6, 7), (7, 5), (5, 2), (9, 1), (9, 3), (3, 3)]
+    return _scripture_graph([1, 2, 3, 4, 5, 6, 7, 9], references, texts={5: "revised"})
+
+
+def test_records(old, tmp_path):
+    records = incremental_lib.BuildRecords(options={"topics": True}, digests={"a.epub": "0"}, graphs={"a.epub": old})
+    records.embedding_nodes = np.asarray(list(old.verses))
+    records.embeddings = _embed([verse.text for verse in old.verses.values()])
+    records.save(tmp_path.as_posix())
+    loaded = incremental_lib.BuildRecords.load(tmp_path.as_posix())
+    assert loaded.options == {"topics": True}
+    assert loaded.graphs["a.epub"] == old
+    np.testing.assert_array_equal(loaded.get_embeddings(["Alma 32:2", "Alma 32:1"]), records.embeddings[[1, 0]])
+
+
+def test_update(old, new):
+    old_canonical = graph_lib.assemble_graph(old, include_topics=True)
+    new_canonical = graph_lib.assemble_graph(new, include_topics=True)
+    diff = incremental_lib.diff_graphs(old_canonical, new_canonical)
+    assert diff.added_nodes == {"Alma 32:9"}
+    assert diff.removed_nodes == {"Alma 32:8"}
+    assert diff.changed_nodes == {"Alma 32:5"}
+    assert diff.added_edges == {("Alma 32:5", "Alma 32:2"), ("Alma 32:9", "Alma 32:1"), ("Alma 32:9", "Alma 32:3")}
+    touched = incremental_lib.get_touched_verses(old_canonical, new_canonical, diff)
+    assert touched == {"Alma 32:1", "Alma 32:2", "Alma 32:3", "Alma 32:4", "Alma 32:5", "Alma 32:9"}
+    graph = _build(old)
+    incremental_lib.apply_diff(graph, new_canonical, diff)
+    incremental_lib.update_jaccard_edges(graph, touched)
+    verses = [node for node, kind in graph.nodes(data="kind") if kind == "verse"]
+    embeddings = _embed([graph.nodes[node]["text"] for node in verses])
+    incremental_lib.update_use_edges(graph, touched | diff.changed_nodes, embeddings, THRESHOLD)
+    expected = _build(new)
+    assert {kind for _, _, kind in expected.edges(data="kind")} == {None, "jaccard", "use"}
+    assert not incremental_lib.compare_graphs(expected, graph)
+    # Sanity check: the previous graph does not match.
+    assert incremental_lib.compare_graphs(expected, _build(old))
@@ -0,0 +1,144 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Precomputed node positions for Connection Explorer neighborhoods.
+
+Each verse's neighborhood (the verse and its ranked neighbors; see
+build_connections.get_connections) is drawn as a star, so the layout is
+radial: the verse sits at the origin and its neighbors fill the slots of a
+Vogel (sunflower) spiral in rank order, so higher-ranked neighbors are closer
+to the center. Within each ring of the spiral, neighbors are placed clockwise
+from the top in Standard Works order, which keeps verses from the same book
+together. Positions cover the full ranked list, so every page of a large
+neighborhood shares the same frame.
+
+Layouts for every verse are computed in one vectorized pass and stored as
+int16 pixel offsets in a flat array, with one slice per verse.
+"""
+import dataclasses
+import functools
+from typing import Optional
+
+import numpy as np
+
+from scripture_graph import explorer_lib
+from scripture_graph.explorer_lib import Connections
+
+# Angle between consecutive spiral slots, in radians.
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
+# Approximate size of a node label, in pixels. The spiral is stretched to this aspect ratio so that labels in
+# adjacent slots do not overlap.
+NODE_WIDTH = 90
+NODE_HEIGHT = 36
+
+
+def get_spiral_positions(counts: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    """Computes radial layouts for a batch of neighborhoods.
+
+    Args:
+        counts: Array containing the number of nodes (including the center) in each neighborhood.
+        keys: Array of sort keys for the nodes of every neighborhood, concatenated in order; within each
+            neighborhood, the center comes first and the other nodes are in rank order. Nodes in the same ring
+            are placed clockwise in order of increasing key.
+
+    Returns:
+        Array with shape [counts.sum(), 2] containing the (x, y) position of each node, in pixels (y increases
+        downward).
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    if len(keys) != counts.sum():
+        raise ValueError(f"expected {counts.sum()} keys; got {len(keys)}")
+    starts = np.cumsum(counts) - counts
+    layout_ids = np.repeat(np.arange(len(counts)), counts)
+    slots = np.arange(len(keys)) - starts[layout_ids]
+    rings = np.floor(np.sqrt(slots)).astype(np.int64)
+    angles = np.mod(slots * GOLDEN_ANGLE, 2 * np.pi)
+    # Within each (neighborhood, ring) group, the i-th node by key takes the i-th slot by angle.
+    slot_order = np.lexsort((angles, rings, layout_ids))
+    node_order = np.lexsort((keys, rings, layout_ids))
+    assigned = np.empty_like(slots)
+    assigned[node_order] = slot_order
+    radius = np.sqrt(slots[assigned])
+    angle = angles[assigned]
+    return np.stack([radius * np.sin(angle) * NODE_WIDTH, -radius * np.cos(angle) * NODE_HEIGHT], axis=1)
+
+
+@dataclasses.dataclass
+class Layouts:
+    """Node positions for the neighborhood of every verse.
+
+    Attributes:
+        verses: Array of verse keys.
+        offsets: Array of offsets into `positions`; the layout for verses[i] is positions[offsets[i]:offsets[i + 1]],
+            with the verse first and its neighbors in the order of its "ranked" connections.
+        positions: Array with shape [N, 2] containing (x, y) positions, in pixels.
+    """
+
+    verses: np.ndarray
+    offsets: np.ndarray
+    positions: np.ndarray
+
+    @classmethod
+    def from_connections(cls, connections: Connections) -> "Layouts":
+        """Computes layouts for every verse in a set of connections."""
+        verses = list(connections)
+        order = {verse: i for i, verse in enumerate(explorer_lib.sort_verses(connections, verses))}
+        keys, counts = [], []
+        for verse in verses:
+            ranked = connections[verse].get("ranked", [])
+            keys.append(order[verse])
+            keys.extend(order[node] for node, _ in ranked)
+            counts.append(len(ranked) + 1)
+        positions = np.rint(get_spiral_positions(np.asarray(counts), np.asarray(keys)))
+        dtype = np.int16 if np.abs(positions).max(initial=0) <= np.iinfo(np.int16).max else np.int32
+        return cls(
+            verses=np.asarray(verses),
+            offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            positions=positions.astype(dtype),
+        )
+
+    def save(self, filename: str) -> None:
+        """Writes the layouts to an (uncompressed, for fast loading) NPZ file."""
+        np.savez(filename, verses=self.verses, offsets=self.offsets, positions=self.positions)
+
+    @classmethod
+    def load(cls, filename: str) -> "Layouts":
+        """Loads layouts written by `save`."""
+        with np.load(filename) as data:
+            return cls(verses=data["verses"], offsets=data["offsets"], positions=data["positions"])
+
+    @functools.cached_property
+    def index(self) -> dict[str, int]:
+        """Dict mapping verse keys to layout IDs."""
+        return {verse: i for i, verse in enumerate(self.verses.tolist())}
+
+    def get_positions(self, connections: Connections, verse: str) -> Optional[dict[str, tuple[int, int]]]:
+        """Returns the positions of the nodes in the neighborhood of a verse.
+
+        Args:
+            connections: Connections that the layouts were computed from.
+            verse: Verse key.
+
+        Returns:
+            Dict mapping node keys to (x, y) positions, or None if there is no layout for the verse or it does not
+            match the connections (e.g. after an incremental update that did not rewrite the layouts).
+        """
+        layout_id = self.index.get(verse)
+        if layout_id is None:
+            return None
+        start, end = self.offsets[layout_id], self.offsets[layout_id + 1]
+        nodes = [verse] + [node for node, _ in connections[verse].get("ranked", [])]
+        if len(nodes) != end - start:
+            return None
+        return dict(zip(nodes, map(tuple, self.positions[start:end].tolist())))
@@ -0,0 +1,81 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.layout_lib."""
+import numpy as np
+import pytest
+
+from scripture_graph import explorer_lib
+from scripture_graph import layout_lib
+
+
+@pytest.fixture(name="connections")
+def connections_fixture():
+    """Small set of connections with ranked neighbors."""
+
+    def _node(book, chapter, verse, **kwargs):
+        return {"volume": "Book of Mormon", "book": book, "chapter": chapter, "verse": verse, **kwargs}
+
+    return {
+        "1 Ne. 3:7": _node(
+            "1 Ne.",
+            3,
+            7,
+            incoming=["Alma 32:21", "Mosiah 2:17"],
+            outgoing=["Alma 32:21"],
+            ranked=[["Alma 32:21", "both"], ["Mosiah 2:17", "incoming"], ["Ether 12:6", "suggested"]],
+        ),
+        "Alma 32:21": _node("Alma", 32, 21, ranked=[["1 Ne. 3:7", "both"]]),
+        "Mosiah 2:17": _node("Mosiah", 2, 17, ranked=[["1 Ne. 3:7", "outgoing"]]),
+        "Ether 12:6": _node("Ether", 12, 6),
+    }
+
+
+def test_get_spiral_positions():
+    rng = np.random.default_rng(0)
+    counts = np.asarray([1, 50, 200])
+    positions = layout_lib.get_spiral_positions(counts, rng.permutation(counts.sum()))
+    assert positions.shape == (251, 2)
+    np.testing.assert_array_equal(positions[[0, 1, 51]], 0)  # Centers.
+    # Higher-ranked neighbors are in inner rings.
+    radius = np.hypot(positions[51:, 0] / layout_lib.NODE_WIDTH, positions[51:, 1] / layout_lib.NODE_HEIGHT)
+    assert np.all(np.diff(np.floor(radius + 1e-6)) >= 0)
+    # Labels do not overlap.
+    delta = np.abs(positions[51:, None] - positions[None, 51:])
+    overlap = (delta[..., 0] < layout_lib.NODE_WIDTH * 0.75) & (delta[..., 1] < layout_lib.NODE_HEIGHT * 0.6)
+    assert overlap.sum() == 200  # Only the diagonal.
+    with pytest.raises(ValueError, match="expected 251 keys"):
+        layout_lib.get_spiral_positions(counts, np.arange(10))
+
+
+def test_layouts(connections, tmp_path):
+    layouts = layout_lib.Layouts.from_connections(connections)
+    assert layouts.positions.dtype == np.int16
+    filename = str(tmp_path / "layouts.npz")
+    layouts.save(filename)
+    layouts = layout_lib.Layouts.load(filename)
+    positions = layouts.get_positions(connections, "1 Ne. 3:7")
+    assert list(positions) == ["1 Ne. 3:7", "Alma 32:21", "Mosiah 2:17", "Ether 12:6"]
+    assert positions["1 Ne. 3:7"] == (0, 0)
+    assert len(set(positions.values())) == 4
+    assert layouts.get_positions(connections, "Ether 12:6") == {"Ether 12:6": (0, 0)}
+    assert layouts.get_positions(connections, "Moroni 10:4") is None
+    # Stale layouts are ignored.
+    connections["Alma 32:21"]["ranked"].append(["Ether 12:6", "suggested"])
+    assert layouts.get_positions(connections, "Alma 32:21") is None
+    elements = explorer_lib.get_elements(
+        connections, "1 Ne. 3:7", explorer_lib.FilterMode.ALL, include_suggested=False, positions=positions
+    )
+    assert [node["position"] for node in elements["nodes"]] == [
+        {"x": x, "y": y} for x, y in list(positions.values())[:3]
+    ]
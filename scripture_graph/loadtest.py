@@ -0,0 +1,131 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load tests the Connection Explorer app (see loadtest_lib).
+
+Usage:
+    loadtest.py [options]
+
+Options:
+    --url=<str>                 Base URL of a running server (e.g. http://127.0.0.1:8080); by default, the app runs
+                                in-process with the Flask test client.
+    --app=<str>                 App directory for in-process runs [default: app].
+    --asgi                      For in-process runs, serve requests with the ASGI app (app/asgi.py) from an event
+                                loop instead of the Flask test client from threads.
+    --scale=<float>             For in-process runs, serve synthetic data at this scale (see benchmark_lib) instead
+                                of the data in --app.
+    --requests=<int>            Number of measured requests [default: 10000].
+    --warmup=<int>              Number of requests sent before the measured run (e.g. to fill caches) [default: 0].
+    --concurrency=<int>         Number of concurrent requests [default: 8].
+    --mix=<str>                 Comma-separated route fractions [default: elements=0.7,table=0.25,tree=0.05].
+    --zipf=<float>              Zipf exponent for verse popularity; 0 is uniform [default: 1.1].
+    --seed=<int>                Random seed [default: 0].
+    --accept_encoding=<str>     Accept-Encoding request header [default: gzip].
+    --server_pid=<int>          For --url runs, the server process ID (for memory reporting).
+    --output=<str>              Output JSON filename for the report.
+
+Memory is reported for this process in in-process runs (which includes the
+app) and for --server_pid in HTTP runs. In-process throughput is limited by the
+GIL, so use a server (e.g. gunicorn with the settings in app.yaml, or uvicorn
+for app/asgi.py) to size deployments.
+"""
+import functools
+import json
+import logging
+import tempfile
+from typing import Callable
+import urllib.request
+
+import docopt
+
+from scripture_graph import benchmark_lib
+from scripture_graph import loadtest_lib
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    """Parses route fractions (e.g. "elements=0.7,table=0.3")."""
+    mix = {}
+    for item in text.split(","):
+        route, value = item.split("=")
+        mix[route] = float(value)
+    return mix
+
+
+Runner = Callable[[list[loadtest_lib.Request]], tuple[list[loadtest_lib.Sample], float]]
+
+
+def get_runner(tmpdir: str, **kwargs) -> tuple[Runner, list[str]]:
+    """Sets up the app (or a connection to a server) and fetches the verses from the navigation tree.
+
+    Returns:
+        Function that sends a list of requests (see loadtest_lib.run), and the list of verses.
+    """
+    headers = {"Accept-Encoding": kwargs["--accept_encoding"]}
+    concurrency = int(kwargs["--concurrency"])
+    if kwargs["--url"]:
+        with urllib.request.urlopen(kwargs["--url"].rstrip("/") + "/tree") as response:
+            tree = json.load(response)
+        send = loadtest_lib.get_http_sender(kwargs["--url"], headers)
+        return functools.partial(loadtest_lib.run, send, concurrency=concurrency), loadtest_lib.get_tree_verses(tree)
+    if kwargs["--scale"]:
+        context = benchmark_lib.BenchmarkContext(
+            tmpdir,
+            scale=float(kwargs["--scale"]),
+            seed=int(kwargs["--seed"]),
+            max_verses=5000,
+            app_dir=kwargs["--app"],
+        )
+        module = context.app
+    else:
+        module = benchmark_lib.load_app(kwargs["--app"], kwargs["--app"])
+    tree = module.app.test_client().get("/tree").get_json()
+    if kwargs["--asgi"]:
+        asgi_app = benchmark_lib.load_asgi_app(kwargs["--app"]).app
+        runner = functools.partial(loadtest_lib.run_asgi, asgi_app, concurrency=concurrency, headers=headers)
+    else:
+        send = loadtest_lib.get_client_sender(module.app, headers)
+        runner = functools.partial(loadtest_lib.run, send, concurrency=concurrency)
+    return runner, loadtest_lib.get_tree_verses(tree)
+
+
+def main(**kwargs) -> None:
+    mix = parse_mix(kwargs["--mix"])
+    seed, zipf = int(kwargs["--seed"]), float(kwargs["--zipf"])
+    concurrency = int(kwargs["--concurrency"])
+    pid = int(kwargs["--server_pid"]) if kwargs["--url"] and kwargs["--server_pid"] else None
+    with tempfile.TemporaryDirectory() as tmpdir:
+        runner, verses = get_runner(tmpdir, **kwargs)
+        logger.info(f"Loaded {len(verses)} verses")
+        if int(kwargs["--warmup"]):
+            runner(loadtest_lib.make_requests(verses, int(kwargs["--warmup"]), mix=mix, zipf=zipf, seed=seed + 1))
+        start = loadtest_lib.start_memory_usage(pid)
+        requests = loadtest_lib.make_requests(verses, int(kwargs["--requests"]), mix=mix, zipf=zipf, seed=seed)
+        summary = loadtest_lib.summarize(*runner(requests))
+        summary["memory"] = loadtest_lib.get_memory_usage(start, pid)
+    summary["settings"] = {
+        "mix": mix,
+        "zipf": zipf,
+        "concurrency": concurrency,
+        "mode": "http" if kwargs["--url"] else "in-process-asgi" if kwargs["--asgi"] else "in-process",
+    }
+    print(loadtest_lib.format_summary(summary))
+    if kwargs["--output"]:
+        with open(kwargs["--output"], "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(**docopt.docopt(__doc__))
@@ -0,0 +1,349 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Load testing for the Connection Explorer app.
+
+Requests are drawn from a mix of routes (/elements, /table, and /tree). Verses
+follow a Zipf distribution over a random popularity ranking, since a few
+verses (e.g. 1 Ne. 3:7) get most of the traffic; /elements requests are spread
+evenly over every filter mode and suggested-edge setting. Since the app caches
+rendered responses, the skew matters: popular verses are mostly cache hits.
+
+Requests are sent by a pool of worker threads, either to the Flask test client
+(in-process, no network) or over HTTP to a running server. The ASGI app
+(app/asgi.py) can also be driven in-process from an event loop (see
+`run_asgi`), with one task per concurrent request instead of one thread.
+"""
+import asyncio
+import collections
+import concurrent.futures
+import dataclasses
+import json
+import threading
+import time
+from typing import Any, Callable, Optional
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+from scripture_graph import profile_lib
+from scripture_graph.explorer_lib import FilterMode
+
+# Default fraction of requests for each route.
+DEFAULT_MIX = {"elements": 0.7, "table": 0.25, "tree": 0.05}
+
+# Default Zipf exponent for verse popularity.
+DEFAULT_ZIPF = 1.1
+
+# Latency percentiles in reports.
+PERCENTILES = (50, 95, 99)
+
+
+@dataclasses.dataclass(frozen=True)
+class Request:
+    """A request in the load mix.
+
+    Attributes:
+        route: Route name (a key in DEFAULT_MIX).
+        path: Path and query string.
+        variant: Label for the request variant (e.g. "all,suggested" for /elements).
+    """
+
+    route: str
+    path: str
+    variant: str = ""
+
+
+@dataclasses.dataclass(frozen=True)
+class Sample:
+    """The outcome of a single request.
+
+    Attributes:
+        request: Request.
+        status: HTTP status code (0 for connection errors).
+        seconds: Latency.
+        size: Response body size, in bytes (as sent, i.e. after compression).
+    """
+
+    request: Request
+    status: int
+    seconds: float
+    size: int
+
+
+def get_tree_verses(tree: list[dict[str, Any]]) -> list[str]:
+    """Extracts the verses (leaves) from the navigation tree."""
+    verses = []
+    stack = list(reversed(tree))
+    while stack:
+        node = stack.pop()
+        if node.get("folder"):
+            stack.extend(reversed(node["children"]))
+        else:
+            verses.append(node["key"])
+    return verses
+
+
+def _get_request(route: str, verse: str, filter_mode: str, include_suggested: bool) -> Request:
+    """Builds a request for a route."""
+    if route == "elements":
+        query = {"verse": verse, "filter_mode": filter_mode, "include_suggested": str(include_suggested).lower()}
+        variant = f"{filter_mode},{'suggested' if include_suggested else 'canonical'}"
+        return Request(route, f"/elements?{urllib.parse.urlencode(query)}", variant)
+    if route == "table":
+        return Request(route, f"/table?{urllib.parse.urlencode({'verse': verse})}")
+    return Request(route, "/tree")
+
+
+def make_requests(
+    verses: list[str],
+    num_requests: int,
+    mix: Optional[dict[str, float]] = None,
+    zipf: float = DEFAULT_ZIPF,
+    seed: int = 0,
+) -> list[Request]:
+    """Generates a request mix.
+
+    Args:
+        verses: Verses to request.
+        num_requests: Number of requests.
+        mix: Dict mapping routes to the fraction of requests; defaults to DEFAULT_MIX.
+        zipf: Zipf exponent for verse popularity; 0 makes every verse equally popular.
+        seed: Random seed.
+
+    Returns:
+        List of Requests.
+    """
+    if mix is None:
+        mix = DEFAULT_MIX
+    for route in mix:
+        if route not in DEFAULT_MIX:
+            raise ValueError(f"unsupported route: {route}")
+    rng = np.random.default_rng(seed)
+    weights = 1.0 / np.arange(1, len(verses) + 1) ** zipf
+    # Popularity ranks are assigned to verses at random.
+    verse_ids = rng.permutation(len(verses))[rng.choice(len(verses), size=num_requests, p=weights / weights.sum())]
+    routes = list(mix)
+    route_weights = np.asarray([mix[route] for route in routes], dtype=float)
+    route_ids = rng.choice(len(routes), size=num_requests, p=route_weights / route_weights.sum())
+    filter_modes = rng.choice([mode.name.lower() for mode in FilterMode], size=num_requests)
+    include_suggested = rng.random(num_requests) < 0.5
+    return [
+        _get_request(routes[route_ids[i]], verses[verse_ids[i]], str(filter_modes[i]), bool(include_suggested[i]))
+        for i in range(num_requests)
+    ]
+
+
+def get_client_sender(app: Any, headers: dict[str, str]) -> Callable[[Request], Sample]:
+    """Returns a function that sends requests through the Flask test client (one client per thread).
+
+    NOTE(kearnes): Flask is only a dependency of the app, so `app` is not annotated as flask.Flask.
+    """
+    local = threading.local()
+
+    def _send(request: Request) -> Sample:
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+        start = time.perf_counter()
+        response = local.client.get(request.path, headers=headers)
+        size = len(response.get_data())
+        return Sample(request, response.status_code, time.perf_counter() - start, size)
+
+    return _send
+
+
+def get_http_sender(base_url: str, headers: dict[str, str], timeout: float = 30.0) -> Callable[[Request], Sample]:
+    """Returns a function that sends requests to a server over HTTP."""
+
+    def _send(request: Request) -> Sample:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(
+                urllib.request.Request(base_url.rstrip("/") + request.path, headers=headers), timeout=timeout
+            ) as response:
+                size = len(response.read())
+                status = response.status
+        except urllib.error.HTTPError as error:
+            size = len(error.read())
+            status = error.code
+        except OSError:
+            size, status = 0, 0
+        return Sample(request, status, time.perf_counter() - start, size)
+
+    return _send
+
+
+def run(send: Callable[[Request], Sample], requests: list[Request], concurrency: int) -> tuple[list[Sample], float]:
+    """Sends requests from a pool of worker threads.
+
+    Args:
+        send: Function that sends a request (see `get_client_sender` and `get_http_sender`).
+        requests: Requests to send, in order.
+        concurrency: Number of concurrent requests.
+
+    Returns:
+        List of Samples (in request order) and the elapsed time, in seconds.
+    """
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(send, requests))
+    return samples, time.perf_counter() - start
+
+
+async def _send_asgi(app: Callable, request: Request, headers: dict[str, str]) -> Sample:
+    """Sends a GET request directly to an ASGI application."""
+    path, _, query = request.path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": urllib.parse.unquote(path),
+        "raw_path": path.encode("latin-1"),
+        "query_string": query.encode("latin-1"),
+        "root_path": "",
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()],
+        "client": None,
+        "server": None,
+    }
+    messages = []
+
+    async def _receive() -> dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def _send(message: dict[str, Any]) -> None:
+        messages.append(message)
+
+    start = time.perf_counter()
+    await app(scope, _receive, _send)
+    seconds = time.perf_counter() - start
+    size = sum(len(message.get("body", b"")) for message in messages[1:])
+    return Sample(request, messages[0]["status"], seconds, size)
+
+
+def run_asgi(
+    app: Callable, requests: list[Request], concurrency: int, headers: dict[str, str]
+) -> tuple[list[Sample], float]:
+    """Sends requests to an ASGI application from an event loop; see `run`.
+
+    Args:
+        app: ASGI application.
+        requests: Requests to send, in order.
+        concurrency: Maximum number of requests in flight.
+        headers: Request headers.
+
+    Returns:
+        List of Samples (in request order) and the elapsed time, in seconds.
+    """
+
+    async def _run() -> list[Sample]:
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _bounded(request: Request) -> Sample:
+            async with semaphore:
+                return await _send_asgi(app, request, headers)
+
+        return await asyncio.gather(*(_bounded(request) for request in requests))
+
+    start = time.perf_counter()
+    samples = asyncio.run(_run())
+    return list(samples), time.perf_counter() - start
+
+
+def summarize_latency(samples: list[Sample]) -> dict[str, Any]:
+    """Summarizes latencies (in milliseconds), response sizes, and errors for a set of samples."""
+    latencies = np.asarray([sample.seconds for sample in samples]) * 1000
+    summary = {
+        "count": len(samples),
+        "errors": sum(1 for sample in samples if not 200 <= sample.status < 400),
+        "mean_ms": float(latencies.mean()),
+    }
+    for percentile, value in zip(PERCENTILES, np.percentile(latencies, PERCENTILES)):
+        summary[f"p{percentile}_ms"] = float(value)
+    summary["max_ms"] = float(latencies.max())
+    summary["mean_bytes"] = float(np.mean([sample.size for sample in samples]))
+    return summary
+
+
+def summarize(samples: list[Sample], seconds: float) -> dict[str, Any]:
+    """Summarizes a load test.
+
+    Args:
+        samples: Samples from `run`.
+        seconds: Elapsed time.
+
+    Returns:
+        Dict with overall throughput and latency, plus breakdowns by route and by /elements variant.
+    """
+    by_route = collections.defaultdict(list)
+    by_variant = collections.defaultdict(list)
+    for sample in samples:
+        by_route[sample.request.route].append(sample)
+        if sample.request.variant:
+            by_variant[sample.request.variant].append(sample)
+    return {
+        "seconds": seconds,
+        "throughput": len(samples) / seconds,
+        "overall": summarize_latency(samples),
+        "routes": {route: summarize_latency(values) for route, values in sorted(by_route.items())},
+        "variants": {variant: summarize_latency(values) for variant, values in sorted(by_variant.items())},
+    }
+
+
+def start_memory_usage(pid: Optional[int] = None) -> Optional[int]:
+    """Starts tracking the memory usage of a process (default: this one).
+
+    Returns:
+        The current RSS, to pass to `get_memory_usage`.
+    """
+    if pid is None:
+        profile_lib.reset_peak_rss()
+    return profile_lib.get_rss(pid)
+
+
+def get_memory_usage(start: Optional[int], pid: Optional[int] = None) -> dict[str, Optional[float]]:
+    """Reports the start, end, and (for this process) peak RSS, in MiB.
+
+    Args:
+        start: RSS from `start_memory_usage`.
+        pid: Process ID; defaults to this process.
+
+    Returns:
+        Dict of memory usage; values are None if unavailable.
+    """
+    end = profile_lib.get_rss(pid)
+    data = {"start_mib": None, "end_mib": None, "growth_mib": None}
+    if start is not None and end is not None:
+        data = {"start_mib": start / (1 << 20), "end_mib": end / (1 << 20), "growth_mib": (end - start) / (1 << 20)}
+    if pid is None:
+        data["peak_mib"] = profile_lib.get_peak_rss() / (1 << 20)
+    return data
+
+
+def format_summary(summary: dict[str, Any]) -> str:
+    """Formats a summary as a table."""
+    lines = [f"{summary['throughput']:.1f} requests/s over {summary['seconds']:.1f}s"]
+    header = f"{'':30}{'count':>8}{'errors':>8}" + "".join(f"{f'p{p} (ms)':>11}" for p in PERCENTILES)
+    lines.append(header)
+    rows = [("overall", summary["overall"])] + list(summary["routes"].items())
+    rows += [(f"elements[{variant}]", values) for variant, values in summary["variants"].items()]
+    for name, values in rows:
+        row = f"{name:30}{values['count']:>8}{values['errors']:>8}"
+        row += "".join(f"{values[f'p{p}_ms']:>11.2f}" for p in PERCENTILES)
+        lines.append(row)
+    if "memory" in summary:
+        lines.append(f"memory: {json.dumps(summary['memory'])}")
+    return "\n".join(lines)
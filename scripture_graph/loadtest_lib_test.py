@@ -0,0 +1,82 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.loadtest_lib."""
+import collections
+
+import pytest
+
+from scripture_graph import loadtest_lib
+
+
+def test_get_tree_verses():
+    tree = [
+        {
+            "title": "Book of Mormon",
+            "folder": True,
+            "children": [
+                {"title": "Alma 32", "folder": True, "children": [{"key": "Alma 32:1"}, {"key": "Alma 32:2"}]},
+                {"title": "Alma 33", "folder": True, "children": [{"key": "Alma 33:1"}]},
+            ],
+        },
+        {"title": "Doctrine and Covenants", "folder": True, "children": [{"key": "D&C 1:1"}]},
+    ]
+    assert loadtest_lib.get_tree_verses(tree) == ["Alma 32:1", "Alma 32:2", "Alma 33:1", "D&C 1:1"]
+
+
+def test_make_requests():
+    verses = [f"Alma 32:{i}" for i in range(1, 101)]
+    requests = loadtest_lib.make_requests(verses, 5000, zipf=1.1, seed=0)
+    routes = collections.Counter(request.route for request in requests)
+    assert routes["elements"] > routes["table"] > routes["tree"] > 0
+    # Every filter mode and suggested-edge setting is exercised.
+    assert len({request.variant for request in requests if request.route == "elements"}) == 6
+    # Popular verses dominate.
+    counts = collections.Counter(request.path for request in requests if request.route == "table")
+    assert counts.most_common(1)[0][1] > 10 * len(requests) * 0.25 / len(verses)
+    assert "D%26C" in loadtest_lib.make_requests(["D&C 1:1"], 1, mix={"table": 1.0})[0].path
+    assert loadtest_lib.make_requests(verses, 100, seed=1) == loadtest_lib.make_requests(verses, 100, seed=1)
+    with pytest.raises(ValueError, match="unsupported route"):
+        loadtest_lib.make_requests(verses, 10, mix={"search": 1.0})
+
+
+def test_run():
+    def _send(request):
+        status = 404 if request.route == "tree" else 200
+        return loadtest_lib.Sample(request, status, seconds=0.001, size=10)
+
+    requests = loadtest_lib.make_requests([f"Alma 32:{i}" for i in range(1, 11)], 200, seed=0)
+    samples, seconds = loadtest_lib.run(_send, requests, concurrency=4)
+    assert [sample.request for sample in samples] == requests
+    summary = loadtest_lib.summarize(samples, seconds)
+    assert summary["overall"]["count"] == 200
+    assert summary["routes"]["tree"]["errors"] == summary["routes"]["tree"]["count"]
+    assert summary["routes"]["elements"]["errors"] == 0
+    assert summary["overall"]["p50_ms"] == pytest.approx(1.0)
+    assert "elements[all,suggested]" in loadtest_lib.format_summary(summary)
+
+
+def test_run_asgi():
+    async def _app(scope, receive, send):
+        await receive()
+        status = 404 if scope["path"] == "/tree" else 200
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b"12345", "more_body": True})
+        await send({"type": "http.response.body", "body": scope["query_string"][:5]})
+
+    requests = loadtest_lib.make_requests([f"Alma 32:{i}" for i in range(1, 11)], 100, seed=0)
+    samples, _ = loadtest_lib.run_asgi(_app, requests, concurrency=8, headers={"Accept-Encoding": "gzip"})
+    assert [sample.request for sample in samples] == requests
+    for sample in samples:
+        assert sample.status == (404 if sample.request.route == "tree" else 200)
+        assert sample.size == (5 if sample.request.route == "tree" else 10)
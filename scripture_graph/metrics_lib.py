@@ -0,0 +1,207 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Counters, gauges, and histograms are keyed by a tuple of label values (in the
+order of the metric's label names). Updates take a per-metric lock and a
+bisect over the histogram buckets, so recording a request costs a few
+microseconds.
+
+See https://prometheus.io/docs/instrumenting/exposition_formats/.
+"""
+import bisect
+import math
+import threading
+from typing import Iterator, Optional
+
+# Histogram buckets (upper bounds) for request latencies, in seconds. Cached responses take well under a
+# millisecond, so the low end is finer than the Prometheus defaults.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Histogram buckets for response sizes, in bytes.
+SIZE_BUCKETS = tuple(float(256 * 4**i) for i in range(9))  # 256 B to 16 MiB.
+
+# Content type for the text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    """Escapes a label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: Optional[tuple[str, str]] = None) -> str:
+    """Formats a label set (e.g. '{route="/elements",le="0.5"}')."""
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Formats a sample value."""
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """Base class for metrics."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        """Initializes the metric.
+
+        Args:
+            name: Metric name.
+            documentation: Help text.
+            label_names: Label names; updates take label values in the same order.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._lock = threading.Lock()
+
+    def _check_labels(self, labels: tuple[str, ...]) -> None:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}; got {labels}")
+
+    def samples(self) -> Iterator[str]:
+        """Yields sample lines."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        """Renders the metric in the text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines) + "\n"
+
+
+class _ScalarMetric(Metric):
+    """Metric with a single value per label set."""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, documentation, label_names)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def get(self, *labels: str) -> float:
+        """Returns the current value for a label set."""
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            self._check_labels(labels)
+            yield f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}"
+
+
+class Counter(_ScalarMetric):
+    """Monotonically increasing counter."""
+
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        """Increments the counter for a label set."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+
+class Gauge(_ScalarMetric):
+    """Value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, *labels: str) -> None:
+        """Sets the value for a label set."""
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Distribution of observations in fixed buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        """Initializes the histogram.
+
+        Args:
+            name: Metric name.
+            documentation: Help text.
+            label_names: Label names.
+            buckets: Sorted bucket upper bounds; an implicit +Inf bucket is added.
+        """
+        super().__init__(name, documentation, label_names)
+        if list(buckets) != sorted(buckets):
+            raise ValueError("buckets must be sorted")
+        self.buckets = tuple(buckets)
+        # Per label set: [non-cumulative bucket counts (including +Inf), sum].
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        """Records an observation for a label set."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def get_count(self, *labels: str) -> int:
+        """Returns the number of observations for a label set."""
+        state = self._values.get(labels)
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((labels, (list(state[0]), state[1])) for labels, state in self._values.items())
+        for labels, (counts, total) in values:
+            self._check_labels(labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                label_text = _format_labels(self.label_names, labels, ("le", _format_value(bound)))
+                yield f"{self.name}_bucket{label_text} {cumulative}"
+            label_text = _format_labels(self.label_names, labels)
+            yield f"{self.name}_sum{label_text} {_format_value(total)}"
+            yield f"{self.name}_count{label_text} {cumulative}"
+
+
+class Registry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        """Registers a metric and returns it."""
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f"duplicate metric: {metric.name}")
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Renders every metric in the text exposition format."""
+        return "".join(metric.render() for metric in self._metrics)
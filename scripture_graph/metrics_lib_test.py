@@ -0,0 +1,63 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.metrics_lib."""
+import pytest
+
+from scripture_graph import metrics_lib
+
+
+def test_counter_and_gauge():
+    registry = metrics_lib.Registry()
+    counter = registry.add(metrics_lib.Counter("requests_total", "Requests.", ("route", "status")))
+    gauge = registry.add(metrics_lib.Gauge("startup_seconds", "Startup time.", ("data",)))
+    counter.inc("/elements", "200")
+    counter.inc("/elements", "200")
+    counter.inc('/a"b', "404", amount=3)
+    gauge.set(1.5, "connections")
+    assert counter.get("/elements", "200") == 2
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a\\"b",status="404"} 3',
+        'requests_total{route="/elements",status="200"} 2',
+        "# HELP startup_seconds Startup time.",
+        "# TYPE startup_seconds gauge",
+        'startup_seconds{data="connections"} 1.5',
+    ]
+    with pytest.raises(ValueError, match="duplicate metric"):
+        registry.add(metrics_lib.Gauge("startup_seconds", "Again."))
+
+
+def test_histogram():
+    histogram = metrics_lib.Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value, "/table")
+    assert histogram.get_count("/table") == 4
+    assert histogram.get_count("/tree") == 0
+    assert histogram.render().splitlines()[2:] == [
+        'latency_seconds_bucket{route="/table",le="0.1"} 2',
+        'latency_seconds_bucket{route="/table",le="1"} 3',
+        'latency_seconds_bucket{route="/table",le="+Inf"} 4',
+        'latency_seconds_sum{route="/table"} 2.65',
+        'latency_seconds_count{route="/table"} 4',
+    ]
+    with pytest.raises(ValueError, match="sorted"):
+        metrics_lib.Histogram("bad", "Bad.", buckets=(1.0, 0.1))
+
+
+def test_wrong_labels():
+    counter = metrics_lib.Counter("requests_total", "Requests.", ("route",))
+    counter.inc("/elements", "200")
+    with pytest.raises(ValueError, match="expects labels"):
+        counter.render()
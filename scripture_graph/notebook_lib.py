@@ -12,9 +12,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 """Utility functions for working in Jupyter/Colab notebooks."""
+import json
+
+import networkx as nx
 import pandas as pd
 import scipy.stats
 
+from scripture_graph import graph_lib
+
 
 def assign_ranks(scores: dict[str, float]) -> pd.DataFrame:
     """Assigns ranks to per-object scores."""
@@ -24,3 +29,34 @@ def assign_ranks(scores: dict[str, float]) -> pd.DataFrame:
     df = pd.DataFrame(rows)
     df["rank"] = scipy.stats.rankdata(-1 * df.score.values, method="min")
     return df.sort_values(["rank", "key"], ignore_index=True)
+
+
+def get_centrality_ranks(graph: nx.Graph, name: str) -> pd.DataFrame:
+    """Assigns ranks using centrality scores precomputed by graph_lib.add_centrality.
+
+    Args:
+        graph: Graph built with `build_graph.py --centrality`.
+        name: Centrality measure; see graph_lib.CENTRALITY_MEASURES.
+
+    Returns:
+        DataFrame with key, score, and rank columns.
+    """
+    scores = nx.get_node_attributes(graph, name)
+    if not scores:
+        raise KeyError(f"graph does not have precomputed {name} scores")
+    return assign_ranks(scores)
+
+
+def load_rollup(filename: str, level: str) -> pd.DataFrame:
+    """Loads a rollup graph written by `build_graph.py --rollups` as a DataFrame.
+
+    Args:
+        filename: Rollups JSON filename.
+        level: Rollup level; see graph_lib.ROLLUP_LEVELS.
+
+    Returns:
+        DataFrame with source and target columns and a count column for each of graph_lib.EDGE_KINDS.
+    """
+    with open(filename, encoding="utf-8") as f:
+        rollup = json.load(f)[level]
+    return pd.DataFrame(rollup["edges"], columns=["source", "target", *graph_lib.EDGE_KINDS])
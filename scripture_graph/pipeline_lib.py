@@ -0,0 +1,307 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Build pipeline stages with a content-addressed on-disk cache.
+
+Each stage is identified by a key that hashes the stage name, the code version
+(see `get_code_version`), the stage parameters, and the keys of its inputs
+(upstream stage keys or content digests). Since downstream keys include
+upstream keys, changing a parameter only invalidates the stages that depend on
+it; for example, changing the similarity threshold for suggested edges reuses
+the cached parse, graph, Jaccard, and embedding stages.
+
+Stage values are pickled in the cache directory:
+
+    <cache_dir>/<key[:2]>/<key>.pkl
+
+Stages that write output files record the key and the digests of every file
+they write (including extra outputs such as compressed copies) under
+`<cache_dir>/outputs`, so an output is rewritten only when its key changes or
+any of its files on disk was modified or removed.
+
+Every stage is also measured by the active profile_lib.Profiler, if any.
+"""
+import dataclasses
+import functools
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+from typing import Any, Callable, Optional, TypeVar
+
+from scripture_graph import profile_lib
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Default cache size limit, in bytes.
+DEFAULT_CACHE_SIZE = 8 << 30
+
+
+def get_digest(data: bytes) -> str:
+    """Computes the SHA-256 digest of a byte string."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_file_digest(filename: str) -> str:
+    """Computes the SHA-256 digest of a file."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_file_digests(filenames: list[str]) -> dict[str, str]:
+    """Computes the SHA-256 digests of several files, keyed by filename."""
+    return {filename: get_file_digest(filename) for filename in filenames}
+
+
+@functools.lru_cache(maxsize=1)
+def get_code_version() -> str:
+    """Computes a digest of the package source (excluding tests).
+
+    NOTE(kearnes): This is deliberately conservative: any change to the package invalidates every cached stage.
+    """
+    digest = hashlib.sha256()
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    for basename in sorted(os.listdir(dirname)):
+        if basename.endswith(".py") and not basename.endswith("_test.py"):
+            digest.update(basename.encode("utf-8"))
+            with open(os.path.join(dirname, basename), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def get_key(name: str, inputs: list[str], params: Optional[dict[str, Any]] = None) -> str:
+    """Computes the cache key for a stage.
+
+    Args:
+        name: Stage name.
+        inputs: List of input keys (upstream stage keys or content digests).
+        params: Optional dict of JSON-serializable stage parameters.
+
+    Returns:
+        Hex digest.
+    """
+    spec = {"name": name, "code": get_code_version(), "inputs": inputs, "params": params or {}}
+    return get_digest(json.dumps(spec, sort_keys=True).encode("utf-8"))
+
+
+@dataclasses.dataclass(frozen=True)
+class Result:
+    """The output of a stage.
+
+    Attributes:
+        key: Stage key; use this as an input key for downstream stages.
+        value: Stage value.
+    """
+
+    key: str
+    value: Any
+
+
+class StageCache:
+    """On-disk cache of pickled stage values with a size limit.
+
+    When the cache grows beyond `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, dirname: str, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+
+    def _get_filename(self, key: str) -> str:
+        return os.path.join(self.dirname, key[:2], f"{key}.pkl")
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        """Fetches a cached value.
+
+        Returns:
+            Tuple of (hit, value); value is None on a miss.
+        """
+        filename = self._get_filename(key)
+        try:
+            with open(filename, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return False, None
+        except (EOFError, pickle.UnpicklingError) as error:
+            logger.warning(f"Ignoring corrupt cache entry {filename}: {error}")
+            return False, None
+        os.utime(filename)  # Mark as recently used.
+        return True, value
+
+    def put(self, key: str, value: Any) -> None:
+        """Stores a value and evicts old entries if necessary."""
+        filename = self._get_filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(filename), delete=False) as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, filename)
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Evicts least recently used entries until the cache fits within the size limit.
+
+        Args:
+            keep: Optional key that is never evicted (e.g. the entry that was just written).
+        """
+        entries = []
+        for dirpath, _, filenames in os.walk(self.dirname):
+            for basename in filenames:
+                if basename.endswith(".pkl"):
+                    stat = os.stat(os.path.join(dirpath, basename))
+                    entries.append((stat.st_mtime, stat.st_size, os.path.join(dirpath, basename)))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if keep and os.path.basename(filename) == f"{keep}.pkl":
+                continue
+            logger.info(f"Evicting {filename} ({size} bytes)")
+            os.remove(filename)
+            total -= size
+
+
+class Pipeline:
+    """Runs build stages, reusing cached values where possible.
+
+    Without a cache, every stage is computed (and outputs are always written).
+    """
+
+    def __init__(self, cache: Optional[StageCache] = None, force: bool = False):
+        """Initializes the pipeline.
+
+        Args:
+            cache: Optional StageCache.
+            force: If True, ignore cached values and existing outputs (the cache is still updated).
+        """
+        self.cache = cache
+        self.force = force
+
+    def run(
+        self,
+        name: str,
+        function: Callable[..., T],
+        *args,
+        inputs: list[str],
+        params: Optional[dict[str, Any]] = None,
+        label: Optional[str] = None,
+        **kwargs,
+    ) -> Result:
+        """Runs a stage.
+
+        Args:
+            name: Stage name.
+            function: Function that computes the stage value from `args` and `kwargs`.
+            *args: Positional arguments for `function`.
+            inputs: List of input keys; these must identify everything that `args` and `kwargs` are derived from.
+            params: Optional dict of JSON-serializable stage parameters.
+            label: Optional description for logs and profiles (e.g. the input filename).
+            **kwargs: Keyword arguments for `function`.
+
+        Returns:
+            Result.
+        """
+        key = get_key(name, inputs, params)
+        description = f"{name} ({label})" if label else name
+        with profile_lib.stage(name, label=label) as stage:
+            if self.cache is not None and not self.force:
+                hit, value = self.cache.get(key)
+                if hit:
+                    stage.cached = True
+                    logger.info(f"Stage {description}: cached ({key[:12]})")
+                    return Result(key=key, value=value)
+            start = time.perf_counter()
+            value = function(*args, **kwargs)
+            logger.info(f"Stage {description}: computed in {time.perf_counter() - start:.1f}s ({key[:12]})")
+            if self.cache is not None:
+                self.cache.put(key, value)
+        return Result(key=key, value=value)
+
+    def write(
+        self,
+        name: str,
+        filename: str,
+        function: Callable[..., None],
+        *args,
+        inputs: list[str],
+        params: Optional[dict[str, Any]] = None,
+        extra_outputs: Optional[list[str]] = None,
+        **kwargs,
+    ) -> str:
+        """Runs a stage that writes an output file, skipping it if the output is up to date.
+
+        Args:
+            name: Stage name.
+            filename: Output filename; passed to `function` after `args`.
+            function: Function that writes the output.
+            *args: Positional arguments for `function`.
+            inputs: List of input keys.
+            params: Optional dict of JSON-serializable stage parameters.
+            extra_outputs: Optional list of other files written by `function` (e.g. compressed copies); the stage
+                is only skipped if these are also up to date.
+            **kwargs: Keyword arguments for `function`.
+
+        Returns:
+            Stage key.
+        """
+        key = get_key(name, inputs, params)
+        filenames = [filename] + (extra_outputs or [])
+        stamp = None
+        with profile_lib.stage(name, label=filename) as stage:
+            if self.cache is not None:
+                stamp = os.path.join(
+                    self.cache.dirname, "outputs", f"{get_digest(os.path.abspath(filename).encode())}.json"
+                )
+                if not self.force and _is_up_to_date(stamp, key, filenames):
+                    stage.cached = True
+                    logger.info(f"Stage {name}: {filename} is up to date ({key[:12]})")
+                    return key
+            start = time.perf_counter()
+            function(*args, filename, **kwargs)
+            logger.info(f"Stage {name}: wrote {filename} in {time.perf_counter() - start:.1f}s ({key[:12]})")
+        if stamp is not None:
+            os.makedirs(os.path.dirname(stamp), exist_ok=True)
+            with open(stamp, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "digests": get_file_digests(filenames), "filename": filename}, f)
+        return key
+
+
+def _is_up_to_date(stamp: str, key: str, filenames: list[str]) -> bool:
+    """Checks whether the output files recorded in a stamp exist and match the stage key and digests."""
+    if not os.path.exists(stamp) or not all(os.path.exists(filename) for filename in filenames):
+        return False
+    with open(stamp, encoding="utf-8") as f:
+        recorded = json.load(f)
+    return recorded["key"] == key and recorded.get("digests") == get_file_digests(filenames)
+
+
+def get_pipeline(cache_dir: Optional[str], cache_size: float, force: bool = False) -> Pipeline:
+    """Creates a pipeline from command-line options.
+
+    Args:
+        cache_dir: Optional cache directory; if None, stages are not cached.
+        cache_size: Maximum cache size, in GiB.
+        force: Whether to ignore cached values and existing outputs.
+
+    Returns:
+        Pipeline.
+    """
+    cache = StageCache(cache_dir, max_bytes=int(cache_size * (1 << 30))) if cache_dir else None
+    return Pipeline(cache, force=force)
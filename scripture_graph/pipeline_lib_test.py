@@ -0,0 +1,114 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.pipeline_lib."""
+import collections
+import os
+
+import pytest
+
+from scripture_graph import pipeline_lib
+
+
+@pytest.fixture(name="calls")
+def calls_fixture():
+    """Counts calls to each stage function."""
+    return collections.Counter()
+
+
+def test_run(tmp_path, calls):
+    def _square(value):
+        calls["square"] += 1
+        return value**2
+
+    def _add(value, offset):
+        calls["add"] += 1
+        return value + offset
+
+    def _build(pipeline, value, offset):
+        square = pipeline.run("square", _square, value, inputs=[str(value)])
+        return pipeline.run("add", _add, square.value, offset, inputs=[square.key], params={"offset": offset})
+
+    cache = pipeline_lib.StageCache(tmp_path.as_posix())
+    assert _build(pipeline_lib.Pipeline(cache), 3, 1).value == 10
+    assert _build(pipeline_lib.Pipeline(cache), 3, 1).value == 10
+    assert calls == {"square": 1, "add": 1}
+    # Changing a parameter only reruns the downstream stage.
+    assert _build(pipeline_lib.Pipeline(cache), 3, 2).value == 11
+    assert calls == {"square": 1, "add": 2}
+    # Changing an input reruns everything downstream of it.
+    assert _build(pipeline_lib.Pipeline(cache), 4, 2).value == 18
+    assert calls == {"square": 2, "add": 3}
+    _build(pipeline_lib.Pipeline(cache, force=True), 3, 1)
+    assert calls == {"square": 3, "add": 4}
+    # Without a cache, every stage runs.
+    _build(pipeline_lib.Pipeline(), 3, 1)
+    assert calls == {"square": 4, "add": 5}
+
+
+def test_write(tmp_path, calls):
+    def _write(value, filename):
+        calls["write"] += 1
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(value)
+
+    pipeline = pipeline_lib.Pipeline(pipeline_lib.StageCache((tmp_path / "cache").as_posix()))
+    filename = (tmp_path / "output.txt").as_posix()
+    pipeline.write("output", filename, _write, "a", inputs=["a"])
+    pipeline.write("output", filename, _write, "a", inputs=["a"])
+    assert calls["write"] == 1
+    pipeline.write("output", filename, _write, "b", inputs=["b"])
+    assert calls["write"] == 2
+    # Modified outputs are rewritten.
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write("modified")
+    pipeline.write("output", filename, _write, "b", inputs=["b"])
+    assert calls["write"] == 3
+    with open(filename, encoding="utf-8") as f:
+        assert f.read() == "b"
+
+
+def test_write_extra_outputs(tmp_path, calls):
+    def _write(value, filename):
+        calls["write"] += 1
+        for suffix in ["", ".gz"]:
+            with open(f"{filename}{suffix}", "w", encoding="utf-8") as f:
+                f.write(value)
+
+    pipeline = pipeline_lib.Pipeline(pipeline_lib.StageCache((tmp_path / "cache").as_posix()))
+    filename = (tmp_path / "output.txt").as_posix()
+    extra_outputs = [f"{filename}.gz"]
+    pipeline.write("output", filename, _write, "a", inputs=["a"], extra_outputs=extra_outputs)
+    pipeline.write("output", filename, _write, "a", inputs=["a"], extra_outputs=extra_outputs)
+    assert calls["write"] == 1
+    # Missing or modified extra outputs are rewritten.
+    os.remove(extra_outputs[0])
+    pipeline.write("output", filename, _write, "a", inputs=["a"], extra_outputs=extra_outputs)
+    assert calls["write"] == 2
+    with open(extra_outputs[0], "w", encoding="utf-8") as f:
+        f.write("modified")
+    pipeline.write("output", filename, _write, "a", inputs=["a"], extra_outputs=extra_outputs)
+    assert calls["write"] == 3
+    with open(extra_outputs[0], encoding="utf-8") as f:
+        assert f.read() == "a"
+
+
+def test_evict(tmp_path):
+    cache = pipeline_lib.StageCache(tmp_path.as_posix(), max_bytes=2500)
+    for i, key in enumerate(["aa", "bb", "cc"]):
+        cache.put(key, b"x" * 1000)
+        os.utime(os.path.join(tmp_path, key[:2], f"{key}.pkl"), (i, i))
+    cache.evict()
+    assert not cache.get("aa")[0]
+    assert cache.get("bb") == (True, b"x" * 1000)
+    assert cache.get("cc")[0]
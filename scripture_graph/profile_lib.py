@@ -0,0 +1,248 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Per-stage build profiles.
+
+Library code marks stages with `stage` and timing samples with `record`; both
+are no-ops unless a Profiler is active (see `activate`), so the hooks can stay
+in hot paths. Stages nest, and each one records wall time, CPU time (for all
+threads in the process), and peak RSS.
+
+On Linux, the peak RSS counter (VmHWM) is reset at the start of each stage, so
+the reported peak covers only that stage (and its children). Elsewhere, the
+reported peak is the process peak so far.
+"""
+import contextlib
+import cProfile
+import dataclasses
+import json
+import resource
+import sys
+import time
+from typing import Any, Iterator, Optional
+
+import numpy as np
+
+# Percentiles reported for timing samples.
+PERCENTILES = (50, 90, 99)
+
+# Active profilers; the last one receives stages and samples.
+_ACTIVE: list["Profiler"] = []
+
+
+def _read_status(field: str, pid: Optional[int] = None) -> Optional[int]:
+    """Reads a memory field from /proc/<pid>/status, in bytes (None if unavailable)."""
+    try:
+        with open(f"/proc/{pid or 'self'}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def get_rss(pid: Optional[int] = None) -> Optional[int]:
+    """Returns the current resident set size of a process (default: this one), in bytes (None if unavailable)."""
+    return _read_status("VmRSS", pid=pid)
+
+
+def get_peak_rss() -> int:
+    """Returns the peak resident set size, in bytes."""
+    peak = _read_status("VmHWM")
+    if peak is None:
+        # NOTE(kearnes): ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != "darwin":
+            peak *= 1024
+    return peak
+
+
+def reset_peak_rss() -> None:
+    """Resets the peak RSS counter to the current RSS, if supported (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+@dataclasses.dataclass
+class Stage:  # pylint: disable=too-many-instance-attributes
+    """Measurements for one stage.
+
+    Attributes:
+        name: Stage name.
+        label: Optional description (e.g. the input filename).
+        cached: Whether the stage value was loaded from the cache (or the output was up to date).
+        wall: Wall time, in seconds.
+        cpu: CPU time, in seconds.
+        peak_rss: Peak RSS during the stage, in bytes.
+        rss_start: RSS at the start of the stage, in bytes.
+        rss_end: RSS at the end of the stage, in bytes.
+        children: Nested stages.
+    """
+
+    name: str
+    label: Optional[str] = None
+    cached: bool = False
+    wall: float = 0.0
+    cpu: float = 0.0
+    peak_rss: int = 0
+    rss_start: Optional[int] = None
+    rss_end: Optional[int] = None
+    children: list["Stage"] = dataclasses.field(default_factory=list)
+
+    def to_json(self) -> dict[str, Any]:
+        """Returns a JSON-serializable dict (memory in MiB)."""
+        data = {
+            "name": self.name,
+            "wall": round(self.wall, 6),
+            "cpu": round(self.cpu, 6),
+            "peak_rss_mib": round(self.peak_rss / (1 << 20), 1),
+        }
+        if self.label is not None:
+            data["label"] = self.label
+        if self.cached:
+            data["cached"] = True
+        if self.rss_start is not None and self.rss_end is not None:
+            data["rss_delta_mib"] = round((self.rss_end - self.rss_start) / (1 << 20), 1)
+        if self.children:
+            data["children"] = [child.to_json() for child in self.children]
+        return data
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+    """Summarizes timing samples with percentiles."""
+    array = np.asarray(values)
+    summary = {"count": len(values), "total": float(array.sum()), "mean": float(array.mean())}
+    for percentile, value in zip(PERCENTILES, np.percentile(array, PERCENTILES)):
+        summary[f"p{percentile}"] = float(value)
+    summary["max"] = float(array.max())
+    return summary
+
+
+class Profiler:
+    """Collects stage measurements and timing samples."""
+
+    def __init__(self, use_cprofile: bool = False):
+        """Initializes the profiler.
+
+        Args:
+            use_cprofile: If True, run cProfile during each top-level stage and keep the profile for the
+                slowest one (see `dump_hottest`). Stage timings then include the cProfile overhead.
+        """
+        self.use_cprofile = use_cprofile
+        self.stages: list[Stage] = []
+        self.samples: dict[str, list[float]] = {}
+        self._stack: list[tuple[Stage, list[int]]] = []
+        self._hottest: Optional[tuple[Stage, cProfile.Profile]] = None
+        self._start = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str, label: Optional[str] = None) -> Iterator[Stage]:
+        """Measures a stage; yields the Stage so callers can annotate it (e.g. set `cached`)."""
+        entry = Stage(name=name, label=label)
+        if self._stack:
+            parent, parent_peak = self._stack[-1]
+            parent.children.append(entry)
+            # Save the parent's peak so far, since the counter is about to be reset.
+            parent_peak[0] = max(parent_peak[0], get_peak_rss())
+        else:
+            self.stages.append(entry)
+        reset_peak_rss()
+        peak = [0]
+        profile = cProfile.Profile() if self.use_cprofile and not self._stack else None
+        self._stack.append((entry, peak))
+        entry.rss_start = get_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield entry
+        finally:
+            if profile is not None:
+                profile.disable()
+            entry.wall = time.perf_counter() - wall
+            entry.cpu = time.process_time() - cpu
+            entry.rss_end = get_rss()
+            entry.peak_rss = max(peak[0], get_peak_rss())
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][1][0] = max(self._stack[-1][1][0], entry.peak_rss)
+            if profile is not None and (self._hottest is None or entry.wall > self._hottest[0].wall):
+                self._hottest = (entry, profile)
+
+    def record(self, name: str, value: float) -> None:
+        """Adds a timing sample (in seconds)."""
+        self.samples.setdefault(name, []).append(value)
+
+    def to_json(self) -> dict[str, Any]:
+        """Returns the report as a JSON-serializable dict."""
+        data = {
+            "wall": round(time.perf_counter() - self._start, 6),
+            "peak_rss_mib": round(max([stage.peak_rss for stage in self.stages] + [0]) / (1 << 20), 1),
+            "stages": [stage.to_json() for stage in self.stages],
+            "samples": {name: summarize(values) for name, values in self.samples.items()},
+        }
+        computed = [stage for stage in self.stages if not stage.cached]
+        if computed:
+            hottest = max(computed, key=lambda stage: stage.wall)
+            data["hottest"] = {"name": hottest.name, "label": hottest.label, "wall": round(hottest.wall, 6)}
+        return data
+
+    def save(self, filename: str) -> None:
+        """Writes the report as JSON."""
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, indent=2)
+
+    def dump_hottest(self, filename: str) -> Optional[str]:
+        """Writes the cProfile stats for the slowest top-level stage (see pstats).
+
+        Returns:
+            The name of the profiled stage, or None if no stages were profiled.
+        """
+        if self._hottest is None:
+            return None
+        entry, profile = self._hottest
+        profile.dump_stats(filename)
+        return entry.name
+
+
+@contextlib.contextmanager
+def activate(profiler: Optional[Profiler]) -> Iterator[Optional[Profiler]]:
+    """Makes a profiler active within the context; a no-op if `profiler` is None."""
+    if profiler is None:
+        yield None
+        return
+    _ACTIVE.append(profiler)
+    try:
+        yield profiler
+    finally:
+        _ACTIVE.remove(profiler)
+
+
+@contextlib.contextmanager
+def stage(name: str, label: Optional[str] = None) -> Iterator[Stage]:
+    """Measures a stage with the active profiler, if any (see `Profiler.stage`)."""
+    if not _ACTIVE:
+        yield Stage(name=name, label=label)
+        return
+    with _ACTIVE[-1].stage(name, label=label) as entry:
+        yield entry
+
+
+def record(name: str, value: float) -> None:
+    """Adds a timing sample to the active profiler, if any."""
+    if _ACTIVE:
+        _ACTIVE[-1].record(name, value)
@@ -0,0 +1,72 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.profile_lib."""
+import json
+import pstats
+
+import numpy as np
+
+from scripture_graph import pipeline_lib
+from scripture_graph import profile_lib
+
+
+def test_inactive():
+    with profile_lib.stage("noop") as stage:
+        profile_lib.record("noop", 1.0)
+    assert stage.name == "noop"
+
+
+def test_profiler(tmp_path):
+    profiler = profile_lib.Profiler(use_cprofile=True)
+    with profile_lib.activate(profiler):
+        with profile_lib.stage("outer", label="a.epub"):
+            with profile_lib.stage("inner"):
+                array = np.ones((1 << 20, 8))  # 64 MiB.
+            del array
+            for value in [1.0, 2.0, 3.0, 4.0]:
+                profile_lib.record("sample", value)
+        with profile_lib.stage("other"):
+            pass
+    profile_lib.record("sample", 5.0)  # Not recorded; the profiler is no longer active.
+    filename = (tmp_path / "profile.json").as_posix()
+    profiler.save(filename)
+    with open(filename, encoding="utf-8") as f:
+        report = json.load(f)
+    assert [stage["name"] for stage in report["stages"]] == ["outer", "other"]
+    outer = report["stages"][0]
+    assert outer["label"] == "a.epub"
+    assert [child["name"] for child in outer["children"]] == ["inner"]
+    assert outer["children"][0]["peak_rss_mib"] >= 64
+    assert outer["peak_rss_mib"] >= outer["children"][0]["peak_rss_mib"]
+    assert outer["wall"] >= outer["children"][0]["wall"]
+    assert report["samples"]["sample"]["count"] == 4
+    assert report["samples"]["sample"]["p50"] == 2.5
+    assert report["samples"]["sample"]["max"] == 4.0
+    assert report["hottest"]["name"] == "outer"
+    stats_filename = (tmp_path / "hottest.prof").as_posix()
+    assert profiler.dump_hottest(stats_filename) == "outer"
+    assert pstats.Stats(stats_filename).total_calls > 0
+
+
+def test_pipeline_stages(tmp_path):
+    profiler = profile_lib.Profiler()
+    pipeline = pipeline_lib.Pipeline(pipeline_lib.StageCache(tmp_path.as_posix()))
+    with profile_lib.activate(profiler):
+        pipeline.run("square", lambda value: value**2, 3, inputs=["3"], label="three")
+        pipeline.run("square", lambda value: value**2, 3, inputs=["3"], label="three")
+    stages = profiler.to_json()["stages"]
+    assert [(stage["name"], stage["label"], stage.get("cached", False)) for stage in stages] == [
+        ("square", "three", False),
+        ("square", "three", True),
+    ]
@@ -0,0 +1,424 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Full-text verse search with a compact inverted index.
+
+Queries are made of whitespace-separated clauses, where each clause is a word
+or a quoted phrase. Clauses must all match (AND) unless they are separated by
+OR; a clause preceded by NOT (or prefixed with "-") must not match. For example:
+
+    faith "hope in christ" -works
+    "strait and narrow" OR "straight and narrow"
+
+Matching verses are ranked by BM25.
+
+This module also provides reference autocompletion (see ReferenceIndex), which
+matches partial references like "1 ne 3" or "D&C 13" to verse keys.
+"""
+import bisect
+import collections
+import dataclasses
+import functools
+import itertools
+import re
+from typing import Iterable, Iterator
+
+import numpy as np
+
+import scripture_graph
+
+# pylint: disable=too-many-locals
+
+# Tokens are runs of letters and digits, optionally joined by apostrophes (e.g. "lord's").
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+
+# Query clauses: an optional "-", then a quoted phrase or a bare word.
+CLAUSE_PATTERN = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+# BM25 parameters.
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Common book abbreviations, in addition to the short names and full names in BOOKS_SHORT.
+BOOK_ALIASES = {
+    "Gen.": ["gn"],
+    "Ex.": ["exod"],
+    "Deut.": ["dt"],
+    "Ps.": ["psalm", "psa"],
+    "Song.": ["song of songs", "sos"],
+    "Matt.": ["mt"],
+    "Mark": ["mk"],
+    "Luke": ["lk"],
+    "John": ["jn"],
+    "Philem.": ["phlm"],
+    "Rev.": ["revelations"],
+    "W of M": ["wom"],
+    "D&C": ["dc", "d and c", "doctrine & covenants"],
+    "JS—M": ["jsm"],
+    "JS—H": ["jsh"],
+    "A of F": ["aof"],
+}
+
+
+def normalize_reference(text: str) -> str:
+    """Normalizes a (partial) reference for matching.
+
+    Case, periods, and dashes are ignored, and a leading book number is separated
+    from the book name (e.g. "1Ne." -> "1 ne").
+    """
+    text = re.sub(r"[—–-]", " ", text.lower().replace(".", ""))
+    text = re.sub(r"^(\d)(?=[a-z])", r"\1 ", text.strip())
+    return re.sub(r"\s+", " ", text)
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lowercase tokens."""
+    return TOKEN_PATTERN.findall(text.replace("’", "'").lower())
+
+
+@dataclasses.dataclass(frozen=True)
+class Clause:
+    """A single query clause.
+
+    Attributes:
+        tokens: Tokens in the clause; clauses with more than one token are phrases.
+        negated: Whether matching documents are excluded.
+    """
+
+    tokens: tuple[str, ...]
+    negated: bool = False
+
+
+def parse_query(query: str) -> list[list[Clause]]:
+    """Parses a query into a disjunction of conjunctions.
+
+    Args:
+        query: Query string.
+
+    Returns:
+        List of groups (joined by OR), where each group is a list of clauses (joined by AND).
+
+    Raises:
+        ValueError: If the query (or one of its OR groups) has no positive clauses.
+    """
+    groups = [[]]
+    negate_next = False
+    for match in CLAUSE_PATTERN.finditer(query):
+        minus, phrase, word = match.groups()
+        if word == "OR":
+            groups.append([])
+            continue
+        if word == "AND":
+            continue
+        if word == "NOT":
+            negate_next = True
+            continue
+        negated = negate_next
+        negate_next = False
+        if word is not None and word.startswith("-") and len(word) > 1:
+            negated = True
+            word = word[1:]
+        tokens = tuple(tokenize(phrase if word is None else word))
+        if tokens:
+            groups[-1].append(Clause(tokens=tokens, negated=negated or bool(minus)))
+    for group in groups:
+        if not any(not clause.negated for clause in group):
+            raise ValueError(f"query must have at least one positive term in each OR group: {query!r}")
+    return groups
+
+
+@dataclasses.dataclass
+class SearchIndex:
+    """Inverted index over verse text.
+
+    Postings for each term are stored contiguously in document order. Document
+    IDs are delta-encoded within each term, and token positions are
+    delta-encoded within each posting.
+
+    Attributes:
+        documents: Array of document keys (e.g. "1 Ne. 3:7").
+        lengths: Array of document lengths (in tokens).
+        terms: Sorted array of terms.
+        term_offsets: Array of length len(terms) + 1; the postings for terms[i] are
+            in [term_offsets[i], term_offsets[i + 1]).
+        doc_deltas: Delta-encoded document IDs for each posting.
+        frequencies: Number of occurrences for each posting; the positions for the
+            postings of a term follow the same order.
+        position_deltas: Delta-encoded token positions.
+    """
+
+    documents: np.ndarray
+    lengths: np.ndarray
+    terms: np.ndarray
+    term_offsets: np.ndarray
+    doc_deltas: np.ndarray
+    frequencies: np.ndarray
+    position_deltas: np.ndarray
+
+    @classmethod
+    def from_texts(cls, documents: Iterable[str], texts: Iterable[str]) -> "SearchIndex":
+        """Builds an index.
+
+        Args:
+            documents: Document keys.
+            texts: Document texts (see graph_lib.prepare_text).
+
+        Returns:
+            SearchIndex.
+        """
+        documents = list(documents)
+        term_ids, doc_ids, positions, lengths = [], [], [], []
+        vocabulary = {}
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            term_ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in tokens)
+            doc_ids.extend([doc_id] * len(tokens))
+            positions.extend(range(len(tokens)))
+        terms = np.asarray(sorted(vocabulary))
+        # Map term IDs (in order of first appearance) to their ranks in sorted order.
+        ranks = np.empty(len(vocabulary), dtype=np.int64)
+        ranks[[vocabulary[term] for term in terms.tolist()]] = np.arange(len(vocabulary))
+        term_ids = ranks[np.asarray(term_ids, dtype=np.int64)]
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        positions = np.asarray(positions, dtype=np.int64)
+        order = np.lexsort((positions, doc_ids, term_ids))
+        term_ids, doc_ids, positions = term_ids[order], doc_ids[order], positions[order]
+        # Each (term, document) pair is one posting.
+        starts = np.flatnonzero(np.diff(term_ids, prepend=-1) | np.diff(doc_ids, prepend=-1))
+        posting_terms, posting_docs = term_ids[starts], doc_ids[starts]
+        frequencies = np.diff(np.append(starts, term_ids.size))
+        term_offsets = np.searchsorted(posting_terms, np.arange(len(terms) + 1))
+        # NOTE(kearnes): Every term has at least one posting, and the first document ID for each term is absolute.
+        doc_deltas = np.diff(posting_docs, prepend=0)
+        doc_deltas[term_offsets[:-1]] = posting_docs[term_offsets[:-1]]
+        position_deltas = np.diff(positions, prepend=0)
+        position_deltas[starts] = positions[starts]
+        return cls(
+            documents=np.asarray(documents),
+            lengths=np.asarray(lengths, dtype=np.uint16),
+            terms=terms,
+            term_offsets=term_offsets.astype(np.int64),
+            doc_deltas=doc_deltas.astype(np.uint32),
+            frequencies=frequencies.astype(np.uint16),
+            position_deltas=position_deltas.astype(np.uint16),
+        )
+
+    def save(self, filename: str) -> None:
+        """Writes the index to an (uncompressed, for fast loading) NPZ file."""
+        np.savez(filename, **{field.name: getattr(self, field.name) for field in dataclasses.fields(self)})
+
+    @classmethod
+    def load(cls, filename: str) -> "SearchIndex":
+        """Loads an index written by `save`."""
+        with np.load(filename) as data:
+            return cls(**{key: data[key] for key in data.files})
+
+    @functools.cached_property
+    def position_offsets(self) -> np.ndarray:
+        """Offsets of the positions for each posting."""
+        return np.concatenate([[0], np.cumsum(self.frequencies, dtype=np.int64)])
+
+    def get_postings(self, term: str) -> tuple[np.ndarray, np.ndarray, slice]:
+        """Decodes the postings for a term.
+
+        Returns:
+            doc_ids: Array of document IDs containing the term.
+            frequencies: Array of term frequencies in each document.
+            postings: Slice of the postings for the term.
+        """
+        index = np.searchsorted(self.terms, term)
+        if index == self.terms.size or self.terms[index] != term:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), slice(0, 0)
+        start, stop = self.term_offsets[index], self.term_offsets[index + 1]
+        doc_ids = np.cumsum(self.doc_deltas[start:stop], dtype=np.int64)
+        return doc_ids, self.frequencies[start:stop].astype(np.int64), slice(start, stop)
+
+    def get_positions(self, postings: slice) -> tuple[np.ndarray, np.ndarray]:
+        """Decodes the token positions for a range of postings.
+
+        Returns:
+            posting_ids: Array of posting indices (relative to `postings.start`) for each position.
+            positions: Array of token positions.
+        """
+        offsets = self.position_offsets[postings.start : postings.stop + 1]
+        deltas = self.position_deltas[offsets[0] : offsets[-1]].astype(np.int64)
+        totals = np.cumsum(deltas)
+        # Undo the cumulative sum across posting boundaries.
+        counts = np.diff(offsets)
+        bases = np.concatenate([[0], totals])[offsets[:-1] - offsets[0]]
+        return np.repeat(np.arange(counts.size), counts), totals - np.repeat(bases, counts)
+
+    def _match_clause(self, clause: Clause) -> np.ndarray:
+        """Returns the sorted document IDs matching a clause."""
+        if len(clause.tokens) == 1:
+            return self.get_postings(clause.tokens[0])[0]
+        # For phrases, intersect (document, start position) keys across the tokens.
+        max_length = int(self.lengths.max(initial=0)) + len(clause.tokens)
+        keys = None
+        for offset, token in enumerate(clause.tokens):
+            doc_ids, _, postings = self.get_postings(token)
+            if not doc_ids.size:
+                return doc_ids
+            posting_ids, positions = self.get_positions(postings)
+            token_keys = doc_ids[posting_ids] * max_length + positions - offset
+            keys = token_keys if keys is None else np.intersect1d(keys, token_keys, assume_unique=True)
+            if not keys.size:
+                return np.zeros(0, dtype=np.int64)
+        return np.unique(keys // max_length)
+
+    def _score(self, doc_ids: np.ndarray, tokens: Iterable[str]) -> np.ndarray:
+        """Computes BM25 scores for documents."""
+        scores = np.zeros(doc_ids.size)
+        lengths = self.lengths[doc_ids].astype(float)
+        average_length = self.lengths.mean() if self.lengths.size else 0.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (average_length or 1.0))
+        for token in tokens:
+            token_docs, frequencies, _ = self.get_postings(token)
+            if not token_docs.size:
+                continue
+            idf = np.log(1 + (self.documents.size - token_docs.size + 0.5) / (token_docs.size + 0.5))
+            index = np.clip(np.searchsorted(token_docs, doc_ids), 0, token_docs.size - 1)
+            term_frequencies = np.where(token_docs[index] == doc_ids, frequencies[index], 0)
+            scores += idf * term_frequencies * (BM25_K1 + 1) / (term_frequencies + norm)
+        return scores
+
+    def search(self, query: str, k: int = 20, offset: int = 0) -> tuple[list[tuple[str, float]], int]:
+        """Runs a query.
+
+        Args:
+            query: Query string; see the module docstring.
+            k: Maximum number of results.
+            offset: Number of top results to skip (for paging).
+
+        Returns:
+            results: List of (document, score) tuples, sorted by decreasing score (ties are broken by
+                document order).
+            total: Total number of matching documents.
+
+        Raises:
+            ValueError: If the query is invalid (see `parse_query`), `k` is not positive, or `offset` is negative.
+        """
+        if k < 1:
+            raise ValueError(f"k must be positive: {k}")
+        if offset < 0:
+            raise ValueError(f"offset must be non-negative: {offset}")
+        matches = []
+        for group in parse_query(query):
+            positive = sorted(
+                (self._match_clause(clause) for clause in group if not clause.negated), key=lambda ids: ids.size
+            )
+            doc_ids = positive[0]
+            for other in positive[1:]:
+                doc_ids = np.intersect1d(doc_ids, other, assume_unique=True)
+            for clause in group:
+                if clause.negated and doc_ids.size:
+                    doc_ids = np.setdiff1d(doc_ids, self._match_clause(clause), assume_unique=True)
+            tokens = dict.fromkeys(token for clause in group if not clause.negated for token in clause.tokens)
+            matches.append((doc_ids, self._score(doc_ids, tokens)))
+        doc_ids = np.concatenate([ids for ids, _ in matches])
+        scores = np.concatenate([scores for _, scores in matches])
+        # A document matching several OR groups keeps its best score.
+        order = np.lexsort((-scores, doc_ids))
+        doc_ids, scores = doc_ids[order], scores[order]
+        first = np.flatnonzero(np.diff(doc_ids, prepend=-1))
+        doc_ids, scores = doc_ids[first], scores[first]
+        ranked = np.lexsort((doc_ids, -scores))[offset : offset + k]
+        results = [(str(self.documents[i]), float(scores[j])) for i, j in zip(doc_ids[ranked], ranked)]
+        return results, int(doc_ids.size)
+
+
+class ReferenceIndex:
+    """Autocompletion index over verse keys.
+
+    Book aliases (see BOOK_ALIASES) are kept in a sorted array, so the books
+    matching a prefix are found with binary search. Verses are then enumerated in
+    Standard Works order, stopping as soon as enough results have been found.
+    """
+
+    def __init__(self, verses: Iterable[tuple[str, int, int]]):
+        """Initializes the index.
+
+        Args:
+            verses: (book, chapter, verse) tuples, where book is a short name (e.g. "1 Ne.").
+        """
+        chapters = collections.defaultdict(lambda: collections.defaultdict(list))
+        for book, chapter, verse in verses:
+            chapters[book][int(chapter)].append(int(verse))
+        self._chapters = {
+            book: {chapter: sorted(numbers) for chapter, numbers in sorted(book_chapters.items())}
+            for book, book_chapters in chapters.items()
+        }
+        aliases = {}
+        for name, book in scripture_graph.BOOKS_SHORT.items():
+            for alias in [name, book, *BOOK_ALIASES.get(book, [])]:
+                if book in self._chapters:
+                    aliases[normalize_reference(alias)] = book
+        self._aliases = sorted(aliases)
+        self._books = [aliases[alias] for alias in self._aliases]
+
+    def get_books(self, prefix: str) -> list[str]:
+        """Returns the books with an alias starting with a normalized prefix; exact matches come first."""
+        start = bisect.bisect_left(self._aliases, prefix)
+        stop = bisect.bisect_left(self._aliases, prefix + "\uffff")
+        exact = [self._books[start]] if start < stop and self._aliases[start] == prefix else []
+        others = sorted(set(self._books[start:stop]) - set(exact), key=scripture_graph.BOOK_ORDER.get)
+        return exact + others
+
+    def complete(self, text: str, k: int = 10) -> list[str]:
+        """Completes a partial reference.
+
+        Args:
+            text: Partial reference (e.g. "1 ne 3", "alma 32:2", or "D&C 13").
+            k: Maximum number of results.
+
+        Returns:
+            List of verse keys (e.g. "1 Ne. 3:7") in Standard Works order, with exact
+            chapter and verse matches first.
+
+        Raises:
+            ValueError: If `k` is not positive.
+        """
+        if k < 1:
+            raise ValueError(f"k must be positive: {k}")
+        match = re.fullmatch(r"(.*?)\s*(?:(\d+)\s*(?:(:)\s*(\d*))?)?", normalize_reference(text))
+        book_prefix, chapter_prefix, colon, verse_prefix = match.groups()
+        if not re.search(r"[a-z&]", book_prefix):
+            # Inputs like "1" or "2 " are the start of a book name.
+            book_prefix, chapter_prefix, colon = normalize_reference(text), None, None
+        if not book_prefix:
+            return []
+        results = itertools.chain.from_iterable(
+            self._iter_verses(book, chapter_prefix or "", verse_prefix or "", exact_chapter=bool(colon))
+            for book in self.get_books(book_prefix)
+        )
+        return list(itertools.islice(results, k))
+
+    def _iter_verses(self, book: str, chapter_prefix: str, verse_prefix: str, exact_chapter: bool) -> Iterator[str]:
+        """Yields the verses in a book that match chapter and verse prefixes."""
+        chapters = self._chapters[book]
+        if exact_chapter:
+            candidates = [int(chapter_prefix)] if int(chapter_prefix or -1) in chapters else []
+        else:
+            candidates = _match_numbers(chapters, chapter_prefix)
+        for chapter in candidates:
+            for verse in _match_numbers(chapters[chapter], verse_prefix):
+                yield f"{book} {chapter}:{verse}"
+
+
+def _match_numbers(numbers: Iterable[int], prefix: str) -> list[int]:
+    """Returns the numbers whose decimal representation starts with a prefix, with an exact match first."""
+    if not prefix:
+        return list(numbers)
+    matches = [number for number in numbers if str(number).startswith(prefix)]
+    return sorted(matches, key=lambda number: str(number) != prefix)
@@ -0,0 +1,116 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests for scripture_graph.search_lib."""
+import pytest
+
+from scripture_graph import search_lib
+
+
+@pytest.fixture(name="index")
+def index_fixture():
+    """Small search index."""
+    texts = {
+        "1 Ne. 3:7": "i will go and do the things which the lord hath commanded",
+        "Alma 32:21": "faith is not to have a perfect knowledge of things; hope for things which are not seen",
+        "Ether 12:6": "faith is things which are hoped for and are not seen",
+        "Moro. 7:41": "ye shall have hope through the atonement of christ",
+        "2 Ne. 31:20": "press forward with a steadfastness in christ, having a perfect brightness of hope",
+    }
+    return search_lib.SearchIndex.from_texts(texts.keys(), texts.values())
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("faith", ["Ether 12:6", "Alma 32:21"]),
+        ("hope christ", ["Moro. 7:41", "2 Ne. 31:20"]),
+        ('"not seen"', ["Ether 12:6", "Alma 32:21"]),
+        ('"seen not"', []),
+        ("faith -knowledge", ["Ether 12:6"]),
+        ("faith NOT knowledge", ["Ether 12:6"]),
+        ("commanded OR atonement", ["1 Ne. 3:7", "Moro. 7:41"]),
+        ("Hope Perfect", ["Alma 32:21", "2 Ne. 31:20"]),
+        ("missing", []),
+    ],
+)
+def test_search(index, query, expected):
+    results, total = index.search(query)
+    assert sorted(verse for verse, _ in results) == sorted(expected)
+    assert total == len(expected)
+    scores = [score for _, score in results]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_search_ranking(index):
+    # "things" appears twice in Alma 32:21; otherwise shorter verses rank higher.
+    results, _ = index.search("things")
+    assert [verse for verse, _ in results] == ["Alma 32:21", "Ether 12:6", "1 Ne. 3:7"]
+    assert index.search("things", k=1, offset=1)[0] == results[1:2]
+
+
+@pytest.mark.parametrize("query", ["", "-faith", "faith OR -hope"])
+def test_search_invalid(index, query):
+    with pytest.raises(ValueError, match="at least one positive term"):
+        index.search(query)
+
+
+@pytest.mark.parametrize("k,offset", [(0, 0), (-1, 0), (1, -1)])
+def test_search_invalid_page(index, k, offset):
+    with pytest.raises(ValueError, match="must be"):
+        index.search("things", k=k, offset=offset)
+
+
+def test_save_load(index, tmp_path):
+    filename = (tmp_path / "search.npz").as_posix()
+    index.save(filename)
+    loaded = search_lib.SearchIndex.load(filename)
+    assert loaded.search('"perfect knowledge"') == index.search('"perfect knowledge"')
+
+
+@pytest.fixture(name="references")
+def references_fixture():
+    """Small reference index."""
+    verses = [("1 Ne.", 3, verse) for verse in range(1, 32)]
+    verses += [("1 Ne.", chapter, 1) for chapter in [1, 30]]
+    verses += [("1 Jn.", 1, 1), ("John", 3, 16), ("D&C", 13, 1), ("JS—H", 1, 19), ("Moses", 1, 39), ("Mosiah", 2, 17)]
+    return search_lib.ReferenceIndex(verses)
+
+
+@pytest.mark.parametrize(
+    "text,expected",
+    [
+        ("1 ne 3:7", ["1 Ne. 3:7"]),
+        ("1ne. 3:3", ["1 Ne. 3:3", "1 Ne. 3:30", "1 Ne. 3:31"]),
+        ("1 Nephi 3", ["1 Ne. 3:1", "1 Ne. 3:2", "1 Ne. 3:3"]),
+        ("1 ne 3:", ["1 Ne. 3:1", "1 Ne. 3:2", "1 Ne. 3:3"]),
+        ("1 ne", ["1 Ne. 1:1", "1 Ne. 3:1", "1 Ne. 3:2"]),
+        ("1", ["1 Jn. 1:1", "1 Ne. 1:1", "1 Ne. 3:1"]),
+        ("D&C 13", ["D&C 13:1"]),
+        ("dc 1", ["D&C 13:1"]),
+        ("js-h 1:1", ["JS—H 1:19"]),
+        ("john", ["John 3:16"]),
+        ("mos", ["Mosiah 2:17", "Moses 1:39"]),
+        ("1 jn", ["1 Jn. 1:1"]),
+        ("alma", []),
+        ("1 ne 4:1", []),
+        ("", []),
+    ],
+)
+def test_complete(references, text, expected):
+    assert references.complete(text, k=3) == expected
+
+
+def test_complete_invalid(references):
+    with pytest.raises(ValueError, match="must be positive"):
+        references.complete("1 ne", k=0)
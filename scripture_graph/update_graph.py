@@ -0,0 +1,206 @@
+# Copyright 2020-2022 Steven Kearnes
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Incrementally updates a scripture graph and its artifacts after EPUB revisions.
+
+Usage:
+    update_graph.py --input_pattern=<str> --records=<str> --graph=<str> [options]
+
+Options:
+    --input_pattern=<str>   Input EPUB pattern.
+    --records=<str>         Records directory written by build_graph.py --records (updated in place).
+    --graph=<str>           Graph written by the previous build (updated in place).
+    --connections=<str>     Connections JSON written by build_connections.py (patched in place).
+    --index=<str>           Adjacency index; rewritten if any edges changed.
+    --layouts=<str>         Neighborhood layouts; rewritten if any edges changed.
+    --search_index=<str>    Full-text search index; rewritten if any verses changed.
+    --topic_index=<str>     Verse x topic index; rewritten if any topic references changed.
+    --tree=<str>            Navigation tree; rewritten if any verses were added or removed.
+    --rollups=<str>         Rollup graphs; rewritten if any edges changed.
+    --verify                Compare the updated graph (and connections) to a clean build.
+
+Only EPUBs whose digests differ from the records are reparsed, and suggested
+edges are recomputed only for the affected verses (see incremental_lib). The
+build options (topics, suggested edges, threshold, etc.) are read from the
+records, so updates always match the original build settings. Derived node
+attributes (centrality, components, and communities) depend on the whole graph
+and are recomputed, with centrality warm-started from the previous graph.
+"""
+import glob
+import json
+import logging
+from typing import Any, Optional
+
+import docopt
+import networkx as nx
+
+from scripture_graph import build_connections
+from scripture_graph import build_graph
+from scripture_graph import explorer_lib
+from scripture_graph import graph_lib
+from scripture_graph import incremental_lib
+from scripture_graph import layout_lib
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Maximum number of differences to log in --verify mode.
+MAX_REPORTED_DIFFERENCES = 50
+
+
+def update(
+    graph: nx.DiGraph, records: incremental_lib.BuildRecords, old: nx.DiGraph, new: nx.DiGraph
+) -> tuple[incremental_lib.GraphDiff, set[str]]:
+    """Applies the changes between two canonical graphs to a graph (in place).
+
+    Args:
+        graph: Graph from the previous build.
+        records: BuildRecords; the stored embeddings are updated.
+        old: Canonical graph for the previous records.
+        new: Canonical graph for the updated records.
+
+    Returns:
+        GraphDiff and the set of verses whose connections may have changed.
+    """
+    diff = incremental_lib.diff_graphs(old, new)
+    logger.info(diff)
+    if not diff:
+        return diff, set()
+    previous = graph_lib.read_centrality(graph) if records.options["centrality"] else None
+    incremental_lib.apply_diff(graph, new, diff)
+    touched = incremental_lib.get_touched_verses(old, new, diff)
+    logger.info(f"Canonical neighborhoods changed for {len(touched)} verses")
+    affected = set(touched)
+    if records.options["suggested"]:
+        revised = {node for node in diff.added_nodes | diff.changed_nodes if graph.nodes[node]["kind"] == "verse"}
+        affected |= incremental_lib.update_jaccard_edges(graph, touched)
+        embeddings = records.update_embeddings(graph, revised)
+        affected |= incremental_lib.update_use_edges(graph, touched | revised, embeddings, records.options["threshold"])
+    # NOTE(kearnes): Neighbor lists are ordered by in-degree, so neighbors of touched verses may be reordered.
+    for node in touched:
+        affected.update(graph.predecessors(node))
+        affected.update(graph.successors(node))
+    incremental_lib.add_derived_attributes(graph, records.options, previous=previous)
+    return diff, {node for node in affected if node in graph and graph.nodes[node]["kind"] == "verse"}
+
+
+def patch_connections(connections: explorer_lib.Connections, graph: nx.DiGraph, verses: set[str]) -> None:
+    """Updates connections (in place) for a set of verses.
+
+    Derived node attributes are refreshed for every verse.
+
+    Args:
+        connections: Dict of connections keyed by verse.
+        graph: Updated graph without topic nodes.
+        verses: Verses whose connections may have changed.
+    """
+    for verse in set(connections) - set(graph.nodes):
+        del connections[verse]
+    connections.update(build_connections.get_connections(graph, verses=sorted(verses)))
+    for verse, data in connections.items():
+        for name in incremental_lib.DERIVED_ATTRIBUTES:
+            data.pop(name, None)
+        data.update(build_connections.get_derived_attributes(graph.nodes[verse]))
+
+
+def write_artifacts(graph: nx.DiGraph, diff: incremental_lib.GraphDiff, affected: set[str], **kwargs) -> None:
+    """Patches or rewrites the artifacts affected by an update."""
+    verses_changed = any(
+        node in graph and graph.nodes[node]["kind"] == "verse" for node in diff.added_nodes | diff.changed_nodes
+    ) or bool(diff.removed_nodes)
+    edges_changed = bool(diff.added_edges or diff.removed_edges or diff.added_nodes or diff.removed_nodes or affected)
+    verse_graph = graph.copy()
+    graph_lib.remove_topic_nodes(verse_graph)
+    connections = None
+    if kwargs["--connections"]:
+        with open(kwargs["--connections"], encoding="utf-8") as f:
+            connections = json.load(f)
+        logger.info(f"Patching connections for {len(affected)} verses")
+        patch_connections(connections, verse_graph, affected)
+        with open(kwargs["--connections"], "w", encoding="utf-8") as f:
+            json.dump(connections, f, indent=2)
+    if kwargs["--index"] and edges_changed:
+        graph_lib.Adjacency.from_graph(verse_graph).save(kwargs["--index"])
+    if kwargs["--layouts"] and edges_changed:
+        if connections is None:
+            connections = build_connections.get_connections(verse_graph)
+        layout_lib.Layouts.from_connections(connections).save(kwargs["--layouts"])
+    if kwargs["--search_index"] and verses_changed:
+        if connections is None:
+            connections = build_connections.get_connections(verse_graph)
+        build_connections.get_search_index(verse_graph, connections).save(kwargs["--search_index"])
+    if kwargs["--topic_index"] and edges_changed:
+        graph_lib.TopicIndex.from_graph(graph).save(kwargs["--topic_index"])
+    if kwargs["--tree"] and (diff.added_nodes or diff.removed_nodes):
+        graph_lib.write_tree(graph, kwargs["--tree"])
+    if kwargs["--rollups"] and edges_changed:
+        graph_lib.write_rollups(graph, kwargs["--rollups"])
+
+
+def verify(graph: nx.DiGraph, filenames: list[str], options: dict[str, Any], connections_filename: Optional[str]):
+    """Compares an updated graph (and connections) to a clean build.
+
+    Raises:
+        RuntimeError: If the updated graph differs from a clean build.
+    """
+    logger.info("Running a clean build for verification")
+    records = incremental_lib.BuildRecords(options=options)
+    for filename in filenames:
+        records.add(filename)
+    expected = graph_lib.assemble_graph(records.get_scripture_graph(), include_topics=options["topics"])
+    if options["suggested"]:
+        graph_lib.add_jaccard_edges(expected)
+        graph_lib.add_use_edges(expected, options["threshold"])
+    incremental_lib.add_derived_attributes(expected, options)
+    differences = incremental_lib.compare_graphs(expected, graph)
+    if connections_filename:
+        with open(connections_filename, encoding="utf-8") as f:
+            connections = json.load(f)
+        graph_lib.remove_topic_nodes(expected)
+        for verse, data in build_connections.get_connections(expected).items():
+            actual = dict(connections.get(verse, {}))
+            for name in incremental_lib.DERIVED_ATTRIBUTES:
+                data.pop(name, None)
+                actual.pop(name, None)
+            if data != actual:
+                differences.append(f"connections differ for {verse}")
+        differences.extend(f"extra connections for {verse}" for verse in sorted(set(connections) - set(expected)))
+    for difference in differences[:MAX_REPORTED_DIFFERENCES]:
+        logger.error(difference)
+    if differences:
+        raise RuntimeError(f"incremental update differs from a clean build ({len(differences)} differences)")
+    logger.info("Incremental update matches a clean build")
+
+
+def main(**kwargs) -> None:
+    filenames = sorted(glob.glob(kwargs["--input_pattern"]))
+    records = incremental_lib.BuildRecords.load(kwargs["--records"])
+    include_topics = records.options["topics"]
+    old = graph_lib.assemble_graph(records.get_scripture_graph(), include_topics=include_topics)
+    changed = records.update(filenames)
+    logger.info(f"Changed EPUBs: {changed}")
+    if changed:
+        new = graph_lib.assemble_graph(records.get_scripture_graph(), include_topics=include_topics)
+        graph = nx.read_graphml(kwargs["--graph"])
+        diff, affected = update(graph, records, old, new)
+        if diff:
+            build_graph.write_graph(graph, kwargs["--graph"])
+            write_artifacts(graph, diff, affected, **kwargs)
+        # NOTE(kearnes): Records are saved last, so a failed update is retried from the previous records.
+        records.save(kwargs["--records"])
+    if kwargs["--verify"]:
+        verify(nx.read_graphml(kwargs["--graph"]), filenames, records.options, kwargs["--connections"])
+
+
+if __name__ == "__main__":
+    main(**docopt.docopt(__doc__))
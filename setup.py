@@ -21,8 +21,10 @@ setup(
     packages=find_packages(),
     python_requires=">=3.9",
     install_requires=[
+        "brotli>=1.0.9",
         "cssselect>=1.1.0",
         "docopt>=0.6.2",
+        "jinja2>=3.0.0",
         "lxml>=4.6.2",
         "networkx>=2.5",
         "numpy>=1.19.2",